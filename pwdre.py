@@ -2,24 +2,33 @@
 
 # Author: Andrea Michlíková - xmichl11
 
+import time
+
+STARTED = time.perf_counter()  # Start of the interpreter is not included, imports of the modules below are
+
 import argparse
 import os
+import sys
 
 import src.shared as shared
-from src.program_task import run_cmd
-from src.hashcat_task import run_hashcat
-from src.zxcvbn_task import zxcvbn_for_target
+import src.profiler as profiler
+import src.metrics as metrics
 from src.files import delete_stats_folder, delete_log_file
-from src.latex import (
-    zxcvbn_recovered_tex,
-    zxcvbn_score_tex,
-    hashcat_tex,
-    program_tex,
-    program_hashcat_tex_table,
-    rules_tex_table,
-    wordlist_tex_table,
-)
-from src.analyze_files import analyze_rules, analyze_wordlist
+from src.stages import run_experiment
+
+# Modules that are slow to import, --timing-startup reports which of them a run loaded
+HEAVY_MODULES = ["zxcvbn", "jinja2", "psutil", "asyncio", "http.server", "multiprocessing.managers",
+                 "src.program_task", "src.hashcat_task", "src.zxcvbn_task", "src.latex", "src.similarity"]
+
+
+def print_startup(phases):
+    """Prints the duration of the startup phases and the heavy modules loaded by the run."""
+    print("Startup timing:")
+    for phase, start, end in zip(phases, [STARTED] + [t for _, t in phases], [t for _, t in phases]):
+        print(f"  {phase[0]:<14} {(end - start) * 1000:9.1f} ms")
+    print(f"  {'total':<14} {(phases[-1][1] - STARTED) * 1000:9.1f} ms")
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(f"  loaded modules: {', '.join(loaded) or 'none'}")
 
 
 # Parse command-line arguments
@@ -29,20 +38,58 @@ def parse_args():
     parser.add_argument("--delete-log", action="store_true", dest="delete_log", help="Deletes the log file before execution")
     parser.add_argument("--no-log", action="store_false", dest="log", help="Disables logging")
     parser.add_argument("-l", "--log-file", type=str, dest="log_file", help="Set the log file")
-    parser.add_argument("-c", "--config", type=str, required=True, help="Set the configuration file")
-    parser.set_defaults(delete_stats=False, delete_log=False, log=True, log_file=shared.DEFAULT_LOG_FILE)
-    return parser.parse_args()
+    parser.add_argument("-c", "--config", type=str, help="Set the configuration file")
+    parser.add_argument("--force", action="store_true", dest="force", help="Runs all stages even if their inputs did not change")
+    parser.add_argument("--coordinator", type=str, metavar="HOST:PORT", help="Distributes rule generation and Hashcat runs to workers")
+    parser.add_argument("--worker", type=str, metavar="HOST:PORT", help="Runs jobs from the coordinator at the given address")
+    parser.add_argument("--profile", type=str, nargs="?", const="", metavar="FOLDER",
+                        help="Saves a Chrome trace and a summary of the run (default folder: <stats_folder>/profile)")
+    parser.add_argument("--cprofile", action="store_true", help="With --profile also saves cProfile statistics of every stage")
+    parser.add_argument("--metrics", type=str, nargs="?", const="", metavar="FILE",
+                        help="Writes live metrics in the Prometheus text format (default: <stats_folder>/metrics.prom)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT", help="Serves live metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--plan", type=int, nargs="?", const=0, metavar="PARALLEL",
+                        help="Prints the jobs of the configuration with estimated costs without running them (default: parallel_runs)")
+    parser.add_argument("--baseline", type=str, metavar="FOLDER", help="Compares the statistics with a baseline folder, exits with 1 on regressions")
+    parser.add_argument("--watch", action="store_true", help="After the run evaluates new or changed rule files until it is interrupted")
+    parser.add_argument("--timing-startup", action="store_true", dest="timing_startup",
+                        help="Prints the time of imports, configuration and the run and the heavy modules that were loaded")
+    parser.set_defaults(delete_stats=False, delete_log=False, log=True, log_file=shared.DEFAULT_LOG_FILE, force=False)
+    args = parser.parse_args()
+    if not args.config and not args.worker:
+        parser.error("the following arguments are required: -c/--config")
+    if args.watch and (args.coordinator or args.worker):
+        parser.error("--watch cannot be used with --coordinator or --worker")
+    if (args.coordinator or args.worker) and not os.environ.get("PWDRE_AUTHKEY"):
+        parser.error("--coordinator and --worker need a secret key shared by all hosts in PWDRE_AUTHKEY")
+    return args
 
 
 def main():
-    # Parse input arguments and initialize global config
+    # Parse input arguments and create the experiment
+    phases = [("imports", time.perf_counter())]
     args = parse_args()
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    shared.initialize_shared(script_dir, args)
 
-    con = shared.CONFIG
-    con_stats = con.stats
-    program_table = False
+    # Workers get the configuration with every job from the coordinator
+    if args.worker:
+        from src.distributed import run_worker, get_authkey
+        run_worker(args.worker, script_dir, get_authkey())
+        return
+
+    exp = shared.initialize_shared(script_dir, args)
+    phases.append(("configuration", time.perf_counter()))
+
+    con = exp.config
+
+    # Regressions are checked only against fresh measurements, programs are not skipped by the log
+    exp.remeasure = bool(args.baseline or con.regression.baseline)
+
+    # Dry run, only the estimates of the jobs are printed
+    if args.plan is not None:
+        from src.plan import plan_experiment
+        plan_experiment(exp, args.plan)
+        return
 
     # Optionally delete previous statistics and log file
     if args.delete_stats:
@@ -50,53 +97,45 @@ def main():
     if args.delete_log:
         delete_log_file(args.log_file)
 
-    # Run programs and generate performance graphs
-    if (con_stats.time_passwords
-        or con_stats.memory_passwords
-        or con_stats.rules_passwords
-        or con_stats.cpu_passwords):
-        run_cmd()  # Execute the rule generation program
-        program_tex()  # Generate LaTeX graphs from results
-        program_table = True
-
-    # Run Hashcat and generate graph of recovered passwords
-    if con_stats.recovered_guesses:
-        run_hashcat()
-        hashcat_tex()
-        program_table = True if program_table else False
-    else:
-        program_table = False
-
-    # Evaluate rules with zxcvbn and generate statistics and graphs
-    if con_stats.zxcvbn_recovered or con_stats.zxcvbn_score:
-        if not con_stats.recovered_guesses:
-            shared.CONFIG.input.rules_size = [0]
-            run_hashcat()
-
-        zxcvbn_for_target()  # Run zxcvbn on passwords
-
-        # Generate graph for zxcvbn recovery stats
-        if con_stats.zxcvbn_recovered: 
-            zxcvbn_recovered_tex()  
-            
-        # Generate graph for zxcvbn score distribution
-        if con_stats.zxcvbn_score: 
-            zxcvbn_score_tex() 
-
-    if program_table:
-        program_hashcat_tex_table()
-
-    # Analyze generated rules and create LaTeX table
-    # if con_stats.analyze_rules:
-    #     analyze_rules()
-    #     rules_tex_table()
-
-    # Analyze wordlist and create LaTeX table
-    if con_stats.analyze_wordlist:
-        analyze_wordlist()
-        wordlist_tex_table()
+    # Profiling records the stages, program and Hashcat runs, subprocesses and log and CSV operations
+    profile_folder = None
+    if args.profile is not None:
+        profile_folder = args.profile or os.path.join(con.general.stats_folder, "profile")
+        profiler.enable(os.path.join(profile_folder, "stages") if args.cprofile else None)
+
+    # Live metrics of the run for dashboards, the file is replaced every few seconds
+    if args.metrics is not None or args.metrics_port:
+        metrics_file = None
+        if args.metrics is not None:
+            metrics_file = args.metrics or os.path.join(con.general.stats_folder, "metrics.prom")
+        metrics.enable(metrics_file, args.metrics_port)
+
+    # Run rule generation, Hashcat, zxcvbn, analyses and LaTeX outputs,
+    # stages whose inputs did not change since the last run are skipped
+    try:
+        if args.coordinator:
+            from src.distributed import run_coordinator, get_authkey
+            run_coordinator(exp, args.coordinator, get_authkey(), force=args.force)
+        elif args.watch:
+            from src.watch import watch_experiment
+            watch_experiment(exp, force=args.force)
+        else:
+            run_experiment(exp, force=args.force)
+    finally:
+        if profile_folder is not None:
+            profiler.save(profile_folder)
+        metrics.disable()
 
     print("The entire process has been completed.")
+    phases.append(("run", time.perf_counter()))
+    if args.timing_startup:
+        print_startup(phases)
+
+    # Compare the statistics with the baseline, regressions fail the run
+    if args.baseline or con.regression.baseline:
+        from src.regression import check_regressions
+        if check_regressions(exp, args.baseline):
+            sys.exit(1)
 
 
 if __name__ == "__main__":
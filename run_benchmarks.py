@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+# Author: Andrea Michlíková - xmichl11
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import src.store as store
+from src.config import Config, GeneralConfig, StatsConfig, InputConfig
+from src.shared import Experiment, initialize_filepaths
+from src.files import count_lines_in_file, load_passwords, create_size_file, save_to_file, get_stem
+from src.log import (
+    save_log,
+    log_command,
+    has_command_run,
+    get_command_hash,
+    is_program_record_in_csv,
+    is_hashcat_record_in_csv,
+    is_file_record_in_csv,
+)
+from src.analyze_files import analyze_wordlist
+from src.zxcvbn_task import analyze_passwords
+
+# Folder with the bundled dictionaries
+DICTIONARIES = "experiments_dictionaries"
+
+# Parameters with the size of a synthetic input, measurements over several sizes form a growth curve
+SIZE_PARAMS = ("entries", "rows")
+
+
+def parse_arguments():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmarks of the PWDRE hot paths.")
+    parser.add_argument("-o", "--output", type=str, default="benchmark_results.json", help="JSON file with the results")
+    parser.add_argument("-d", "--dictionaries", type=str, default=DICTIONARIES, help="Folder with the dictionaries")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of repetitions of every measurement")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="Numbers of entries of the synthetic logs and CSV files")
+    parser.add_argument("--zxcvbn-limit", type=int, default=2000, help="Number of passwords analyzed by zxcvbn per file")
+    parser.add_argument("--only", type=str, nargs="+", default=[],
+                        help="Runs only these groups: count_lines_in_file, load_passwords, analyze_wordlist, analyze_passwords, log, csv")
+    parser.add_argument("--compare", type=str, help="JSON file of an earlier run to compare with")
+    return parser.parse_args()
+
+
+def create_experiment(folder):
+    """Creates an experiment that keeps its log and statistics in a scratch folder."""
+    config = Config(programs=[], general=GeneralConfig(stats_folder=folder), stats=StatsConfig(), input=InputConfig())
+    initialize_filepaths(config)
+    return Experiment(config=config, script_dir=os.getcwd(), log=True, log_file=os.path.join(folder, "log.json"),
+                      temp_folder=os.path.join(folder, "temp", ""))
+
+
+def measure(func, repeat):
+    """Runs a function 'repeat' times and returns the times in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class Suite:
+    """Collects the results of the benchmarks."""
+
+    def __init__(self, repeat, only):
+        self.repeat = repeat
+        self.only = only
+        self.results = []
+
+    def enabled(self, name):
+        return not self.only or name in self.only
+
+    def add(self, name, times, items, unit, **params):
+        """Saves the times of a benchmark, the throughput is computed from the median time."""
+        median = statistics.median(times)
+        result = {
+            "name": name,
+            "params": params,
+            "times": [round(t, 6) for t in times],
+            "median": round(median, 6),
+            "min": round(min(times), 6),
+            "items": items,
+            "throughput": round(items / median, 2) if median else None,
+            "unit": unit,
+        }
+        self.results.append(result)
+        details = " ".join(f"{key}={value}" for key, value in params.items())
+        print(f"{name:<22} {details:<45} {median * 1000:>10.2f} ms {result['throughput'] or 0:>14,.0f} {unit}")
+        return result
+
+
+########################################################################### Files
+def bench_count_lines(suite, files):
+    for file in files:
+        lines = count_lines_in_file(file)
+        times = measure(lambda: count_lines_in_file(file), suite.repeat)
+        suite.add("count_lines_in_file", times, lines, "lines/s", file=os.path.basename(file),
+                  mb=round(os.path.getsize(file) / 2 ** 20, 2))
+
+
+def bench_load_passwords(suite, files, folder):
+    for file in files:
+        passwords = load_passwords(file)
+        times = measure(lambda: load_passwords(file), suite.repeat)
+        suite.add("load_passwords", times, len(passwords), "lines/s", file=os.path.basename(file))
+
+        # Random sampling of the wordlist sizes, every repetition writes to a new folder
+        size = min(10000, len(passwords))
+        counter = iter(range(suite.repeat))
+        times = measure(lambda: create_size_file(os.path.join(folder, f"sample_{next(counter)}"), get_stem(file), passwords, size),
+                        suite.repeat)
+        suite.add("sample_passwords", times, size, "lines/s", file=os.path.basename(file), size=size)
+
+
+def bench_analyze_wordlist(suite, files, folder):
+    for file in files:
+        lines = count_lines_in_file(file)
+        times = []
+        for n in range(suite.repeat):
+            # A new statistics folder, otherwise the wordlist is already in the CSV file
+            exp = create_experiment(os.path.join(folder, f"wordlist_{n}"))
+            exp.wordlist_list = [file]
+            times += measure(lambda: analyze_wordlist(exp), 1)
+            store.close(exp)
+        suite.add("analyze_wordlist", times, lines, "lines/s", file=os.path.basename(file))
+
+
+def bench_analyze_passwords(suite, files, folder, limit):
+    for file in files:
+        passwords = load_passwords(file)[:limit]
+        sample = os.path.join(folder, f"zxcvbn_{get_stem(file)}.txt")
+        save_to_file(sample, "\n".join(passwords))
+        times = measure(lambda: analyze_passwords(sample), suite.repeat)
+        suite.add("analyze_passwords", times, len(passwords), "passwords/s", file=os.path.basename(file))
+
+
+########################################################################### Log and CSV
+def synthetic_log(size):
+    """Creates a log with 'size' finished program runs."""
+    log = {}
+    for i in range(size):
+        cmd = f"python3 programs/generator.py wordlist_{i}.txt rules/rules_{i}.rule"
+        log[get_command_hash(cmd)] = {
+            "command": cmd,
+            "status": "done",
+            "rule_file": f"rules/rules_{i}.rule",
+            "stats": {"wordlist": f"wordlist_{i}.txt", "wordlist_size": "10000", "time": "1.00",
+                      "memory": "10.00", "cpu": "99.00", "rule_size": "1000"},
+        }
+    return log
+
+
+def bench_log(suite, sizes, folder):
+    for size in sizes:
+        exp = create_experiment(os.path.join(folder, f"log_{size}"))
+        save_log(exp, synthetic_log(size))
+        cmd = f"python3 programs/generator.py wordlist_{size // 2}.txt rules/rules_{size // 2}.rule"
+
+        times = measure(lambda: has_command_run(exp, cmd), suite.repeat)
+        suite.add("has_command_run", times, 1, "calls/s", entries=size)
+
+        counter = iter(range(suite.repeat))
+        times = measure(lambda: log_command(exp, f"new command {next(counter)}", "done", time="1.00"), suite.repeat)
+        suite.add("log_command", times, 1, "calls/s", entries=size)
+
+
+def synthetic_csv(exp, size):
+    """Creates program, Hashcat and zxcvbn CSV files with 'size' rows."""
+    header = {table: ",".join(store.get_header(table)) for table in ("program", "hashcat", "zxcvbn_score")}
+    program = [f"Gen,0,rules/rules_{i}.rule,wordlist_{i}.txt,1000,1.00,10.00,99.00,100,1,,,,,,,done,,,," for i in range(size)]
+    hashcat = [f"rules/rules_{i}.rule,1000,attack.txt,5000,target.txt,5000000,2.50,done,," for i in range(size)]
+    score = [f"rules/rules_{i}.rule,2.50,1,2,3,4,5" for i in range(size)]
+    for table, rows in (("program", program), ("hashcat", hashcat), ("zxcvbn_score", score)):
+        save_to_file(store.get_csv_path(exp, table), "\n".join([header[table]] + rows) + "\n")
+
+
+def bench_csv(suite, sizes, folder):
+    for size in sizes:
+        exp = create_experiment(os.path.join(folder, f"csv_{size}"))
+        synthetic_csv(exp, size)
+        hit, miss = size // 2, size + 1
+        con_stats = exp.config.stats
+
+        # First check imports the CSV files into the results store
+        times = measure(lambda: store.import_csv(exp, "program"), suite.repeat)
+        suite.add("import_csv", times, size, "rows/s", rows=size)
+
+        for name, check in (
+            ("is_program_record", lambda n: is_program_record_in_csv(exp, f"rules/rules_{n}.rule", f"wordlist_{n}.txt")),
+            ("is_hashcat_record", lambda n: is_hashcat_record_in_csv(exp, f"rules/rules_{n}.rule", 1000, "attack.txt", "target.txt")),
+            ("is_file_record", lambda n: is_file_record_in_csv(exp, con_stats.zxcvbn_score_csv_file, "file_name", f"rules/rules_{n}.rule")),
+        ):
+            check(hit)  # Synchronizes the table
+            for kind, n in (("hit", hit), ("miss", miss)):
+                times = measure(lambda: check(n), suite.repeat)
+                suite.add(name, times, 1, "calls/s", rows=size, lookup=kind)
+        store.close(exp)
+
+
+########################################################################### Report
+def get_commit():
+    """Returns the current git commit, or None outside of a repository."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def growth_slope(points):
+    """Returns the least-squares slope of log(time) over log(size) for (size, time) points,
+    about 0 for a constant time, 1 for a linear growth and 2 for a quadratic one.
+    """
+    xs = [math.log(size) for size, _ in points]
+    ys = [math.log(median) for _, median in points]
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx if sxx else None
+
+
+def growth_curves(results):
+    """Groups the measurements of synthetic inputs by name and the other parameters into curves over the sizes.
+    Every curve has the median time and throughput per size and the log-log slope of the time.
+    """
+    grouped = defaultdict(list)
+    for result in results:
+        size_param = next((param for param in SIZE_PARAMS if param in result["params"]), None)
+        if size_param and result["median"]:
+            params = {key: value for key, value in result["params"].items() if key != size_param}
+            grouped[(result["name"], json.dumps(params, sort_keys=True), size_param)].append(result)
+
+    curves = []
+    for (name, params, size_param), group in grouped.items():
+        if len(group) < 2:
+            continue
+        group.sort(key=lambda result: result["params"][size_param])
+        points = [{"size": result["params"][size_param], "median": result["median"], "throughput": result["throughput"]}
+                  for result in group]
+        slope = growth_slope([(point["size"], point["median"]) for point in points])
+        curves.append({"name": name, "params": json.loads(params), "size_param": size_param, "points": points,
+                       "slope": None if slope is None else round(slope, 3)})
+    return curves
+
+
+def print_curves(curves):
+    """Prints the median time of every curve per size and its slope."""
+    if not curves:
+        return
+    print("\nGrowth over the sizes (median ms per size, slope of log time over log size):")
+    for curve in curves:
+        details = " ".join(f"{key}={value}" for key, value in curve["params"].items())
+        times = "  ".join(f"{point['size']}: {point['median'] * 1000:.3f}" for point in curve["points"])
+        slope = "-" if curve["slope"] is None else f"{curve['slope']:.2f}"
+        print(f"{curve['name']:<22} {details:<20} {times}  slope {slope}")
+
+
+def curve_key(curve):
+    return curve["name"], json.dumps(curve["params"], sort_keys=True)
+
+
+def compare_results(results, curves, compare_file):
+    """Prints the speedup of every benchmark and the change of the growth slopes against an earlier run."""
+    with open(compare_file) as f:
+        earlier = json.load(f)
+    previous = {result_key(result): result for result in earlier["results"]}
+    print(f"\nComparison with {compare_file} (commit {earlier.get('commit')}):")
+    for result in results:
+        old = previous.get(result_key(result))
+        if old and result["median"]:
+            details = " ".join(f"{key}={value}" for key, value in result["params"].items())
+            print(f"{result['name']:<22} {details:<45} {old['median'] / result['median']:>8.2f}x")
+
+    previous_curves = {curve_key(curve): curve for curve in earlier.get("curves", [])}
+    for curve in curves:
+        old = previous_curves.get(curve_key(curve))
+        if old and old["slope"] is not None and curve["slope"] is not None:
+            details = " ".join(f"{key}={value}" for key, value in curve["params"].items())
+            print(f"{curve['name']:<22} {details:<45} slope {old['slope']:.2f} -> {curve['slope']:.2f}")
+
+
+def main():
+    args = parse_arguments()
+    files = sorted(os.path.join(args.dictionaries, name) for name in os.listdir(args.dictionaries)
+                   if os.path.isfile(os.path.join(args.dictionaries, name)))
+    suite = Suite(args.repeat, args.only)
+    folder = tempfile.mkdtemp(prefix="pwdre_bench_")
+    random.seed(0)
+
+    try:
+        if suite.enabled("count_lines_in_file"):
+            bench_count_lines(suite, files)
+        if suite.enabled("load_passwords"):
+            bench_load_passwords(suite, files, folder)
+        if suite.enabled("analyze_wordlist"):
+            bench_analyze_wordlist(suite, files, folder)
+        if suite.enabled("analyze_passwords"):
+            bench_analyze_passwords(suite, files, folder, args.zxcvbn_limit)
+        if suite.enabled("log"):
+            bench_log(suite, args.sizes, folder)
+        if suite.enabled("csv"):
+            bench_csv(suite, args.sizes, folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    curves = growth_curves(suite.results)
+    print_curves(curves)
+
+    output = {
+        "commit": get_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "results": suite.results,
+        "curves": curves,
+    }
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=4)
+    print(f"Benchmark results saved to {args.output}")
+
+    if args.compare:
+        compare_results(suite.results, curves, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,24 @@
 # Author: Andrea Michlíková - xmichl11
 
 from collections import defaultdict
-import statistics
 import math
 import string
 from src.log import rules_to_csv, is_file_record_in_csv, wordlist_to_csv
-from src.files import get_rules_list
+from src.files import get_rules_list, open_input
+from src.sketch import HyperLogLog, QuantileSketch, histogram_mean, histogram_median
 import src.shared as shared
 
-def analyze_rules():
+def analyze_rules(exp):
     """Analyzes rule files to count occurrences of specific rules."""
-    rules_files = get_rules_list()
+    rules_files = get_rules_list(exp)
     rule_order = shared.RULE_ORDER.keys()
     rule_counts = defaultdict(int, {rule: 0 for rule in rule_order})
 
     for rule_file in rules_files:
         line_lengths = []
-        if is_file_record_in_csv(shared.CONFIG.stats.rules_csv_file, "rule_file", rule_file):
+        if is_file_record_in_csv(exp, exp.config.stats.rules_csv_file, "rule_file", rule_file):
             continue
-        with open(rule_file, "r", encoding="utf-8") as file:
+        with open_input(rule_file) as file:
             for line in file:
                 # Split the line by spaces to get individual rules
                 if not line or line[0] == "#":
@@ -33,7 +33,7 @@ def analyze_rules():
                         continue
                     rule_counts[general_rule] += 1
 
-        rules_to_csv(rule_file, rule_order, rule_counts)
+        rules_to_csv(exp, rule_file, rule_order, rule_counts)
 
 #############################################################
 def find_charset(password):
@@ -108,26 +108,32 @@ def analyze_password(password, charset_counts):
     return length, entropy, is_ascii
 
 
-def analyze_wordlist():
-    """Analyzes all wordlists in the shared configuration."""
-    for wl_path in shared.WORDLIST_LIST:
-        if is_file_record_in_csv(shared.CONFIG.stats.wordlist_csv_file, "wordlist", wl_path):
-            return
+def analyze_wordlist(exp):
+    """Analyzes all wordlists in the shared configuration.
+    Statistics are collected in a single pass with fixed memory, so the size of the wordlist does not matter.
+    """
+    for wl_path in exp.wordlist_list:
+        if is_file_record_in_csv(exp, exp.config.stats.wordlist_csv_file, "wordlist", wl_path):
+            continue
         wl_size = 0
-        lengths = []
-        entropies = [] 
+        length_counts = defaultdict(int)  # Exact histogram of password lengths
+        entropy_sum = 0.0
+        entropy_sketch = QuantileSketch()  # Approximate entropy quantiles
+        distinct = HyperLogLog()  # Approximate number of distinct passwords
         entropy_above = 0  # Number of passwords with entropy above 75
         charset_counts = defaultdict(int, {key: 0 for key in shared.CHARSET.keys()})
         ascii = 0
 
-        with open(wl_path, "r", encoding="utf-8", errors="replace") as file:
+        with open_input(wl_path) as file:
             for line in file:
                 line = line.rstrip("\n")
                 wl_size += 1
 
                 len, entropy, is_ascii = analyze_password(line, charset_counts)
-                lengths.append(len)
-                entropies.append(entropy)
+                length_counts[len] += 1
+                entropy_sum += entropy
+                entropy_sketch.add(entropy)
+                distinct.add(line)
 
                 if is_ascii:
                     ascii += 1
@@ -135,12 +141,15 @@ def analyze_wordlist():
                 if entropy >= 75:
                     entropy_above += 1
 
-        median_len = round(statistics.median(lengths) if lengths else 0)
-        avg_len = round(statistics.mean(lengths) if lengths else 0, 2)
+        median_len = round(histogram_median(length_counts))
+        avg_len = round(histogram_mean(length_counts), 2)
 
-        avg_entropy = round(statistics.mean(entropies) if entropies else 0, 2)
+        avg_entropy = round(entropy_sum / wl_size if wl_size else 0, 2)
+        entropy_p90 = round(entropy_sketch.quantile(0.90), 2)
+        entropy_p99 = round(entropy_sketch.quantile(0.99), 2)
 
         wordlist_to_csv(
+            exp,
             wl_path,
             wl_size,
             avg_len,
@@ -149,4 +158,7 @@ def analyze_wordlist():
             entropy_above,
             ascii,
             charset_counts,
+            distinct.count(),
+            entropy_p90,
+            entropy_p99,
         )
@@ -0,0 +1,401 @@
+# Author: Andrea Michlíková - xmichl11
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import psutil
+
+from src.profiler import span
+
+# Script that starts measured commands, see src/launcher.py
+LAUNCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "launcher.py")
+
+# Interval of memory measurement for the memory budget in seconds
+SAMPLE_INTERVAL = 0.1
+
+# Seconds between SIGTERM and SIGKILL when a process is stopped
+KILL_GRACE = 5
+
+# Maximal number of bytes moved between two stages of a pipeline at once
+PIPE_CHUNK = 2 ** 16
+
+# Maximal length of one output line in bytes
+LINE_LIMIT = 2 ** 20
+
+# Shell builtins that change the state of the shell, a command with them is not split into separate processes
+SHELL_STATE_BUILTINS = {"cd", "pushd", "popd", "export", "unset", "set", "source", ".", "exec", "alias", "ulimit", "umask"}
+
+
+@dataclass
+class RunResult:
+    returncode: Optional[int] = None  # Exit code of the process
+    stdout: str = ""  # Captured standard output
+    stderr: str = ""  # Captured standard error output
+    elapsed: float = 0.0  # Wall time in seconds
+    memory: float = 0.0  # Peak memory of the largest process in MB
+    cpu: float = 0.0  # CPU time of the processes divided by the wall time in percent
+    timed_out: bool = False  # The process was stopped after the time limit
+    matched: Optional[str] = None  # Output pattern that stopped the process
+    exceeded: Optional[str] = None  # Budget that stopped the process, "time" or "memory"
+    stages: List["StageResult"] = field(default_factory=list)  # Stages of a split pipeline
+
+
+@dataclass
+class StageResult:
+    cmd: str  # Command of the stage
+    elapsed: float = 0.0  # Wall time from the start of the pipeline to the end of the stage in seconds
+    cpu_time: float = 0.0  # User and system CPU time of the stage and its children in seconds
+    memory: float = 0.0  # Peak memory of the largest process of the stage in MB
+    bytes: int = 0  # Bytes the stage passed to the next stage, the output size for the last stage
+    returncode: Optional[int] = None  # Exit code of the stage
+
+
+class Process:
+    """A shell command started in its own session, so the whole tree can be stopped.
+    The process is reaped from the event loop when its pidfd becomes readable, without a thread per process.
+    A measured command is started by the launcher, which reports the peak memory and the CPU time
+    of the command together with all its descendants, even the short-lived ones.
+    """
+
+    def __init__(self, cmd, cwd, stdin=None, stdout=subprocess.PIPE, measure=False):
+        self.returncode = None
+        self.rusage = None  # Resource usage of the process and its children
+        self.usage = None  # Peak memory in kB and CPU time in seconds of the command reported by the launcher
+        self.report_fd = None
+        if measure:
+            self.report_fd, report_write = os.pipe()
+            args = [sys.executable, "-S", LAUNCHER, str(report_write), cmd]
+            try:
+                self.popen = subprocess.Popen(args, cwd=cwd, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE,
+                                              start_new_session=True, pass_fds=(report_write,))
+            finally:
+                os.close(report_write)
+        else:
+            self.popen = subprocess.Popen(cmd, shell=True, cwd=cwd, stdin=stdin, stdout=stdout,
+                                          stderr=subprocess.PIPE, start_new_session=True)
+        self.pid = self.popen.pid
+        self.loop = asyncio.get_running_loop()
+        self.exited = self.loop.create_future()
+        try:
+            self.pidfd = os.pidfd_open(self.pid)
+            self.loop.add_reader(self.pidfd, self.poll)
+        except (AttributeError, OSError):
+            self.pidfd = None  # Without pidfd support the process is polled
+            self.poll()
+
+    def poll(self):
+        pid, status, rusage = os.wait4(self.pid, os.WNOHANG)
+        if pid == 0:
+            if self.pidfd is None:
+                self.loop.call_later(SAMPLE_INTERVAL, self.poll)
+            return
+        self.rusage = rusage
+        # Popen must not wait for the process, it is already reaped
+        self.returncode = self.popen.returncode = os.waitstatus_to_exitcode(status)
+        if self.pidfd is not None:
+            self.loop.remove_reader(self.pidfd)
+            os.close(self.pidfd)
+        if self.report_fd is not None:
+            self.read_report()
+        if not self.exited.done():
+            self.exited.set_result(self.returncode)
+
+    def read_report(self):
+        # The launcher has exited, so the pipe is closed and the read does not block.
+        # A killed launcher reports nothing, its command is not measured.
+        with os.fdopen(self.report_fd, "rb") as report:
+            values = report.read().split()
+        self.report_fd = None
+        if len(values) == 3:
+            self.returncode = self.popen.returncode = int(values[0])
+            self.usage = (int(values[1]), float(values[2]))
+
+    async def wait(self):
+        return await asyncio.shield(self.exited)
+
+    def cpu_time(self):
+        """Returns the user and system CPU time of the process and its children in seconds."""
+        if self.usage:
+            return self.usage[1]
+        return self.rusage.ru_utime + self.rusage.ru_stime if self.rusage else 0.0
+
+    def peak_memory(self):
+        """Returns the peak resident memory of the largest process of a measured command in MB,
+        ru_maxrss is in kB on Linux.
+        """
+        return self.usage[0] / 1024 if self.usage else 0.0
+
+
+async def wait_ready(add, remove, fd):
+    """Waits until a file descriptor is ready, 'add' and 'remove' are the reader or writer methods of the loop."""
+    ready = asyncio.get_running_loop().create_future()
+    add(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        remove(fd)
+
+
+async def relay(source, target, stage):
+    """Moves the output of a pipeline stage from pipe 'source' to pipe 'target', the input of the next stage,
+    and counts the bytes in the stage. The data is spliced between the pipes without copying it to user space.
+    Both pipes are closed at the end, so the stages see the end of their input or get SIGPIPE like in the shell.
+    """
+    loop = asyncio.get_running_loop()
+    os.set_blocking(source, False)
+    os.set_blocking(target, False)
+    try:
+        while True:
+            try:
+                moved = os.splice(source, target, PIPE_CHUNK, flags=os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                # Either the source is empty or the target is full
+                await wait_ready(loop.add_reader, loop.remove_reader, source)
+                await wait_ready(loop.add_writer, loop.remove_writer, target)
+                continue
+            except BrokenPipeError:
+                break  # The next stage has ended
+            if not moved:
+                break  # The stage has closed its output
+            stage.bytes += moved
+    finally:
+        os.close(source)
+        os.close(target)
+
+
+async def open_reader(pipe):
+    """Returns an asyncio stream reader of a pipe of a process."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT, loop=loop)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop), pipe)
+    return reader
+
+
+def signal_group(process, sig):
+    """Sends a signal to the process group of a process, the process is started in its own session."""
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def kill_process(process):
+    """Terminates a process with its children, kills them if they do not end in time."""
+    signal_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), KILL_GRACE)
+    except asyncio.TimeoutError:
+        signal_group(process, signal.SIGKILL)
+        await process.wait()
+
+
+def read_memory(tree):
+    """Returns the current resident memory of processes in kB."""
+    total = 0
+    for proc in tree:
+        try:
+            total += proc.memory_info().rss // 1024
+        except psutil.Error:
+            pass
+    return total
+
+
+async def monitor(pids, memory_limit, on_exceeded, launched=False):
+    """Samples the memory of processes and their children until it is cancelled.
+    When the processes together use more than 'memory_limit' MB, 'on_exceeded' is awaited and the monitor ends.
+    With 'launched' the processes are launchers, only their children are counted.
+    """
+    roots = []
+    for pid in pids:
+        try:
+            roots.append(psutil.Process(pid))
+        except psutil.NoSuchProcess:
+            pass
+
+    while roots:
+        trees = []
+        for root in list(roots):
+            try:
+                trees += ([] if launched else [root]) + root.children(recursive=True)
+            except psutil.NoSuchProcess:
+                roots.remove(root)
+        if read_memory(trees) > memory_limit * 1024:
+            await on_exceeded()
+            return
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+def split_pipeline(cmd):
+    """Splits a shell command into the commands of its pipeline.
+    Pipes in quotes and subshells are kept. Commands with other control operators ('&&', '||', ';', '&', '|&')
+    or with builtins that change the shell, such as 'cd', are not split.
+    """
+    commands, current = [], []
+    quote, depth, escaped = None, 0, False
+    for i, char in enumerate(cmd):
+        previous, following = cmd[i - 1:i], cmd[i + 1:i + 2]
+        if escaped:
+            escaped = False
+        elif char == "\\" and quote != "'":
+            escaped = True
+        elif quote:
+            quote = None if char == quote else quote
+        elif char in "'\"":
+            quote = char
+        elif char in "({":
+            depth += 1
+        elif char in ")}":
+            depth -= 1
+        elif depth:
+            pass
+        elif char in ";\n":
+            return [cmd]
+        elif char == "&" and previous not in ("<", ">") and following != ">":
+            return [cmd]  # '&&' or a background job, '>&', '<&' and '&>' are redirections
+        elif char == "|" and previous != ">":
+            if following in ("|", "&") or previous == "|":
+                return [cmd]
+            commands.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    commands.append("".join(current).strip())
+    if not all(commands) or any(command.split()[0] in SHELL_STATE_BUILTINS for command in commands):
+        return [cmd]
+    return commands
+
+
+async def run_process(cmd, cwd=None, timeout=None, stop_patterns=(), measure=False, on_line: Callable = None, name=None,
+                      time_limit=None, memory_limit=None, split=False):
+    """Runs a shell command as an async subprocess and reads its output line by line.
+    - `timeout`: Time limit in seconds, the process is stopped after it.
+    - `stop_patterns`: The process is stopped when a line contains one of the patterns.
+    - `measure`: Sets the peak memory and CPU usage of the process and all its descendants,
+      reported by the launcher from os.wait4 when the process ends.
+    - `on_line`: Called with the stream name and every line of the output.
+    - `name`: Name of the process in the profile, the first word of the command by default.
+    - `time_limit`, `memory_limit`: Budget in seconds and MB, the process is stopped when it exceeds one of them
+      and the budget is set in `exceeded`. Unlike `timeout`, reaching the budget is not a failure.
+    - `split`: A pipeline is started as separate processes connected by pipes,
+      so every stage is measured on its own in `stages`.
+    """
+    with span(name or cmd.split(" ", 1)[0], "subprocess", cmd=cmd):
+        commands = split_pipeline(cmd) if split else [cmd]
+        return await run_traced_process(commands, cwd, timeout, stop_patterns, measure, on_line, time_limit, memory_limit)
+
+
+async def run_traced_process(commands, cwd, timeout, stop_patterns, measure, on_line, time_limit=None, memory_limit=None):
+    """Runs the processes of run_process, inside of its profiling span.
+    The output of every command goes to the input of the next one, the output of the last command is the result.
+    """
+    result = RunResult()
+    output = {"stdout": [], "stderr": []}
+    stages = [StageResult(cmd) for cmd in commands]
+
+    start_time = time.monotonic()
+    processes, relays, stdin = [], [], None
+    for stage in stages[:-1]:
+        read_fd, write_fd = os.pipe()
+        processes.append(Process(stage.cmd, cwd, stdin, write_fd, measure))
+        os.close(write_fd)  # Only the stage holds the write end, so the relay sees the end of its output
+        if stdin is not None:
+            os.close(stdin)
+        # The output is relayed to the next stage through a second pipe, so the passed bytes are counted
+        stdin, relay_fd = os.pipe()
+        relays.append(relay(read_fd, relay_fd, stage))
+    processes.append(Process(commands[-1], cwd, stdin, measure=measure))
+    if stdin is not None:
+        os.close(stdin)
+    process = processes[-1]
+    stdout = await open_reader(process.popen.stdout)
+    stderrs = [await open_reader(proc.popen.stderr) for proc in processes]
+
+    async def stop_all():
+        await asyncio.gather(*(kill_process(proc) for proc in processes))
+
+    async def stop_over_memory():
+        result.exceeded = "memory"
+        await stop_all()
+
+    monitor_task = None
+    if memory_limit:
+        monitor_task = asyncio.create_task(monitor([proc.pid for proc in processes], memory_limit, stop_over_memory,
+                                                   measure))
+    limit = min((t for t in (timeout, time_limit) if t), default=None)
+
+    async def read(stream, name):
+        async for raw in stream:
+            line = raw.decode("utf-8", errors="replace")
+            output[name].append(line)
+            if name == "stdout":
+                stages[-1].bytes += len(raw)
+            if on_line:
+                on_line(name, line)
+            if result.matched is None:
+                for pattern in stop_patterns:
+                    if pattern in line:
+                        result.matched = pattern
+                        for proc in processes:
+                            signal_group(proc, signal.SIGTERM)
+                        break
+
+    async def wait(proc, stage):
+        await proc.wait()
+        stage.elapsed = time.monotonic() - start_time
+
+    tasks = [read(stdout, "stdout")] + relays
+    tasks += [read(stderr, "stderr") for stderr in stderrs]
+    tasks += [wait(proc, stage) for proc, stage in zip(processes, stages)]
+    try:
+        await asyncio.wait_for(asyncio.gather(*tasks), limit)
+    except asyncio.TimeoutError:
+        if time_limit and limit == time_limit:
+            result.exceeded = "time"
+        else:
+            result.timed_out = True
+        await stop_all()
+    except asyncio.CancelledError:
+        await stop_all()
+        raise
+    finally:
+        if monitor_task:
+            monitor_task.cancel()
+            try:
+                await monitor_task
+            except asyncio.CancelledError:
+                pass
+
+    result.elapsed = time.monotonic() - start_time
+    result.returncode = process.returncode
+    result.stdout = "".join(output["stdout"])
+    result.stderr = "".join(output["stderr"])
+    if measure:
+        result.memory = max(proc.peak_memory() for proc in processes)
+        cpu_time = sum(proc.cpu_time() for proc in processes)
+        result.cpu = cpu_time / result.elapsed * 100 if result.elapsed else 0
+
+    if len(commands) > 1:
+        for stage, proc in zip(stages, processes):
+            stage.returncode = proc.returncode
+            stage.elapsed = stage.elapsed or result.elapsed
+            stage.cpu_time = proc.cpu_time()
+            stage.memory = proc.peak_memory()
+        result.stages = stages
+    return result
+
+
+async def gather_limited(coroutines, limit):
+    """Runs coroutines in one event loop, at most 'limit' of them at the same time."""
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines))
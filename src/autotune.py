@@ -0,0 +1,130 @@
+# Author: Andrea Michlíková - xmichl11
+
+import json
+import os
+import socket
+import subprocess
+from dataclasses import asdict
+
+from src.files import file_lock
+
+# Hashcat options of the tuned settings
+OPTIONS = {"workload_profiles": "-w", "kernel_accel": "-n", "kernel_loops": "-u", "kernel_threads": "-T"}
+
+# A setting replaces the best one only when it is faster by this factor, smaller differences are noise
+MIN_GAIN = 1.02
+
+# Tuned options by the cache key, every process reads the cache file once
+_options = {}
+
+# Version of Hashcat, it is asked for once
+_version = None
+
+
+def get_hashcat_version():
+    """Returns the version printed by 'hashcat --version', "unknown" if Hashcat does not print it."""
+    global _version
+    if _version is None:
+        try:
+            result = subprocess.run(["hashcat", "--version"], capture_output=True, text=True, timeout=60)
+            _version = (result.stdout.strip().splitlines() or ["unknown"])[0]
+        except (OSError, subprocess.TimeoutExpired):
+            _version = "unknown"
+    return _version
+
+
+def get_cache_key():
+    """Returns the key of the tuned options, they are valid for one host and one version of Hashcat."""
+    return f"{socket.gethostname()} {get_hashcat_version()}"
+
+
+def get_cache_file(exp):
+    return os.path.join(exp.config.general.cache_folder, "autotune.json")
+
+
+def get_search_space(exp):
+    """Returns the values tried for every option, the tuned options are valid only for the same values."""
+    space = asdict(exp.config.autotune)
+    return {name: space[name] for name in OPTIONS}
+
+
+def format_options(settings):
+    return "".join(f" {OPTIONS[name]} {value}" for name, value in settings.items())
+
+
+def load_cache(exp):
+    cache_file = get_cache_file(exp)
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, "r") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+
+
+def save_cache(exp, cache):
+    cache_file = get_cache_file(exp)
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    with open(f"{cache_file}.tmp", "w") as f:
+        json.dump(cache, f, indent=4)
+    os.replace(f"{cache_file}.tmp", cache_file)
+
+
+def measure(cmd, cwd):
+    """Runs a Hashcat command and returns the guesses per second from its status, 0 if it fails.
+    The speed of the devices does not include the start of Hashcat, which is the same for every setting.
+    """
+    from src.hashcat_task import parse_speed
+    result = subprocess.run(cmd, shell=True, cwd=cwd, capture_output=True, text=True)
+    # Hashcat exits with 1 when the attack is exhausted without recovering every password
+    if result.returncode not in (0, 1):
+        return 0.0
+    return parse_speed(result.stdout)
+
+
+def tune(cmd, cwd, space):
+    """Tunes the options one after another, every option keeps its fastest value for the next ones.
+    A value is kept only when it is faster than the best settings by MIN_GAIN.
+    Returns the best settings and their speed.
+    """
+    best, best_speed = {}, measure(cmd, cwd)
+    print(f"AUTOTUNE: default settings {best_speed:,.0f} guesses/s")
+    for name, values in space.items():
+        for value in values:
+            settings = {**best, name: value}
+            speed = measure(cmd + format_options(settings), cwd)
+            print(f"AUTOTUNE:{format_options(settings)} {speed:,.0f} guesses/s")
+            if speed > best_speed * MIN_GAIN:
+                best, best_speed = settings, speed
+    return best, best_speed
+
+
+def get_options(exp, make_slice_cmd):
+    """Returns the tuned options of Hashcat for this host, "" when tuning is disabled.
+    Without cached options the command of a short slice of the current job from 'make_slice_cmd'
+    is benchmarked with every setting. Only one process of a host tunes at a time.
+    """
+    if not exp.config.autotune.enabled:
+        return ""
+    key = get_cache_key()
+    if key in _options:
+        return _options[key]
+
+    space = get_search_space(exp)
+    with file_lock(get_cache_file(exp)):
+        cache = load_cache(exp)
+        entry = cache.get(key)
+        if not entry or entry.get("space") != space:
+            print(f"AUTOTUNE: tuning Hashcat on {key}")
+            cmd, cleanup = make_slice_cmd()
+            try:
+                settings, speed = tune(cmd, exp.script_dir, space)
+            finally:
+                cleanup()
+            entry = cache[key] = {"options": format_options(settings).strip(), "speed": speed, "space": space}
+            save_cache(exp, cache)
+        print(f"AUTOTUNE: Hashcat options '{entry['options']}' ({entry['speed']:,.0f} guesses/s)")
+
+    _options[key] = f" {entry['options']}" if entry["options"] else ""
+    return _options[key]
@@ -0,0 +1,58 @@
+# Author: Andrea Michlíková - xmichl11
+
+import math
+import statistics
+
+# Two-sided 95% critical values of Student's t-distribution by degrees of freedom
+T_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093, 20: 2.086,
+    21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064, 25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042,
+    40: 2.021, 60: 2.000, 120: 1.980,
+}
+
+# Measured metrics of a program run
+METRICS = ["time", "memory", "cpu"]
+
+
+def t_critical(df):
+    """Returns the 95% critical value of the t-distribution, the nearest lower tabulated value is used."""
+    if df < 1:
+        return 0.0
+    if df > 120:
+        return 1.960
+    return T_95[max(key for key in T_95 if key <= df)]
+
+
+def drop_outliers(values, factor):
+    """Removes values outside of the Tukey fences, 'factor' times the interquartile range from the quartiles.
+    With a factor 0 or less than four values nothing is removed.
+    """
+    if factor <= 0 or len(values) < 4:
+        return list(values)
+    q1, _, q3 = statistics.quantiles(values, n=4)
+    low, high = q1 - factor * (q3 - q1), q3 + factor * (q3 - q1)
+    return [value for value in values if low <= value <= high]
+
+
+def summarize(values, factor=1.5):
+    """Returns the mean, the sample standard deviation and the half-width of the 95% confidence interval
+    of the values without outliers.
+    """
+    values = drop_outliers(values, factor)
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, 0.0, 0.0
+    std = statistics.stdev(values)
+    return mean, std, t_critical(len(values) - 1) * std / math.sqrt(len(values))
+
+
+def summarize_trials(trials, factor=1.5):
+    """Summarizes trials, dictionaries with the measured metrics, into formatted statistics of every metric."""
+    summary = {"trials": len(trials)}
+    for metric in METRICS:
+        mean, std, ci = summarize([trial[metric] for trial in trials], factor)
+        summary[metric] = f"{mean:.2f}"
+        summary[f"{metric}_std"] = f"{std:.2f}"
+        summary[f"{metric}_ci"] = f"{ci:.2f}"
+    return summary
@@ -12,6 +12,8 @@ class Program:
     args: List[str] = field(
         default_factory=list
     )  # List of arguments for the program runs
+    time_limit: int = 0  # Wall time budget of one run in seconds, 0 for the budget of the stage
+    memory_limit: int = 0  # Memory budget of one run in MB, 0 for the budget of the stage
 
 
 # General configuration for the application
@@ -23,6 +25,12 @@ class GeneralConfig:
     rules_file: str = ""  # Model name of the rules file
     hashcat_folder: str = ""  # Path to the folder for attack with Hashcat
     stats_folder: str = "results"  # Folder to store statistics
+    cache_folder: str = "cache"  # Folder for data cached by file content
+    parallel_runs: int = 1  # Number of program or Hashcat runs at the same time
+    run_timeout: int = 0  # Time limit of one program or Hashcat run in seconds, 0 for no limit
+    hashcat_shards: int = 1  # Keyspace shards of one Hashcat run that run at the same time, 1 to not split runs
+    watch_interval: float = 2  # Seconds between scans of the rule folder in the watch mode without inotify
+    watch_settle: float = 2  # Seconds a rule file must stay unchanged before the watch mode evaluates it
 
 
 # Configuration for statistics collection
@@ -38,6 +46,7 @@ class StatsConfig:
     zxcvbn_score: bool = False
     analyze_rules: bool = False
     analyze_wordlist: bool = False
+    analyze_similarity: bool = False
 
     # File paths for storing statistics
     time_passwords_file: str = "time_passwords.tex"
@@ -49,6 +58,8 @@ class StatsConfig:
     zxcvbn_score_file: str = "zxcvbn_score.tex"
     analyze_rules_file: str = "analyze_rules.tex"
     analyze_wordlist_file: str = "analyze_wordlist.tex"
+    analyze_similarity_file: str = "analyze_similarity.tex"
+    plot_points: int = 1000  # Maximal number of points of one plot in the graphs, 0 for no limit
 
     # CSV file paths for storing statistics
     program_csv_file: str = "program_stats.csv"
@@ -57,6 +68,16 @@ class StatsConfig:
     zxcvbn_score_csv_file: str = "zxcvbn_score_stats.csv"
     rules_csv_file: str = "analyze_rules.csv"
     wordlist_csv_file: str = "analyze_wordlist.csv"
+    similarity_csv_file: str = "analyze_similarity.csv"
+
+    # Results store with all statistics, the CSV files are kept in sync with it
+    results_db_file: str = "results.db"
+
+    # Fingerprints of finished stages, a stage runs again only when its inputs change
+    stage_state_file: str = "stages.json"
+
+    # Comparison with the baseline statistics
+    regression_csv_file: str = "regression.csv"
 
 
 # Configuration for input data
@@ -66,6 +87,76 @@ class InputConfig:
     rules_size: List[int] = field(default_factory=list)  # List of rules sizes
 
 
+# Configuration for cleaning of the input files
+@dataclass
+class PreprocessConfig:
+    # Enable/disable cleaning of the input files
+    wordlist: bool = False
+    attack: bool = False
+    target: bool = False
+
+    dedup: bool = True  # Remove duplicate passwords, the first occurrence is kept
+    normalize: str = ""  # Unicode normalization form (NFC, NFKC, NFD, NFKD)
+    fallback_encoding: str = "latin-1"  # Encoding of lines that are not valid UTF-8, empty to drop them
+    min_length: int = 0  # Minimal length of a password, 0 for no limit
+    max_length: int = 0  # Maximal length of a password, 0 for no limit
+    charsets: List[str] = field(default_factory=list)  # Allowed charsets from shared.CHARSET, empty for all
+    chunk_size: int = 1000000  # Number of passwords sorted in memory at once
+
+
+# Configuration for repeated measurement of the programs
+@dataclass
+class BenchmarkConfig:
+    trials: int = 1  # Number of measured runs of every program run
+    warmup: int = 0  # Number of runs before the measured ones, their results are ignored
+    outlier_factor: float = 1.5  # Trials outside of the quartiles +- factor * IQR are dropped, 0 keeps all
+
+    @property
+    def enabled(self):
+        """Returns True if the programs are measured more than once."""
+        return self.trials > 1 or self.warmup > 0
+
+
+# Configuration for the comparison with baseline statistics
+@dataclass
+class RegressionConfig:
+    baseline: str = ""  # Folder with program_stats.csv and hashcat_stats.csv of the baseline
+    time_threshold: float = 10.0  # Allowed increase of the generation time in percent
+    memory_threshold: float = 10.0  # Allowed increase of the memory usage in percent
+    recovered_threshold: float = 0.0  # Allowed decrease of recovered passwords in percentage points
+
+
+# Configuration for the budgets of one run, a run that exceeds them is stopped and its partial results are kept
+@dataclass
+class BudgetConfig:
+    rules_time: int = 0  # Wall time of one program run in seconds, 0 for no limit
+    rules_memory: int = 0  # Memory of one program run with its child processes in MB, 0 for no limit
+    hashcat_time: int = 0  # Wall time of one Hashcat run in seconds, 0 for no limit
+    hashcat_memory: int = 0  # Memory of one Hashcat run in MB, 0 for no limit
+    hashcat_candidates: int = 0  # Guesses of one Hashcat run, 0 for no limit
+
+
+# Configuration for tuning of the Hashcat workload on every host
+@dataclass
+class AutotuneConfig:
+    enabled: bool = False  # Tune Hashcat on the first run of every host and Hashcat version
+    words: int = 10000  # Attack words of the benchmarked slice of the first run
+    workload_profiles: List[int] = field(default_factory=lambda: [1, 2, 3, 4])  # Values of -w to try
+    kernel_accel: List[int] = field(default_factory=list)  # Values of -n to try, empty to keep the default
+    kernel_loops: List[int] = field(default_factory=list)  # Values of -u to try, empty to keep the default
+    kernel_threads: List[int] = field(default_factory=list)  # Values of -T to try, empty to keep the default
+
+
+# Configuration for the analysis of duplicate candidates of Hashcat runs
+@dataclass
+class DedupConfig:
+    measure: bool = False  # Count the unique candidates of every Hashcat run with a Bloom filter
+    stream: bool = False  # Pass only unique candidates to Hashcat through stdin, such runs are not split into shards
+    memory: int = 64  # Memory of the Bloom filter in MB
+    error_rate: float = 0.001  # False positive rate of the Bloom filter when it fits into the memory
+    sample: int = 1  # With measure, unique candidates are estimated from every n-th of them, 1 counts all
+
+
 # Main configuration class that combines all configurations
 @dataclass
 class Config:
@@ -73,6 +164,12 @@ class Config:
     general: GeneralConfig  # General configuration
     stats: StatsConfig  # Statistics configuration
     input: InputConfig  # Input configuration
+    preprocess: PreprocessConfig = field(default_factory=PreprocessConfig)  # Input cleaning configuration
+    benchmark: BenchmarkConfig = field(default_factory=BenchmarkConfig)  # Repeated measurement configuration
+    regression: RegressionConfig = field(default_factory=RegressionConfig)  # Baseline comparison configuration
+    budget: BudgetConfig = field(default_factory=BudgetConfig)  # Budgets of the runs
+    autotune: AutotuneConfig = field(default_factory=AutotuneConfig)  # Tuning of Hashcat
+    dedup: DedupConfig = field(default_factory=DedupConfig)  # Duplicate candidates of Hashcat
 
     # Static method to load configuration from a YAML file
     @staticmethod
@@ -84,6 +181,12 @@ class Config:
         general_data = data.get("general", {})
         input_data = data.get("input", {})
         stats_data = data.get("stats", {})
+        preprocess_data = data.get("preprocess", {})
+        benchmark_data = data.get("benchmark", {})
+        regression_data = data.get("regression", {})
+        budget_data = data.get("budget", {})
+        autotune_data = data.get("autotune", {})
+        dedup_data = data.get("dedup", {})
 
         # Create a Config object with the loaded data
         config = Config(
@@ -93,11 +196,19 @@ class Config:
                     name=prog["program"],  # Program name
                     run=prog.get("run", ""),  # Executable command
                     args=prog.get("args", []),  # Arguments
+                    time_limit=prog.get("time_limit", 0),  # Wall time budget
+                    memory_limit=prog.get("memory_limit", 0),  # Memory budget
                 )
                 for prog in data.get("programs", [])  # Iterate over programs
             ],
             stats=StatsConfig(**stats_data),
             input=InputConfig(**input_data),
+            preprocess=PreprocessConfig(**preprocess_data),
+            benchmark=BenchmarkConfig(**benchmark_data),
+            regression=RegressionConfig(**regression_data),
+            budget=BudgetConfig(**budget_data),
+            autotune=AutotuneConfig(**autotune_data),
+            dedup=DedupConfig(**dedup_data),
         )
 
         # Validate configuration: rules_file must be set if certain stats are enabled
@@ -110,5 +221,7 @@ class Config:
             raise ValueError(
                 "ERROR: rules_file must be set in general section if programs stats are enabled"
             )
+        if config.dedup.sample < 1:
+            raise ValueError("ERROR: dedup.sample must be at least 1")
 
         return config
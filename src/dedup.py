@@ -0,0 +1,81 @@
+# Author: Andrea Michlíková - xmichl11
+
+import argparse
+import os
+import re
+import sys
+
+from src.sketch import BloomFilter, BLOOM_MEMORY, BLOOM_ERROR_RATE
+
+# Line with the numbers of candidates and the estimated false positive rate, printed to stderr at the end
+COUNTS_PATTERN = re.compile(r"^CANDIDATES raw=(\d+) unique=(\d+) error_rate=(\S+)$", re.MULTILINE)
+
+
+def dedup_stream(source, target, bloom):
+    """Copies lines that were not seen before from 'source' to 'target', only counts them without 'target'.
+    Returns the number of all and of unique lines.
+    """
+    raw = unique = 0
+    add = bloom.add
+    for line in source:
+        raw += 1
+        if add(line.rstrip(b"\r\n")):
+            unique += 1
+            if target:
+                target.write(line)
+    return raw, unique
+
+
+def count_sampled(source, bloom, sample):
+    """Counts all lines of 'source' and estimates the unique ones from the lines whose hash is divisible by 'sample'.
+    Copies of one line have the same hash, so they are all sampled or all skipped and only every 'sample'-th
+    distinct line is added to the filter. Returns the number of all lines and the estimated number of unique lines.
+    """
+    raw = unique = 0
+    add = bloom.add
+    for line in source:
+        raw += 1
+        value = line.rstrip(b"\r\n")
+        if not hash(value) % sample and add(value):
+            unique += 1
+    return raw, unique * sample
+
+
+def parse_counts(output):
+    """Returns the numbers of all and of unique candidates and the estimated false positive rate of the filter
+    printed by this module, None if they are missing.
+    """
+    match = COUNTS_PATTERN.search(output or "")
+    return (int(match.group(1)), int(match.group(2)), float(match.group(3))) if match else (None, None, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Removes duplicate candidates from stdin with a Bloom filter.")
+    parser.add_argument("-e", "--expected", type=int, required=True, help="Expected number of candidates")
+    parser.add_argument("-m", "--memory", type=int, default=BLOOM_MEMORY, help="Memory of the Bloom filter in MB")
+    parser.add_argument("-r", "--error-rate", type=float, default=BLOOM_ERROR_RATE, help="False positive rate of the filter")
+    parser.add_argument("-c", "--count", action="store_true", help="Only counts the candidates, nothing is written")
+    parser.add_argument("-s", "--sample", type=int, default=1, help="With --count, estimates the unique candidates "
+                                                                    "from every n-th of them")
+    args = parser.parse_args()
+    if args.sample < 1 or (args.sample > 1 and not args.count):
+        parser.error("--sample must be at least 1 and needs --count")
+
+    # Only the sampled candidates are added, the filter is sized for them
+    bloom = BloomFilter(args.expected // args.sample, args.memory, args.error_rate)
+    try:
+        if args.sample > 1:
+            raw, unique = count_sampled(sys.stdin.buffer, bloom, args.sample)
+        else:
+            raw, unique = dedup_stream(sys.stdin.buffer, None if args.count else sys.stdout.buffer, bloom)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Hashcat was stopped, for example by its budget, the candidates read so far are not reported
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    # Unique candidates counted as duplicates by a false positive are not included, so the rate is a small underestimate
+    print(f"CANDIDATES raw={raw} unique={unique} error_rate={bloom.error_rate(unique // args.sample):.6g}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+# Author: Andrea Michlíková - xmichl11
+
+import asyncio
+import copy
+import csv
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+import src.store as store
+import src.metrics as metrics
+import src.program_task as program_task
+import src.hashcat_task as hashcat_task
+from src.shared import Experiment, get_scratch_name
+from src.files import count_lines_in_file, get_rules_list, get_wordlist_info, delete_temporary_folder
+from src.log import load_log, merge_log, has_command_run, record_to_csv, delete_program_record, log_command
+from src.preprocess import preprocess_inputs
+from src.stages import build_stages, run_stages
+
+# Seconds between heartbeats of a worker that runs a job
+HEARTBEAT_INTERVAL = 5
+
+# Seconds without any message after which a worker is considered dead
+WORKER_TIMEOUT = 60
+
+# Seconds a worker waits before it asks for a job again
+WAIT_INTERVAL = 2
+
+# Environment variable with the key that workers use to authenticate to the coordinator
+AUTHKEY_VARIABLE = "PWDRE_AUTHKEY"
+
+# Attempts of a job that fails on a worker before it is logged as an error
+MAX_ATTEMPTS = 3
+
+# Stages of the job kinds in the metrics
+JOB_STAGES = {"program": "rules", "hashcat": "hashcat", "hashcat_shard": "hashcat"}
+
+
+def parse_address(address):
+    """Parses an address in the form host:port."""
+    host, _, port = address.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def get_authkey():
+    """Returns the secret key shared by the coordinator and the workers.
+    Messages are pickled, so without a secret key anyone who can connect could run code on the other side.
+    """
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        raise ValueError(f"ERROR: The coordinator and the workers need a secret key in {AUTHKEY_VARIABLE}")
+    return authkey
+
+
+########################################################################### Jobs
+def program_jobs(exp):
+    """Expands the configuration into program runs that are not in the log yet, all of them for the regression check."""
+    jobs = []
+    for wordlist in exp.wordlist_list:
+        wl_info = get_wordlist_info(exp, wordlist)
+        if not wl_info:
+            print(f"WARNING: No valid wordlist data found for '{wordlist}'. Skipping.")
+            continue
+        for program in exp.config.programs:
+            for i, arg in enumerate(program.args):
+                for wl in wl_info:
+                    cmd, _ = program_task.get_cmd(exp, arg, program, wl, i)
+                    cmd = program_task.get_log_cmd(exp, cmd)
+                    if exp.remeasure or not has_command_run(exp, cmd, program_task.get_budget(exp, program)):
+                        jobs.append(("program", cmd, (arg, program, wl, i)))
+    return jobs
+
+
+def hashcat_shard_jobs(exp, cmd, rule_file, target_file, attack_file, attack_size, in_size):
+    """Splits a Hashcat run into jobs of its keyspace shards, returns one job for a run that is not split."""
+    args = (rule_file, target_file, attack_file, attack_size, in_size)
+    rule_count = count_lines_in_file(rule_file)
+    limit = hashcat_task.get_word_limit(hashcat_task.get_budget(exp), attack_size, int(in_size) or rule_count)
+    # Rule files with less rules than the size and runs over the candidate budget are not run, they are not split
+    if int(in_size) > rule_count or limit == 0:
+        return [("hashcat", cmd, args)]
+    shards = hashcat_task.get_shards(exp, attack_size, limit)
+    if len(shards) == 1:
+        return [("hashcat", cmd, args)]
+    return [("hashcat_shard", cmd, (*args, shards, index)) for index in range(len(shards))]
+
+
+def hashcat_jobs(exp):
+    """Expands the configuration into Hashcat runs that are not in the log yet.
+    Runs split into keyspace shards get a job for every shard.
+    """
+    # Hashcat is run only with full rule files when it is needed just for zxcvbn
+    rules_size = exp.config.input.rules_size if exp.config.stats.recovered_guesses else [0]
+
+    jobs = []
+    for attack_file in exp.attack_list:
+        attack_size = count_lines_in_file(attack_file)
+        for target_file in exp.target_list:
+            for rule_file in get_rules_list(exp):
+                if not os.path.exists(rule_file):
+                    print(f"ERROR: Rule file '{rule_file}' not found. Skipping.")
+                    continue
+                for in_size in rules_size:
+                    cmd = hashcat_task.get_log_cmd(rule_file, target_file, attack_file, in_size, exp.config.dedup.stream)
+                    if not has_command_run(exp, cmd, hashcat_task.get_budget(exp)):
+                        jobs += hashcat_shard_jobs(exp, cmd, rule_file, target_file, attack_file, attack_size, in_size)
+    return jobs
+
+
+def run_job(exp, job):
+    """Runs a single job with the given experiment, returns the results of a shard."""
+    kind, _, args = job
+    if kind == "program":
+        asyncio.run(program_task.process_run(exp, *args))
+    elif kind == "hashcat_shard":
+        return asyncio.run(hashcat_task.run_shard_job(exp, *args))
+    else:
+        asyncio.run(hashcat_task.process_run(exp, *args))
+
+
+########################################################################### Worker
+def create_worker_experiment(config, script_dir, scratch):
+    """Creates an experiment that writes the log and statistics of one job to a scratch folder."""
+    config = copy.deepcopy(config)
+    config.general.stats_folder = scratch
+    for attr_name in dir(config.stats):
+        if attr_name.endswith("_file"):
+            file_name = os.path.basename(getattr(config.stats, attr_name))
+            setattr(config.stats, attr_name, os.path.join(scratch, file_name))
+
+    return Experiment(
+        config=config,
+        script_dir=script_dir,
+        log=True,
+        log_file=os.path.join(scratch, "log.json"),
+        temp_folder=os.path.join("temp", get_scratch_name(), ""),
+    )
+
+
+def collect_results(exp):
+    """Returns the log entries and the CSV rows written by a job."""
+    rows = {}
+    for table in store.TABLES:
+        csv_path = store.get_csv_path(exp, table)
+        if os.path.exists(csv_path):
+            with open(csv_path, newline="", encoding="utf-8") as f:
+                rows[table] = list(csv.reader(f))[1:]
+    return {"log": load_log(exp), "rows": rows}
+
+
+def run_worker_job(job, config, script_dir):
+    """Runs a job in its own scratch folder and returns its results.
+    A shard returns its output and recovered passwords, the coordinator merges the shards of a run.
+    """
+    scratch = tempfile.mkdtemp(prefix="pwdre_worker_")
+    exp = create_worker_experiment(config, script_dir, scratch)
+    try:
+        shard = run_job(exp, job)
+        return shard if job[0] == "hashcat_shard" else collect_results(exp)
+    finally:
+        store.close(exp)
+        shutil.rmtree(scratch, ignore_errors=True)
+        delete_temporary_folder(exp)
+
+
+def send_heartbeats(send, done):
+    """Sends heartbeats until the job is done."""
+    while not done.wait(HEARTBEAT_INTERVAL):
+        send(("heartbeat",))
+
+
+def run_worker(address, script_dir, authkey):
+    """Runs jobs from the coordinator until it has no more work."""
+    conn = Client(parse_address(address), authkey=authkey.encode())
+    send_lock = threading.Lock()  # Heartbeats are sent from another thread
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    print(f"WORKER: Connected to {address}")
+    try:
+        while True:
+            send(("ready",))
+            message = conn.recv()
+            if message[0] == "stop":
+                break
+            if message[0] == "wait":
+                time.sleep(WAIT_INTERVAL)
+                continue
+
+            _, job_id, job, config = message
+            print(f"WORKER: Job {job_id}: {job[1]}")
+
+            # Tell the coordinator that the worker is alive while the job runs
+            done = threading.Event()
+            heartbeat = threading.Thread(target=send_heartbeats, args=(send, done), daemon=True)
+            heartbeat.start()
+            try:
+                send(("result", job_id, run_worker_job(job, config, script_dir)))
+            except Exception as e:
+                send(("failed", job_id, str(e)))
+            finally:
+                done.set()
+                heartbeat.join()
+    except (EOFError, OSError):
+        print("WORKER: Connection to the coordinator was closed.")
+    finally:
+        conn.close()
+    print("WORKER: No more jobs.")
+
+
+########################################################################### Coordinator
+class Coordinator:
+    """Hands out jobs to workers and saves their results to the log and CSV files."""
+
+    def __init__(self, exp, address, authkey):
+        self.exp = exp
+        self.listener = Listener(parse_address(address), authkey=authkey.encode())
+        self.cond = threading.Condition()
+        self.queue = deque()  # Jobs waiting for a worker
+        self.running = {}  # Jobs assigned to workers by their ids
+        self.shards = {}  # Finished shards of Hashcat runs by the logged commands of the runs
+        self.failed_runs = set()  # Logged commands of Hashcat runs with a failed shard
+        self.attempts = {}  # Failed attempts of jobs by their ids
+        self.saving = 0  # Finished jobs whose results are being saved
+        self.next_id = 0
+        self.finished = False
+
+    def serve(self):
+        """Accepts workers until the listener is closed."""
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                print("WARNING: A worker with a wrong key was rejected.")
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.handle, args=(conn, self.listener.last_accepted), daemon=True).start()
+
+    def handle(self, conn, peer):
+        """Serves one worker, its job is queued again when the worker dies."""
+        job_id = None
+        print(f"COORDINATOR: Worker {peer} connected")
+        try:
+            while True:
+                if not conn.poll(WORKER_TIMEOUT):
+                    raise TimeoutError
+                message = conn.recv()
+                if message[0] == "heartbeat":
+                    continue
+                if message[0] in ("result", "failed"):
+                    self.finish(*message)
+                    job_id = None
+                    continue
+
+                job_id, job = self.take()
+                if job is None:
+                    conn.send(("stop",) if self.finished else ("wait",))
+                else:
+                    conn.send(("job", job_id, job, self.exp.config))
+        except (EOFError, OSError, TimeoutError):
+            print(f"COORDINATOR: Worker {peer} disconnected")
+            if job_id is not None:
+                self.requeue(job_id)
+        finally:
+            conn.close()
+
+    def take(self):
+        """Assigns the next waiting job."""
+        with self.cond:
+            if not self.queue:
+                return None, None
+            job_id, job = self.queue.popleft()
+            self.running[job_id] = job
+            metrics.job_moved(JOB_STAGES[job[0]], "queued", "running")
+            return job_id, job
+
+    def requeue(self, job_id):
+        """Returns a job of a dead worker to the queue."""
+        with self.cond:
+            job = self.running.pop(job_id, None)
+            if job is not None:
+                print(f"WARNING: Job {job_id} is assigned again: {job[1]}")
+                metrics.job_moved(JOB_STAGES[job[0]], "running", "queued")
+                self.queue.appendleft((job_id, job))
+                self.cond.notify_all()
+
+    def finish(self, status, job_id, result):
+        """Saves the results of a finished job.
+        The results are saved outside of the lock, so other workers can take and finish jobs meanwhile.
+        """
+        with self.cond:
+            job = self.running.pop(job_id, None)
+            if job is None:
+                return  # Result of a job that was already assigned again
+            if status == "failed":
+                self.fail(job_id, job, result)
+                return
+            metrics.job_moved(JOB_STAGES[job[0]], "running", "done")
+            shards = self.finish_shard(job, result) if job[0] == "hashcat_shard" else None
+            self.saving += 1
+
+        try:
+            if job[0] == "hashcat_shard":
+                print(f"COORDINATOR: Job {job_id} done: shard {job[2][-1] + 1}/{len(job[2][-2])} of {job[1]}")
+                if shards:
+                    hashcat_task.record_shards(self.exp, *job[2][:-2], shards)
+            else:
+                merge_log(self.exp, result["log"])
+                for table, rows in result["rows"].items():
+                    for row in rows:
+                        # A new benchmark or regression measurement replaces the previous measurement of the rule file
+                        if table == "program" and (self.exp.config.benchmark.enabled or self.exp.remeasure):
+                            delete_program_record(self.exp, row[2], row[3])
+                        record_to_csv(self.exp, table, row)
+                print(f"COORDINATOR: Job {job_id} done: {job[1]}")
+        finally:
+            with self.cond:
+                self.saving -= 1
+                self.cond.notify_all()
+
+    def fail(self, job_id, job, error):
+        """Queues a failed job again, after MAX_ATTEMPTS attempts it is logged as an error."""
+        attempts = self.attempts[job_id] = self.attempts.get(job_id, 0) + 1
+        if job[0] == "hashcat_shard" and job[1] in self.failed_runs:
+            metrics.job_moved(JOB_STAGES[job[0]], "running", "failed")  # Another shard of the run already failed
+        elif attempts < MAX_ATTEMPTS:
+            print(f"WARNING: Job {job_id} failed ({attempts}/{MAX_ATTEMPTS}), it is assigned again: {error}")
+            metrics.job_moved(JOB_STAGES[job[0]], "running", "queued")
+            self.queue.append((job_id, job))
+        else:
+            print(f"ERROR: Job {job_id} failed {attempts} times: {error}")
+            metrics.job_moved(JOB_STAGES[job[0]], "running", "failed")
+            if job[0] == "hashcat_shard":
+                self.fail_run(job[1])
+            log_command(self.exp, job[1], "error", error_message=error)
+        self.cond.notify_all()
+
+    def fail_run(self, cmd):
+        """Drops the other shards of a Hashcat run with a failed shard, the run is logged as an error."""
+        self.failed_runs.add(cmd)
+        self.shards.pop(cmd, None)
+        for queued in [queued for queued in self.queue if queued[1][1] == cmd]:
+            self.queue.remove(queued)
+            metrics.job_moved(JOB_STAGES[queued[1][0]], "queued", "failed")
+        print(f"ERROR: A shard of Hashcat failed, the run is logged as an error: {cmd}")
+
+    def finish_shard(self, job, result):
+        """Keeps the result of a shard. Returns the results of all shards of the run when this was the last one,
+        the merged run is saved by the caller.
+        """
+        _, cmd, (*_, shards, index) = job
+        if cmd in self.failed_runs:
+            return None  # Another shard of the run failed, the run is already logged as an error
+        done = self.shards.setdefault(cmd, {})
+        done[index] = result
+        if len(done) < len(shards):
+            return None
+        del self.shards[cmd]
+        return [done[i] for i in range(len(shards))]
+
+    def run_jobs(self, jobs):
+        """Queues jobs and waits until all of them are done."""
+        with self.cond:
+            for job in jobs:
+                self.queue.append((self.next_id, job))
+                self.next_id += 1
+                metrics.jobs_queued(JOB_STAGES[job[0]], 1)
+            print(f"COORDINATOR: {len(jobs)} jobs queued")
+            while self.queue or self.running or self.saving:
+                self.cond.wait()
+
+    def close(self):
+        """Stops accepting workers."""
+        self.listener.close()
+
+
+def run_coordinator(exp, address, authkey, force=False):
+    """Distributes rule generation and Hashcat runs to workers, then runs the remaining stages locally."""
+    if not exp.log:
+        raise ValueError("ERROR: The coordinator needs the log to find finished jobs")
+
+    con_stats = exp.config.stats
+    preprocess_inputs(exp)  # Jobs use the cleaned input files
+
+    coordinator = Coordinator(exp, address, authkey)
+    threading.Thread(target=coordinator.serve, daemon=True).start()
+    print(f"COORDINATOR: Listening on {address}")
+
+    try:
+        # Rule files have to exist before Hashcat jobs are created
+        if (con_stats.time_passwords or con_stats.memory_passwords
+                or con_stats.rules_passwords or con_stats.cpu_passwords):
+            coordinator.run_jobs(program_jobs(exp))
+        if con_stats.recovered_guesses or con_stats.zxcvbn_recovered or con_stats.zxcvbn_score:
+            coordinator.run_jobs(hashcat_jobs(exp))
+        coordinator.finished = True
+
+        # Results of all jobs are in the log now, so the stages only load them
+        run_stages(exp, build_stages(exp), force=force)
+    finally:
+        coordinator.close()
+        delete_temporary_folder(exp)
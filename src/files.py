@@ -1,9 +1,67 @@
 # Author: Andrea Michlíková - xmichl11
 
 import os
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
 import random
 import shutil
-import src.shared as shared
+import signal
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Advisory locks are not available on Windows
+    fcntl = None
+
+# Supported compressions detected by file extension
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".xz": "xz", ".zst": "zstd", ".bz2": "bzip2"}
+
+# Supported compressions detected by magic bytes at the start of the file
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"BZh": "bzip2",
+}
+
+# Shell commands that write the decompressed file to stdout
+DECOMPRESS_CMD = {"gzip": "gzip -dc", "xz": "xz -dc", "zstd": "zstd -dc", "bzip2": "bzip2 -dc"}
+
+
+# Locks held by the current thread, a thread can take the same lock again
+_held_locks = threading.local()
+
+
+@contextmanager
+def file_lock(file_path):
+    """Holds an advisory lock of a file, so other processes and threads do not update it at the same time.
+    The lock is taken on a separate '.lock' file, because the file itself can be replaced.
+    """
+    held = getattr(_held_locks, "paths", None)
+    if held is None:
+        held = _held_locks.paths = set()
+    lock_path = os.path.abspath(f"{file_path}.lock")
+    if lock_path in held:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        held.add(lock_path)
+        try:
+            yield
+        finally:
+            held.discard(lock_path)
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
 
 
 def save_to_file(file_path, data):
@@ -33,11 +91,125 @@ def list_files_in_directory(directory, script_dir):
         return []
 
 
+def get_compression(file_path):
+    """Returns the compression of a file by its extension or magic bytes, None for plain text."""
+    compression = COMPRESSION_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+    if compression:
+        return compression
+    try:
+        with open(file_path, "rb") as f:
+            start = f.read(6)
+    except OSError:
+        return None
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def open_zstd(file_path):
+    """Opens a zstd compressed file for binary reading."""
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd.open(file_path, "rb")
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True)
+    except ImportError:
+        pass
+    # Fall back to the zstd tool, which is needed for streaming to Hashcat anyway
+    if not shutil.which("zstd"):
+        raise RuntimeError(f"ERROR: Reading '{file_path}' requires the 'zstandard' package or the zstd tool.")
+    return ProcessReader(["zstd", "-dc", file_path])
+
+
+class ProcessReader(io.RawIOBase):
+    """Reads the stdout of a decompression tool. The end of the output and close() check the exit code,
+    so a corrupt or missing file raises an error instead of reading as empty input.
+    """
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.process.stdout.readinto(buffer)
+        if not count:
+            self.check(self.process.wait())
+        return count
+
+    def check(self, returncode, closed_early=False):
+        # A reader that stops before the end closes the pipe and the tool is killed by SIGPIPE
+        if returncode and not (closed_early and returncode == -signal.SIGPIPE):
+            raise RuntimeError(f"ERROR: '{' '.join(self.cmd)}' failed with exit code {returncode}.")
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.process.stdout.close()
+        self.check(self.process.wait(), closed_early=True)
+
+
+def open_input(file_path, mode="r", encoding="utf-8", errors="replace"):
+    """Opens a plain or compressed input file for reading, in text mode ("r") or binary mode ("rb")."""
+    compression = get_compression(file_path)
+    if compression == "gzip":
+        binary = gzip.open(file_path, "rb")
+    elif compression == "xz":
+        binary = lzma.open(file_path, "rb")
+    elif compression == "bzip2":
+        binary = bz2.open(file_path, "rb")
+    elif compression == "zstd":
+        binary = open_zstd(file_path)
+    elif mode == "rb":
+        return open(file_path, "rb")
+    else:
+        return open(file_path, "r", encoding=encoding, errors=errors)
+
+    if mode == "rb":
+        return binary
+    return io.TextIOWrapper(io.BufferedReader(binary), encoding=encoding, errors=errors)
+
+
+def strip_compression_ext(file_name):
+    """Returns the file name without the compression extension."""
+    root, ext = os.path.splitext(file_name)
+    return root if ext.lower() in COMPRESSION_EXTENSIONS else file_name
+
+
+def get_stem(file_path):
+    """Returns the file name without its directory, compression and file extension."""
+    return os.path.splitext(strip_compression_ext(os.path.basename(file_path)))[0]
+
+
+def decompress_to_scratch(exp, file_path):
+    """Returns a plain text version of a file for tools that can not read it from a pipe.
+    Compressed files are decompressed to memory backed /dev/shm when it is available,
+    otherwise to the temporary folder of the experiment.
+    Returns the path and True if the file is temporary and has to be deleted.
+    """
+    if not get_compression(file_path):
+        return file_path, False
+
+    folder = "/dev/shm" if os.path.isdir("/dev/shm") else exp.temp_folder
+    os.makedirs(folder, exist_ok=True)
+    fd, plain_path = tempfile.mkstemp(dir=folder, prefix="pwdre_", suffix=f"_{get_stem(file_path)}.txt")
+    with open_input(file_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    return plain_path, True
+
+
 def count_lines_in_file(file_path):
     """Counts the number of lines in a file."""
     try:
         count = 0
-        with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        with open_input(file_path) as file:
             count = sum(1 for line in file if line.strip())
             return count
     except FileNotFoundError:
@@ -45,6 +217,15 @@ def count_lines_in_file(file_path):
         return 0
 
 
+def get_file_hash(file_path):
+    """Returns the SHA-256 hash of the file content."""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
 def make_filepath(folder, filename):
     """Creates a file path and ensures the directory exists."""
     os.makedirs(folder, exist_ok=True)
@@ -57,9 +238,11 @@ def create_size_file(folder, file_basename, current_passwords, size):
     selected_pwd = random.sample(current_passwords, size)
     output = os.path.join(folder, f"{file_basename}_{size}.txt")
 
-    if not os.path.exists(output):
-        save_to_file(output, "\n".join(selected_pwd))
-        print(f"Generated file: {output}")
+    # Another process can create the same file, the first one is kept
+    with file_lock(output):
+        if not os.path.exists(output):
+            save_to_file(output, "\n".join(selected_pwd))
+            print(f"Generated file: {output}")
 
     return {"name": output, "size": size}, selected_pwd
 
@@ -67,7 +250,7 @@ def create_size_file(folder, file_basename, current_passwords, size):
 def process_sizes(file_path, passwords, sizes, max_size):
     """Processes a list of sizes and generates files with the specified number of passwords."""
     file_size = count_lines_in_file(file_path)
-    file_basename = os.path.splitext(os.path.basename(file_path))[0]
+    file_basename = get_stem(file_path)
     folder = os.path.join(os.path.dirname(file_path), "random_selected")
     wordlist_info = []
     for size in sizes:
@@ -86,7 +269,7 @@ def process_sizes(file_path, passwords, sizes, max_size):
 def load_passwords(file_path):
     """Loads passwords from a file, filtering out empty lines and comments."""
     try:
-        with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        with open_input(file_path) as file:
             return [line.strip() for line in file if line.strip() and not line.startswith("#")]
     except (UnicodeDecodeError, FileNotFoundError) as e:
         print(f"ERROR: Reading file '{file_path}': {e}")
@@ -114,10 +297,10 @@ def select_passwords_from_file(file_path, sizes, max_size):
 
 
 ##############################################################################################
-def get_wordlist_info(wordlist_path):
+def get_wordlist_info(exp, wordlist_path):
     """Gets wordlist information based on the wordlist size from the config."""
     max_size = count_lines_in_file(wordlist_path)
-    sizes = shared.CONFIG.input.wordlist_size
+    sizes = exp.config.input.wordlist_size
 
     if not sizes:
         return [{"name": wordlist_path, "size": max_size}]
@@ -125,7 +308,9 @@ def get_wordlist_info(wordlist_path):
 
 
 def get_files(file_path):
-    """Gets a list of files from a directory or a single file."""
+    """Gets a list of files from a directory or a single file, an empty list if the path is not configured."""
+    if not file_path:
+        return []
     if os.path.isfile(file_path):
         return [file_path]
     elif os.path.isdir(file_path):
@@ -139,55 +324,67 @@ def get_files(file_path):
         return file_list
 
 
-def create_rules_file_name(program, wordlist, i):
+def create_rules_file_name(exp, program, wordlist, i):
     """Generates a rules file name by replacing placeholders in the config template."""
-    wl = os.path.splitext(os.path.basename(wordlist))[0]
+    wl = get_stem(wordlist)
     filename = (
-        shared.CONFIG.general.rules_file.replace("<program>", program.name)
+        exp.config.general.rules_file.replace("<program>", program.name)
         .replace("<wordlist>", wl)
         .replace("<argsN>", str(i))
     )
     return filename
 
 
-def get_rules_list():
+def get_rules_list(exp):
     """Creates a list of rule files based on the config and wordlists."""
     rules_files = []
-    if shared.CONFIG.general.hashcat_folder != "":
-        folder = os.path.join(shared.SCRIPT_DIR, shared.CONFIG.general.hashcat_folder)
+    if exp.config.general.hashcat_folder != "":
+        folder = os.path.join(exp.script_dir, exp.config.general.hashcat_folder)
         subdirectories = list_subdirectories(folder)
         if subdirectories:
             for subdir in subdirectories:
-                for file in list_files_in_directory(subdir, shared.SCRIPT_DIR):
+                for file in list_files_in_directory(subdir, exp.script_dir):
                     rules_files.append(file)
             return rules_files
-        for file in list_files_in_directory(folder, shared.SCRIPT_DIR):
+        for file in list_files_in_directory(folder, exp.script_dir):
             rules_files.append(file)
     else:
         # If no folder is specified, generate rules from programs and wordlists
-        for wordlist in shared.WORDLIST_LIST:
-            for program in shared.CONFIG.programs:
+        for wordlist in exp.wordlist_list:
+            for program in exp.config.programs:
                 for i, arg in enumerate(program.args):
-                    rule_file = create_rules_file_name(program, wordlist, i)
+                    rule_file = create_rules_file_name(exp, program, wordlist, i)
                     rules_files.append(rule_file)
     return rules_files
 
 
-def create_temporary_file(file, limit):
-    """Creates a temporary file with the first 'limit' lines from a file."""
-    temp_file_path = make_filepath("temp/", f"{os.path.splitext(os.path.basename(file))[0]}_{limit}.txt")
+def get_temporary_file_name(file, limit, folder="temp/"):
+    """Returns the path of the temporary file with the first 'limit' lines from a file."""
+    return os.path.join(folder, f"{get_stem(file)}_{limit}.txt")
 
+
+def create_temporary_file(exp, file, limit):
+    """Creates a temporary file with the first 'limit' lines from a file.
+    The name is unique, so concurrent runs with the same file do not overwrite each other.
+    """
     file_size = count_lines_in_file(file)
     if file_size < limit:
         print(f"WARNING: The file '{file}' has only {file_size} lines, which is less than the limit of {limit}.")
         return None
 
-    with open(file, "r", encoding="utf-8") as wordlist, open(temp_file_path, "w", encoding="utf-8") as temp_file:
+    os.makedirs(exp.temp_folder, exist_ok=True)
+    fd, temp_file_path = tempfile.mkstemp(dir=exp.temp_folder, prefix=f"{get_stem(file)}_{limit}_", suffix=".txt")
+    with open_input(file) as wordlist, os.fdopen(fd, "w", encoding="utf-8") as temp_file:
         temp_file.writelines(line for _, line in zip(range(limit), wordlist))
 
     return temp_file_path
 
 
+def delete_temporary_folder(exp):
+    """Deletes the temporary folder of an experiment."""
+    shutil.rmtree(exp.temp_folder, ignore_errors=True)
+
+
 ##########################################################################
 def delete_stats_folder(folder):
     """Deletes all files in the statistics folder after user confirmation."""
@@ -1,9 +1,16 @@
 # Author: Andrea Michlíková - xmichl11
 
+import asyncio
 import os
 import re
-import subprocess
+import signal
+import sys
+import tempfile
+import time
 import src.shared as shared
+from src.async_run import run_process, gather_limited
+from src.profiler import span
+import src.metrics as metrics
 from src.log import (
     has_command_run,
     log_command,
@@ -12,9 +19,30 @@ from src.log import (
     is_hashcat_record_in_csv,
     hashcat_from_log_to_csv,
     zxcvbn_from_log_to_csv,
+    OVER_BUDGET,
+)
+from src.files import (
+    count_lines_in_file,
+    get_rules_list,
+    create_temporary_file,
+    get_temporary_file_name,
+    get_compression,
+    decompress_to_scratch,
+    DECOMPRESS_CMD,
 )
-from src.files import count_lines_in_file, get_rules_list, create_temporary_file
 from src.zxcvbn_task import run_zxcvbn
+from src.autotune import get_options
+from src.dedup import parse_counts
+from src.sketch import bloom_capacity
+
+# Seconds between status lines of Hashcat when metrics are collected
+STATUS_INTERVAL = 5
+
+# Multipliers of the Hashcat speed units
+SPEED_UNITS = {"": 1, "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15}
+
+# Speed line of a device in the status of Hashcat, "Speed.#*" is the sum of all devices
+SPEED_PATTERN = re.compile(r"^Speed\.#(\*|\d+)\.*:\s*([\d.]+)\s*([kMGTP]?)H/s", re.MULTILINE)
 
 
 def extract_lines(output):
@@ -37,101 +65,532 @@ def extract_lines(output):
     return progress_line, recovered_percentage
 
 
-def prepare_rulefile(rule_file, size):
-    """Prepares a temporary rule file if a size limit is specified."""
+def parse_speed(output):
+    """Returns the guesses per second from the last status in the output of Hashcat, summed over all devices.
+    Returns 0 if the output has no status.
+    """
+    speeds = {}
+    for device, value, unit in SPEED_PATTERN.findall(output):
+        speeds[device] = float(value) * SPEED_UNITS[unit]  # A later status replaces the earlier one
+    return speeds.pop("*", None) or sum(speeds.values())
+
+
+def update_status_metrics(rule_file, in_size, line):
+    """Updates the speed and progress metrics from a status line of Hashcat."""
+    labels = {"rule_file": rule_file, "size": in_size}
+    if line.startswith("Speed."):
+        match = SPEED_PATTERN.match(line)
+        if match:
+            speed = float(match.group(2)) * SPEED_UNITS[match.group(3)]
+            metrics.set_value("pwdre_hashcat_speed_hashes_per_second", speed, **labels)
+    elif line.startswith("Progress"):
+        match = re.search(r":\s*(\d+)/(\d+)", line)
+        if match and int(match.group(2)):
+            metrics.set_value("pwdre_hashcat_progress_ratio", int(match.group(1)) / int(match.group(2)), **labels)
+
+
+def prepare_rulefile(exp, rule_file, size):
+    """Prepares a temporary rule file if a size limit is specified.
+    Hashcat can not read compressed rule files, a full compressed rule file is decompressed to scratch.
+    """
     if size != 0:
-        temp_rf = create_temporary_file(rule_file, size)
+        temp_rf = create_temporary_file(exp, rule_file, size)
         is_temp = True
     else:
-        temp_rf = rule_file
-        is_temp = False
+        temp_rf, is_temp = decompress_to_scratch(exp, rule_file)
     return temp_rf, is_temp
 
 
-def get_cmd(in_size, target_file, attack_file, temp_rf):
-    """Generates the Hashcat command based on input size and file paths."""
+def get_cmd(in_size, target_file, attack_file, temp_rf, recovered_file=shared.RECOVERED_FILE):
+    """Generates the Hashcat command based on input size and file paths.
+    Without the attack file Hashcat reads the candidates from stdin, without the rule file they are used as they are.
+    """
+    inputs = " ".join(file for file in (target_file, attack_file) if file)
+    rules = f" -r {temp_rf}" if temp_rf else ""
     if in_size == 0:
-        return f"hashcat -a 0 -m 99999 {target_file} {attack_file} -r {temp_rf} -o {shared.RECOVERED_FILE} --outfile-format=1 --potfile-disable"
+        return f"hashcat -a 0 -m 99999 {inputs}{rules} -o {recovered_file} --outfile-format=1 --potfile-disable"
     else:
-        return f"hashcat -a 0 -m 99999 {target_file} {attack_file} -r {temp_rf} --potfile-disable"
+        return f"hashcat -a 0 -m 99999 {inputs}{rules} --potfile-disable"
+
+
+def get_log_cmd(rule_file, target_file, attack_file, in_size, dedup=False):
+    """Generates the logged Hashcat command, it always uses the original input files
+    and the default temporary and recovered files, so it is the same for every experiment.
+    Runs with deduplicated candidates are logged separately, their progress counts only unique candidates.
+    """
+    in_size = int(in_size)
+    log_rf = get_temporary_file_name(rule_file, in_size) if in_size != 0 else rule_file
+    cmd = get_cmd(in_size, target_file, attack_file, log_rf)
+    return f"{cmd} [dedup]" if dedup else cmd
+
+
+def get_candidates_cmd(attack_file, temp_rf, session, limit=None):
+    """Generates the command that writes the candidates of a run, the words of the attack file with the rules applied."""
+    compression = get_compression(attack_file)
+    if not compression:
+        cmd = f"hashcat --stdout {attack_file} -r {temp_rf}" + (f" --limit={limit}" if limit else "")
+    else:
+        head = f" | head -n {limit}" if limit else ""
+        cmd = f"{DECOMPRESS_CMD[compression]} {attack_file}{head} | hashcat --stdout -r {temp_rf}"
+    return f"{cmd} --session={session}_candidates"
+
+
+def get_dedup_cmd(exp, expected, count=False):
+    """Generates the command that removes or only counts duplicate candidates with a Bloom filter."""
+    dedup = exp.config.dedup
+    cmd = f"{sys.executable} -m src.dedup --expected={expected} --memory={dedup.memory} --error-rate={dedup.error_rate}"
+    return f"{cmd} --count --sample={dedup.sample}" if count else cmd
+
+
+def get_exec_cmd(in_size, target_file, attack_file, temp_rf, recovered_file, limit=None, skip=0, dedup_cmd=None):
+    """Generates the executed Hashcat command, compressed attack files are streamed to stdin.
+    The target file has to be plain text, Hashcat reads the hash list more than once.
+    Every run has its own session named after its recovered file, so concurrent runs do not share restore files.
+    With 'limit' only 'limit' words of the attack file are used, the first 'skip' words are skipped.
+    With 'dedup_cmd' the candidates are written by Hashcat, deduplicated and read by Hashcat from stdin.
+    """
+    session = os.path.splitext(os.path.basename(recovered_file))[0]
+    compression = get_compression(attack_file)
+    if dedup_cmd:
+        candidates = get_candidates_cmd(attack_file, temp_rf, session, limit)
+        cmd = f"{candidates} | {dedup_cmd} | {get_cmd(in_size, target_file, None, None, recovered_file)}"
+    elif not compression:
+        cmd = get_cmd(in_size, target_file, attack_file, temp_rf, recovered_file)
+        if skip:
+            cmd += f" --skip={skip}"
+        if limit:
+            cmd += f" --limit={limit}"
+    else:
+        tail = f" | tail -n +{skip + 1}" if skip else ""
+        head = f" | head -n {limit}" if limit else ""
+        cmd = f"{DECOMPRESS_CMD[compression]} {attack_file}{tail}{head} | {get_cmd(in_size, target_file, None, temp_rf, recovered_file)}"
+    return f"{cmd} --session={session}"
+
+
+def get_slice_cmd(exp, target_file, attack_file, temp_rf):
+    """Returns the command of a short slice of a Hashcat run for tuning and a function that deletes its files."""
+    recovered_file = os.path.join(exp.temp_folder, "autotune.potfile")
+    os.makedirs(exp.temp_folder, exist_ok=True)
+    cmd = get_exec_cmd(0, target_file, attack_file, temp_rf, recovered_file, exp.config.autotune.words)
+
+    def cleanup():
+        if os.path.exists(recovered_file):
+            os.remove(recovered_file)
+    return cmd, cleanup
+
+
+def get_shards(exp, attack_size, limit=None):
+    """Splits the attack words of a run into keyspace shards, returns the skipped and used words of every shard.
+    Returns one shard without a limit when the run is not split.
+    The bounds come from count_lines_in_file, which does not count words the same way as Hashcat (blank lines),
+    so the last shard runs to the end of the attack file unless the budget limits the words.
+    Runs with deduplicated candidates are not split, duplicates in different shards could not be removed.
+    """
+    words = limit or int(attack_size)
+    shards = 1 if exp.config.dedup.stream else min(exp.config.general.hashcat_shards, words)
+    if shards <= 1:
+        return [(0, None)]
+    bounds = [words * i // shards for i in range(shards + 1)]
+    shard_list = [(bounds[i], bounds[i + 1] - bounds[i]) for i in range(shards)]
+    if not limit:
+        shard_list[-1] = (bounds[-2], None)
+    return shard_list
+
+
+def get_run_error(result, codes=(0, 1)):
+    """Returns why a Hashcat pipeline failed, None if every stage ended well.
+    The last command ends with one of 'codes', Hashcat exits with 1 when the attack is exhausted.
+    Earlier stages, such as the decompressor of the attack file, end with 0 or by SIGPIPE when a later stage
+    stops reading, so a corrupt or truncated attack file fails the run instead of saving partial results.
+    """
+    for stage in result.stages[:-1]:
+        if stage.returncode not in (0, -signal.SIGPIPE, 128 + signal.SIGPIPE):
+            return f"'{stage.cmd}' exited with {stage.returncode}"
+    if result.returncode not in codes:
+        last = result.stages[-1].cmd if result.stages else "hashcat"
+        return f"'{last}' exited with {result.returncode}"
+    return None
+
+
+def get_shard_file(recovered_file, index):
+    base, ext = os.path.splitext(recovered_file)
+    return f"{base}_shard{index}{ext}"
+
+
+async def run_shard(exp, target_file, attack_file, temp_rf, recovered_file, skip, count, options=""):
+    """Runs one keyspace shard of a Hashcat run and returns its output and recovered passwords.
+    Shards always write the recovered passwords, recovered passwords of all shards are merged.
+    """
+    budget = get_budget(exp)
+    exec_cmd = get_exec_cmd(0, target_file, attack_file, temp_rf, recovered_file, count, skip) + options
+    if budget["time"] or budget["memory"]:
+        exec_cmd += f" --status --status-timer={STATUS_INTERVAL}"
+    try:
+        result = await run_process(exec_cmd, cwd=exp.script_dir, timeout=exp.config.general.run_timeout or None,
+                                   name="hashcat", time_limit=budget["time"] or None, memory_limit=budget["memory"] or None,
+                                   split=True)
+        recovered = []
+        if os.path.exists(recovered_file):
+            with open(recovered_file, "r", encoding="utf-8", errors="surrogateescape") as f:
+                recovered = f.read().splitlines()
+    finally:
+        if os.path.exists(recovered_file):
+            os.remove(recovered_file)
+    error = None if result.timed_out or result.exceeded else get_run_error(result)
+    return {"stdout": result.stdout, "recovered": recovered, "elapsed": result.elapsed,
+            "timed_out": result.timed_out, "exceeded": result.exceeded, "error": error}
+
+
+def merge_shards(shards):
+    """Merges the results of the shards of a Hashcat run into the result of the whole run.
+    Progress is the sum of the shards, recovered passwords are the union of the shards, so the percentage
+    is the same as the one of a run that is not split. Returns progress, recovered percentage and recovered passwords.
+    """
+    progress, total = 0, None
+    recovered = dict.fromkeys(password for shard in shards for password in shard["recovered"])
+    for shard in shards:
+        progress_line, _ = extract_lines(shard["stdout"])
+        progress += int(progress_line or 0)
+        match = re.search(r"^Recovered\.+:\s*\d+/(\d+)", shard["stdout"], re.MULTILINE)
+        if match:
+            total = int(match.group(1))  # Every shard loads all digests of the target file
+    recovered_line = f"{len(recovered) * 100 / total:.2f}" if total else None
+    return str(progress), recovered_line, list(recovered)
+
+
+def write_recovered(recovered_file, recovered):
+    with open(recovered_file, "w", encoding="utf-8", errors="surrogateescape") as f:
+        f.writelines(f"{password}\n" for password in recovered)
+
+
+async def run_sharded(exp, target_file, attack_file, temp_rf, recovered_file, shards, options=""):
+    """Runs the keyspace shards of a Hashcat run at the same time and merges them.
+    Returns the wall time, progress, recovered percentage, whether a shard timed out, the exceeded budget
+    and the error of a failed shard.
+    """
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_shard(exp, target_file, attack_file, temp_rf, get_shard_file(recovered_file, i),
+                                               skip, count, options) for i, (skip, count) in enumerate(shards)))
+    progress_line, recovered_line, recovered = merge_shards(results)
+    write_recovered(recovered_file, recovered)
+    timed_out = any(result["timed_out"] for result in results)
+    exceeded = next((result["exceeded"] for result in results if result["exceeded"]), None)
+    error = next((result["error"] for result in results if result["error"]), None)
+    return time.perf_counter() - start, progress_line, recovered_line, timed_out, exceeded, error
+
+
+async def count_candidates(exp, attack_file, temp_rf, expected, limit=None):
+    """Counts all and unique candidates of a run with a Bloom filter, Hashcat only writes the candidates.
+    Returns both counts and the estimated false positive rate of the filter, None for all of them when the counting fails.
+    """
+    session = f"count_{os.getpid()}_{os.path.basename(temp_rf)}"
+    cmd = f"{get_candidates_cmd(attack_file, temp_rf, session, limit)} | {get_dedup_cmd(exp, expected, count=True)}"
+    result = await run_process(cmd, cwd=exp.script_dir, name="dedup", split=True)
+    error = get_run_error(result, codes=(0,))
+    if error:
+        print(f"ERROR: Counting of candidates failed, {error}: {cmd}")
+        return None, None, None
+    return parse_counts(result.stderr)
+
+
+def print_duplicates(cmd, raw_guesses, effective_guesses, error_rate):
+    if raw_guesses:
+        print(f"CANDIDATES: {effective_guesses:,} of {raw_guesses:,} are unique "
+              f"({1 - effective_guesses / raw_guesses:.2%} duplicates, estimated false positive rate {error_rate:.4%}): {cmd}")
+
+
+def get_budget(exp):
+    """Returns the wall time, memory and candidate budget of a Hashcat run."""
+    budget = exp.config.budget
+    return {"time": budget.hashcat_time, "memory": budget.hashcat_memory, "candidates": budget.hashcat_candidates}
 
 
-def process_run(rule_file, target_file, attack_file, attack_size, in_size):
+def get_word_limit(budget, attack_size, rule_size):
+    """Returns the number of attack words that keep the guesses within the candidate budget,
+    None when the whole attack file fits. Every word is combined with every rule.
+    """
+    if not budget["candidates"] or int(attack_size) * rule_size <= budget["candidates"]:
+        return None
+    return budget["candidates"] // max(rule_size, 1)
+
+
+def create_recovered_file(exp):
+    """Returns a unique path of the file for passwords recovered by one Hashcat run."""
+    os.makedirs(exp.temp_folder, exist_ok=True)
+    fd, recovered_file = tempfile.mkstemp(dir=exp.temp_folder, prefix="recovered_", suffix=".potfile")
+    os.close(fd)
+    return recovered_file
+
+
+def delete_run_files(temp_rf, is_temp, recovered_file):
+    """Deletes the temporary rule file and the recovered file of a Hashcat run."""
+    if is_temp and os.path.exists(temp_rf):
+        print(f"{temp_rf} was deleted")
+        os.remove(temp_rf)
+    if os.path.exists(recovered_file):
+        print(f"{recovered_file} was deleted")
+        os.remove(recovered_file)
+
+
+async def process_run(exp, rule_file, target_file, attack_file, attack_size, in_size):
     """Processes a single run of Hashcat with the given parameters."""
-    con_stats = shared.CONFIG.stats
-    zxcvbn_recovered = shared.CONFIG.stats.zxcvbn_recovered
-    zxcvbn_score = shared.CONFIG.stats.zxcvbn_score
+    with span("hashcat", "hashcat", rule_file=rule_file, size=int(in_size)), metrics.job("hashcat"):
+        return await run_rule_file(exp, rule_file, target_file, attack_file, attack_size, in_size)
+
+
+async def run_rule_file(exp, rule_file, target_file, attack_file, attack_size, in_size):
+    """Runs Hashcat with a rule file unless the log has its results. Returns False if the run failed."""
+    con_stats = exp.config.stats
+    zxcvbn_recovered = exp.config.stats.zxcvbn_recovered
+    zxcvbn_score = exp.config.stats.zxcvbn_score
 
     in_size = int(in_size)
-    temp_rf, is_temp = prepare_rulefile(rule_file, in_size)
-    if not temp_rf: return
+    temp_rf, is_temp = prepare_rulefile(exp, rule_file, in_size)
+    if not temp_rf: return True
     
     temp_size = in_size
     if in_size == 0:
         temp_size = count_lines_in_file(temp_rf)
 
     # Build command for Hashcat and zxcvbn
-    cmd = get_cmd(in_size, target_file, attack_file, temp_rf)
-    zxcvbn_cmd = f"zcvbn R:{rule_file} A:{attack_file} T:{target_file}"
+    cmd = get_log_cmd(rule_file, target_file, attack_file, in_size, exp.config.dedup.stream)
+    zxcvbn_cmd = get_zxcvbn_cmd(rule_file, target_file, attack_file)
 
     # Check if the command has already been run
-    if shared.LOG and has_command_run(cmd):
+    if exp.log and has_command_run(exp, cmd, get_budget(exp)):
         print(f"ALREADY RUN {cmd}")
-        if (shared.CONFIG.stats.recovered_guesses and not is_hashcat_record_in_csv(rule_file, temp_size, attack_file, target_file)):
-            hashcat_from_log_to_csv(cmd, temp_size, attack_size)
+        if (exp.config.stats.recovered_guesses and not is_hashcat_record_in_csv(exp, rule_file, temp_size, attack_file, target_file)):
+            hashcat_from_log_to_csv(exp, cmd, temp_size, attack_size)
             
         # Load zxcvbn record from log to CSV
         print(f"{zxcvbn_cmd}")
         if (zxcvbn_recovered or zxcvbn_score):
-            if (not is_file_record_in_csv(con_stats.zxcvbn_recovered_csv_file, "file_name", rule_file)
-                and not is_file_record_in_csv(con_stats.zxcvbn_score_csv_file, "file_name", rule_file)):
-                zxcvbn_from_log_to_csv(zxcvbn_cmd, rule_file)
-        return
+            if (not is_file_record_in_csv(exp, con_stats.zxcvbn_recovered_csv_file, "file_name", rule_file)
+                and not is_file_record_in_csv(exp, con_stats.zxcvbn_score_csv_file, "file_name", rule_file)):
+                zxcvbn_from_log_to_csv(exp, zxcvbn_cmd, rule_file)
+        return True
 
     print(f"RUN: {cmd}")
-    process = subprocess.run(cmd, capture_output=True, shell=True, cwd=shared.SCRIPT_DIR)
-    stdout = process.stdout.decode(errors="replace")
-    progress_line, recovered_line = extract_lines(stdout)
+    recovered_file = create_recovered_file(exp)
+    try:
+        return await run_and_record(exp, cmd, zxcvbn_cmd, rule_file, target_file, attack_file, attack_size, in_size,
+                             temp_rf, temp_size, recovered_file)
+    finally:
+        delete_run_files(temp_rf, is_temp, recovered_file)
+
+
+async def run_and_record(exp, cmd, zxcvbn_cmd, rule_file, target_file, attack_file, attack_size, in_size,
+                         temp_rf, temp_size, recovered_file):
+    """Runs Hashcat as an async subprocess and saves its results.
+    Returns False if the run timed out, failed or has too many candidates for the dedup filter.
+    """
+    timeout = exp.config.general.run_timeout or None
+    budget = get_budget(exp)
+
+    # Too many guesses for the candidate budget, only the first words of the attack file are used
+    limit = get_word_limit(budget, attack_size, temp_size)
+    if limit == 0:
+        print(f"OVER BUDGET: {temp_size} rules exceed the budget of {budget['candidates']} candidates: {cmd}")
+        record_run(exp, cmd, rule_file, temp_size, attack_file, attack_size, target_file, None, "0", None, budget, "candidates")
+        return True
+
+    # Beyond its capacity the filter drops more unique candidates, a streamed run is refused then
+    dedup = exp.config.dedup
+    expected = (limit or int(attack_size)) * temp_size  # Candidates of the run
+    capacity = bloom_capacity(dedup.memory, dedup.error_rate)
+    if dedup.stream and expected > capacity:
+        error = f"{expected:,} candidates exceed the capacity of the dedup filter ({capacity:,} with {dedup.memory} MB)"
+        print(f"ERROR: {error}, increase dedup.memory or disable dedup.stream: {cmd}")
+        metrics.fail_job()
+        if exp.log:
+            log_command(exp, cmd, "error", error_message=error)
+        return False
+
+    plain_target, is_temp_target = decompress_to_scratch(exp, target_file)
+    # Tuned workload options of this host, the first run tunes them on a slice of its attack
+    options = await asyncio.to_thread(get_options, exp, lambda: get_slice_cmd(exp, plain_target, attack_file, temp_rf))
+    shards = get_shards(exp, attack_size, limit)
+    dedup_cmd, raw_guesses, effective_guesses, error_rate = None, None, None, None
+    try:
+        if len(shards) > 1:
+            # Large runs are split into keyspace shards that run at the same time
+            print(f"SHARDS: {len(shards)} shards of {cmd}")
+            elapsed, progress_line, recovered_line, timed_out, exceeded, error = await run_sharded(
+                exp, plain_target, attack_file, temp_rf, recovered_file, shards, options)
+        else:
+            # Only unique candidates are passed to Hashcat, the filter reports how many candidates it read
+            dedup_cmd = get_dedup_cmd(exp, expected) if exp.config.dedup.stream else None
+            exec_cmd = get_exec_cmd(in_size, plain_target, attack_file, temp_rf, recovered_file, limit, dedup_cmd=dedup_cmd) + options
+            on_line = None
+            if metrics.is_enabled() or budget["time"] or budget["memory"]:
+                # Hashcat prints its status periodically, the metrics follow its speed and progress
+                # and a run stopped by its budget keeps the progress of its last status
+                exec_cmd += f" --status --status-timer={STATUS_INTERVAL}"
+            if metrics.is_enabled():
+                on_line = lambda stream, line: update_status_metrics(rule_file, in_size, line)
+            # Stages of compressed and deduplicated attacks run as separate processes, so every exit code is checked
+            result = await run_process(exec_cmd, cwd=exp.script_dir, timeout=timeout, name="hashcat", on_line=on_line,
+                                       time_limit=budget["time"] or None, memory_limit=budget["memory"] or None, split=True)
+            elapsed, timed_out, exceeded = result.elapsed, result.timed_out, result.exceeded
+            error = None if timed_out or exceeded else get_run_error(result)
+            progress_line, recovered_line = extract_lines(result.stdout)
+            if dedup_cmd:
+                raw_guesses, effective_guesses, error_rate = parse_counts(result.stderr)
+    finally:
+        if is_temp_target:
+            os.remove(plain_target)
+
+    if error:
+        print(f"ERROR: Hashcat run failed, {error}: {cmd}")
+        metrics.fail_job()
+        if exp.log:
+            log_command(exp, cmd, "error", error_message=error)
+        return False
+
+    # Without deduplication the candidates of a finished run are counted once more by the Bloom filter
+    if exp.config.dedup.measure and not dedup_cmd and not timed_out and not exceeded:
+        raw_guesses, effective_guesses, error_rate = await count_candidates(exp, attack_file, temp_rf, expected, limit)
+    print_duplicates(cmd, raw_guesses, effective_guesses, error_rate)
+
+    if timed_out:
+        print(f"ERROR: Hashcat was stopped after {timeout} s: {cmd}")
+        metrics.fail_job()
+        if exp.log:
+            log_command(exp, cmd, "error", error_message=f"Timeout after {timeout} s")
+        return False
+
+    exceeded = exceeded or ("candidates" if limit else None)
+    if exceeded:
+        print(f"OVER BUDGET: Hashcat exceeded the {exceeded} budget: {cmd}")
+    record_run(exp, cmd, rule_file, temp_size, attack_file, attack_size, target_file, f"{elapsed:.2f}",
+               progress_line, recovered_line, budget, exceeded, raw_guesses, effective_guesses)
+
+    # Run zxcvbn analysis, passwords recovered by a run stopped by its budget are not analyzed
+    if needs_zxcvbn(exp, rule_file, in_size, exceeded):
+        # zxcvbn is pure Python, it runs in a thread to keep the event loop free for other runs
+        await asyncio.to_thread(run_zxcvbn, exp, zxcvbn_cmd, rule_file, recovered_line, recovered_file)
+    return True
 
-    if shared.LOG:
+
+def get_zxcvbn_cmd(rule_file, target_file, attack_file):
+    """Returns the logged command of the zxcvbn analysis of passwords recovered with a rule file."""
+    return f"zcvbn R:{rule_file} A:{attack_file} T:{target_file}"
+
+
+def needs_zxcvbn(exp, rule_file, in_size, exceeded):
+    """Checks if the passwords recovered with a full rule file are still to be analyzed by zxcvbn."""
+    con_stats = exp.config.stats
+    return (in_size == 0 and not exceeded and (con_stats.zxcvbn_recovered or con_stats.zxcvbn_score)
+            and not is_file_record_in_csv(exp, con_stats.zxcvbn_recovered_csv_file, "file_name", rule_file)
+            and not is_file_record_in_csv(exp, con_stats.zxcvbn_score_csv_file, "file_name", rule_file))
+
+
+async def run_shard_job(exp, rule_file, target_file, attack_file, attack_size, in_size, shards, index):
+    """Runs one shard of a Hashcat run on a worker and returns its results for merge_shards."""
+    in_size = int(in_size)
+    temp_rf, is_temp = prepare_rulefile(exp, rule_file, in_size)
+    plain_target, is_temp_target = decompress_to_scratch(exp, target_file)
+    recovered_file = create_recovered_file(exp)
+    skip, count = shards[index]
+    try:
+        options = await asyncio.to_thread(get_options, exp, lambda: get_slice_cmd(exp, plain_target, attack_file, temp_rf))
+        with span("hashcat", "hashcat", rule_file=rule_file, size=in_size, shard=index):
+            return await run_shard(exp, plain_target, attack_file, temp_rf, recovered_file, skip, count, options)
+    finally:
+        delete_run_files(temp_rf, is_temp, recovered_file)
+        if is_temp_target:
+            os.remove(plain_target)
+
+
+def record_shards(exp, rule_file, target_file, attack_file, attack_size, in_size, results):
+    """Saves the merged results of the shards of a Hashcat run that ran on workers."""
+    in_size = int(in_size)
+    cmd = get_log_cmd(rule_file, target_file, attack_file, in_size, exp.config.dedup.stream)
+    rule_size = in_size or count_lines_in_file(rule_file)
+    budget = get_budget(exp)
+    if any(result["timed_out"] for result in results):
+        print(f"ERROR: A shard of Hashcat was stopped after {exp.config.general.run_timeout} s: {cmd}")
+        if exp.log:
+            log_command(exp, cmd, "error", error_message=f"Timeout after {exp.config.general.run_timeout} s")
+        return
+    error = next((result["error"] for result in results if result.get("error")), None)
+    if error:
+        print(f"ERROR: A shard of Hashcat failed, {error}: {cmd}")
+        if exp.log:
+            log_command(exp, cmd, "error", error_message=error)
+        return
+
+    progress_line, recovered_line, recovered = merge_shards(results)
+    exceeded = next((result["exceeded"] for result in results if result["exceeded"]), None)
+    exceeded = exceeded or ("candidates" if get_word_limit(budget, attack_size, rule_size) else None)
+    elapsed = max(result["elapsed"] for result in results)  # The shards ran at the same time
+
+    raw_guesses, effective_guesses = None, None
+    if exp.config.dedup.measure and not exceeded:
+        limit = get_word_limit(budget, attack_size, rule_size)
+        temp_rf, is_temp = prepare_rulefile(exp, rule_file, in_size)
+        try:
+            raw_guesses, effective_guesses, error_rate = asyncio.run(count_candidates(
+                exp, attack_file, temp_rf, (limit or int(attack_size)) * rule_size, limit))
+        finally:
+            if is_temp:
+                os.remove(temp_rf)
+        print_duplicates(cmd, raw_guesses, effective_guesses, error_rate)
+    record_run(exp, cmd, rule_file, rule_size, attack_file, attack_size, target_file, f"{elapsed:.2f}",
+               progress_line, recovered_line, budget, exceeded, raw_guesses, effective_guesses)
+
+    if needs_zxcvbn(exp, rule_file, in_size, exceeded):
+        recovered_file = create_recovered_file(exp)
+        write_recovered(recovered_file, recovered)
+        run_zxcvbn(exp, get_zxcvbn_cmd(rule_file, target_file, attack_file), rule_file, recovered_line, recovered_file)
+
+
+def record_run(exp, cmd, rule_file, rule_size, attack_file, attack_size, target_file, time, progress_line, recovered_line,
+               budget, exceeded, raw_guesses=None, effective_guesses=None):
+    """Saves the results of a Hashcat run to the log and the CSV file."""
+    status = OVER_BUDGET if exceeded else "done"
+    if exp.log:
         log_command(
+            exp,
             cmd,
-            "done",
+            status,
             rule_file=rule_file,
-            rule_size=str(temp_size),
+            rule_size=str(rule_size),
             attack=attack_file,
             target=target_file,
+            time=time,
             progress_line=progress_line,
             recovered_line=recovered_line,
+            budget=budget if exceeded else None,
+            exceeded=exceeded,
+            raw_guesses=raw_guesses,
+            effective_guesses=effective_guesses,
         )
-    hashcat_to_csv(rule_file, temp_size, attack_file, attack_size, target_file, progress_line, recovered_line)
+    hashcat_to_csv(exp, rule_file, rule_size, attack_file, attack_size, target_file, progress_line, recovered_line, status,
+                   raw_guesses, effective_guesses)
 
-    # Run zxcvbn analysis
-    if in_size == 0 and (zxcvbn_recovered or zxcvbn_score):
-        if (not is_file_record_in_csv(con_stats.zxcvbn_recovered_csv_file, "file_name", rule_file)
-            and not is_file_record_in_csv( con_stats.zxcvbn_score_csv_file, "file_name", rule_file)):
-            run_zxcvbn(zxcvbn_cmd, rule_file, recovered_line, True)
-
-    # Delete temporary file
-    if is_temp:
-        print(f"{temp_rf} was deleted")
-        os.remove(temp_rf)
-    if os.path.exists(shared.RECOVERED_FILE):
-        print(f"{shared.RECOVERED_FILE} was deleted")
-        os.remove(shared.RECOVERED_FILE)
 
+def run_hashcat(exp, rules_files=None, attack_sizes=None):
+    """Main function to run Hashcat.
+    Runs all rule files of the experiment, or only 'rules_files'. 'attack_sizes' are the line counts
+    of the attack files if they are already known. Returns the number of failed runs.
+    """
+    if rules_files is None:
+        rules_files = get_rules_list(exp)
 
-def run_hashcat():
-    """Main function to run Hashcat."""
-    rules_files = get_rules_list()
-
-    for attack_file in shared.ATTACK_LIST:
-        attack_size = count_lines_in_file(attack_file)
-        for target_file in shared.TARGET_LIST:
+    runs = []
+    for attack_file in exp.attack_list:
+        attack_size = attack_sizes[attack_file] if attack_sizes else count_lines_in_file(attack_file)
+        for target_file in exp.target_list:
             for rule_file in rules_files:
                 if not os.path.exists(rule_file):
                     print("Hashcat: Rule file not found.")
                     exit(-1)
                     break
-                for k, in_size in enumerate(shared.CONFIG.input.rules_size):
-                    process_run(rule_file, target_file, attack_file, attack_size, in_size)
+                for k, in_size in enumerate(exp.config.input.rules_size):
+                    runs.append(process_run(exp, rule_file, target_file, attack_file, attack_size, in_size))
+
+    # All runs share one event loop, at most 'parallel_runs' of them at the same time
+    metrics.jobs_queued("hashcat", len(runs))
+    results = asyncio.run(gather_limited(runs, exp.config.general.parallel_runs))
+    return results.count(False)
@@ -1,57 +1,130 @@
 # Author: Andrea Michlíková - xmichl11
 
 import os
-import csv
-from jinja2 import Environment, FileSystemLoader
+import threading
 from collections import defaultdict
 import src.shared as shared
+import src.store as store
 from src.files import count_lines_in_file, save_to_file
-
-
-def program_tex():
+from src.log import OVER_BUDGET
+
+# Jinja2 environment shared by all renderers, templates are compiled only once
+_ENV = None
+
+
+def get_template(name):
+    """Returns a compiled template from the templates folder."""
+    global _ENV
+    if _ENV is None:
+        from jinja2 import Environment, FileSystemLoader  # Jinja2 is loaded only when a LaTeX output is rendered
+        _ENV = Environment(loader=FileSystemLoader("templates"))
+    return _ENV.get_template(name)
+
+
+class ResultsModel:
+    """Results loaded once and shared by all renderers."""
+
+    def __init__(self, exp):
+        self.exp = exp
+        self._tables = {}
+        self._line_counts = {}
+        self._lock = threading.Lock()  # Renderers can run in parallel stages
+
+    def records(self, table):
+        """Returns the records of a table, the table is loaded on first use."""
+        with self._lock:
+            if table not in self._tables:
+                self._tables[table] = store.load_records(self.exp, table)
+            return self._tables[table]
+
+    def count_lines(self, file_path):
+        """Returns the number of lines in a file, every file is counted only once."""
+        with self._lock:
+            if file_path not in self._line_counts:
+                self._line_counts[file_path] = count_lines_in_file(file_path)
+            return self._line_counts[file_path]
+
+
+def is_finished(row, *columns):
+    """Returns whether a row is a finished run with values in all the columns.
+    Runs stopped by their budget have only partial results and are not plotted.
+    """
+    return row.status != OVER_BUDGET and all(getattr(row, column) is not None for column in columns)
+
+
+def lttb(points, threshold):
+    """Returns the indices of the points kept by the largest-triangle-three-buckets downsampling.
+    The first and the last point are always kept. The points between them are split into buckets and from every
+    bucket the point that forms the largest triangle with the previous kept point and the mean of the next bucket
+    is kept, so peaks and the shape of the curve stay. Points have to be sorted by x.
+    """
+    n = len(points)
+    if not threshold or n <= threshold:
+        return list(range(n))
+    threshold = max(threshold, 3)
+
+    every = (n - 2) / (threshold - 2)  # Points in one bucket
+    kept = [0]
+    for i in range(threshold - 2):
+        start, end = int(i * every) + 1, int((i + 1) * every) + 1
+        next_points = points[end:min(int((i + 2) * every) + 1, n)]
+        mean_x = sum(x for x, y, *_ in next_points) / len(next_points)
+        mean_y = sum(y for x, y, *_ in next_points) / len(next_points)
+        ax, ay = points[kept[-1]][:2]
+        kept.append(max(range(start, end), key=lambda j: abs((ax - mean_x) * (points[j][1] - ay)
+                                                             - (ax - points[j][0]) * (mean_y - ay))))
+    kept.append(n - 1)
+    return kept
+
+
+def downsample(plot, threshold, name):
+    """Reduces the points of a plot and their error bars to the point budget."""
+    kept = lttb(plot["points"], threshold)
+    if len(kept) == len(plot["points"]):
+        return plot
+    print(f"TEX: Plot {name} was downsampled from {len(plot['points'])} to {len(kept)} points")
+    plot["points"] = [plot["points"][i] for i in kept]
+    if plot.get("errors"):
+        plot["errors"] = [plot["errors"][i] for i in kept]
+    return plot
+
+
+def program_tex(exp, model=None):
     """Generates LaTeX graphs for program statistics."""
-    # Path to the CSV file containing program statistics
-    csv_path = shared.CONFIG.stats.program_csv_file
-
-    # Initialize the Jinja2 environment and load the template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template("program_graph.tex.jinja")
-
-    # Iterate over different statistic types
-    for stat_type in ["memory", "time", "cpu", "rules"]:
-        if stat_type == "memory" and not shared.CONFIG.stats.memory_passwords:
-            continue
-        if stat_type == "time" and not shared.CONFIG.stats.time_passwords:
+    model = model or ResultsModel(exp)
+    template = get_template("program_graph.tex.jinja")
+
+    # Statistic types enabled in the configuration
+    stat_types = [stat_type for stat_type in ["memory", "time", "cpu", "rules"]
+                  if getattr(exp.config.stats, f"{stat_type}_passwords")]
+    grouped = {stat_type: defaultdict(list) for stat_type in stat_types}
+
+    # Process each row of the program statistics once for all statistic types
+    for row in model.records("program"):
+        if not is_finished(row, "size"):
+            print(f"TEX PROGRAM: Skipping unfinished run of {row.program} for rule_file {row.rule_file}")
             continue
-        if stat_type == "cpu" and not shared.CONFIG.stats.cpu_passwords:
-            continue
-        if stat_type == "rules" and not shared.CONFIG.stats.rules_passwords:
-            continue
-        
-        
-        grouped = defaultdict(list)
-
-        # Open the CSV file and read its content
-        with open(csv_path, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
+        size = int(row.size)
 
-            # Process each row in the CSV file
-            for row in reader:
-                size = int(row['size'])
+        # Skip rows with sizes not in the allowed wordlist sizes
+        if size not in exp.config.input.wordlist_size:
+            if ((model.count_lines(row.wordlist) != size)
+                or (0 not in exp.config.input.wordlist_size)):
+                print(f"TEX PROGRAM: Skipping size {size} for wordlist {row.wordlist}")
+                continue
 
-                # Skip rows with sizes not in the allowed wordlist sizes
-                if size not in shared.CONFIG.input.wordlist_size:
-                    if ((count_lines_in_file(row["wordlist"]) != size)
-                        or (0 not in shared.CONFIG.input.wordlist_size)):
-                        print(f"TEX PROGRAM: Skipping size {size} for wordlist {row['wordlist']}")
-                        continue
+        # Group data by program and run index
+        # Confidence intervals exist only for measured statistics of runs with more trials
+        key = (row.program, int(row.run_index))
+        for stat_type in stat_types:
+            ci = getattr(row, f"{stat_type}_ci", None) if (row.trials or 1) > 1 else None
+            grouped[stat_type][key].append((size, float(getattr(row, stat_type)), ci))
 
-                # Group data by program and run index
-                key = (row['program'], int(row['run_index']))
-                grouped[key].append((int(row["size"]), float(row[stat_type])))
+    # Iterate over different statistic types
+    for stat_type in stat_types:
 
         # Generate the output filename based on the statistic type
-        filename = getattr(shared.CONFIG.stats, f"{stat_type}_passwords_file")
+        filename = getattr(exp.config.stats, f"{stat_type}_passwords_file")
         label_y = {"memory": "Paměť [MB]", "time": "Čas [s]", "cpu": "Průměr CPU v \\%", "rules": "Počet pravidel"}[stat_type]
         title_type = {"memory": "PAMĚŤ", "time": "ČAS", "cpu": "CPU", "rules": "PRAVIDLA"}[stat_type]
         title = f"Generování pravidel - {title_type}"
@@ -59,14 +132,16 @@ def program_tex():
         plots = []  # List to store plot data
 
         # Process grouped data to create plots
-        for i, ((program, run_index), rows) in enumerate(grouped.items()):
+        for i, ((program, run_index), rows) in enumerate(grouped[stat_type].items()):
             rows = sorted(rows, key=lambda r: r[0])  # Sort rows by size
-            points = [(size, value, "") for size, value in rows]  # Prepare points for the plot
-            plots.append({
+            points = [(size, value, "") for size, value, _ in rows]  # Prepare points for the plot
+            has_errors = any(ci is not None for _, _, ci in rows)
+            plots.append(downsample({
                 "legend": f"{program} {run_index}",
                 "points": points,
+                "errors": [ci or 0 for _, _, ci in rows] if has_errors else None,  # 95% CI as error bars
                 "comment": f"{program} {run_index}"
-            })
+            }, exp.config.stats.plot_points, f"{program} {run_index}"))
 
         # Render the LaTeX content using the template
         content = template.render(
@@ -83,36 +158,32 @@ def program_tex():
         print(f"Program LaTeX file saved to {filename}")
 
 
-def hashcat_tex():
+def hashcat_tex(exp, model=None):
     """Generates LaTeX graphs for Hashcat statistics."""
-    # Path to the CSV file containing Hashcat statistics
-    csv_path = shared.CONFIG.stats.hashcat_csv_file
-
-    # Initialize the Jinja2 environment and load the template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template("program_graph.tex.jinja")
+    model = model or ResultsModel(exp)
+    template = get_template("program_graph.tex.jinja")
 
-    # Open the CSV file and read its content
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        grouped = defaultdict(list)
+    grouped = defaultdict(list)
 
-        # Process each row in the CSV file
-        for row in reader:
-            size = int(row['rule_size'])
+    # Process each row of the Hashcat statistics
+    for row in model.records("hashcat"):
+        if not is_finished(row, "rule_size", "attack_size", "progress", "recovered"):
+            print(f"TEX HASHCAT: Skipping unfinished run for rule_file {row.rule_file}")
+            continue
+        size = int(row.rule_size)
 
-            # Skip rows with sizes not in the allowed rule sizes
-            if size not in shared.CONFIG.input.rules_size:
-                if (count_lines_in_file(row["rule_file"]) != size
-                    or 0 not in shared.CONFIG.input.rules_size):
-                    print(f"TEX HASHCAT: Skipping size {size} for rule_file {row['rule_file']}")
-                    continue
+        # Skip rows with sizes not in the allowed rule sizes
+        if size not in exp.config.input.rules_size:
+            if (model.count_lines(row.rule_file) != size
+                or 0 not in exp.config.input.rules_size):
+                print(f"TEX HASHCAT: Skipping size {size} for rule_file {row.rule_file}")
+                continue
 
-            # Group data by rule file
-            grouped[row['rule_file']].append(row)
+        # Group data by rule file
+        grouped[row.rule_file].append(row)
 
     # Get filename for the LaTeX file and define the title for the graph
-    filename = shared.CONFIG.stats.recovered_guesses_file
+    filename = exp.config.stats.recovered_guesses_file
     title = "Prolomená hesla"
 
     plots = []  # List to store plot data
@@ -120,16 +191,16 @@ def hashcat_tex():
     # Process grouped data to create plots
     for i, (rule_file, rows) in enumerate(grouped.items()):
         # Sort rows by rule size
-        rows = sorted(rows, key=lambda r: int(r['rule_size']))
+        rows = sorted(rows, key=lambda r: int(r.rule_size))
 
         # Prepare points for the plot
-        points = [(int(r['rule_size']) * int(r['attack_size']),
-                   float(r['recovered']),
-                   f"% progress = {int(r['progress'])}")for r in rows]
+        points = [(int(r.rule_size) * int(r.attack_size),
+                   float(r.recovered),
+                   f"% progress = {int(r.progress)}")for r in rows]
         file = os.path.basename(rule_file).replace("_", "\\_")
 
-        # Append plot data
-        plots.append({"legend": file, "points": points, "comment": file})
+        # Append plot data, long series are reduced to the point budget
+        plots.append(downsample({"legend": file, "points": points, "comment": file}, exp.config.stats.plot_points, rule_file))
 
     # Render the LaTeX content using the template
     content = template.render(
@@ -146,35 +217,27 @@ def hashcat_tex():
     print(f"Hashcat LaTeX file saved to {filename}")
 
 
-def zxcvbn_score_tex():
+def zxcvbn_score_tex(exp, model=None):
     """Generates LaTeX bar graphs for zxcvbn score distribution."""
-    # Path to the CSV file containing zxcvbn score statistics
-    csv_path = shared.CONFIG.stats.zxcvbn_score_csv_file
-
-    # Initialize the Jinja2 environment and load the template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template("bar_graph.tex.jinja")
+    model = model or ResultsModel(exp)
+    template = get_template("bar_graph.tex.jinja")
 
     plots = []  # List to store plot data
     max_y = 0  # Variable to track the maximum Y value for the graph
 
-    # Open the CSV file and read its content
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
+    # Process each row of the zxcvbn score statistics
+    for row in model.records("zxcvbn_score"):
+        file_name = row.file_name
+        recovered = float(row.recovered)
 
-        # Process each row in the CSV file
-        for row in reader:
-            file_name = row['file_name']
-            recovered = float(row['recovered'])
+        # Prepare points for the bar graph (score distribution)
+        points = [(i, int(getattr(row, f"score_{i}"))) for i in range(5)]
+        max_y = max(max_y, max(count for _, count in points))
 
-            # Prepare points for the bar graph (score distribution)
-            points = [(i, int(row[f"score_{i}"])) for i in range(5)]
-            max_y = max(max_y, max(count for _, count in points))
-
-            # Append plot data for the current file
-            plots.append({"legend": file_name.replace("_", "\\_"),
-                          "points": points,
-                          "recovered": recovered})
+        # Append plot data for the current file
+        plots.append({"legend": file_name.replace("_", "\\_"),
+                      "points": points,
+                      "recovered": recovered})
 
     # Define labels and title for the graph
     title = "Rozložení skóre prolomených hesel"
@@ -191,31 +254,23 @@ def zxcvbn_score_tex():
     )
 
     # Save the rendered content to a file
-    filename = shared.CONFIG.stats.zxcvbn_score_file
+    filename = exp.config.stats.zxcvbn_score_file
     save_to_file(filename, content)
     print(f"Zxcvbn LaTeX file saved to {filename}")
 
 
-def zxcvbn_recovered_tex():
+def zxcvbn_recovered_tex(exp, model=None):
     """Generates LaTeX bar graphs for password recovery difficulty."""
-    # Path to the CSV file containing zxcvbn recovered statistics
-    csv_path = shared.CONFIG.stats.zxcvbn_recovered_csv_file
-
-    # Initialize the Jinja2 environment and load the template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template("bar_graph.tex.jinja")
+    model = model or ResultsModel(exp)
+    template = get_template("bar_graph.tex.jinja")
 
-    # Open the CSV file and read its content
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        grouped = defaultdict(list)
-
-        # Process each row in the CSV file
-        for row in reader:
-            grouped[row['file_name']].append(row)
+    # Group the zxcvbn recovered statistics by file
+    grouped = defaultdict(list)
+    for row in model.records("zxcvbn_recovered"):
+        grouped[row.file_name].append(row)
 
     # Define the output filename and graph title
-    filename = shared.CONFIG.stats.zxcvbn_recovered_file
+    filename = exp.config.stats.zxcvbn_recovered_file
     title = "Náročnost prolomení hesel"
 
     plots = []  # List to store plot data
@@ -224,16 +279,16 @@ def zxcvbn_recovered_tex():
     # Process grouped data to create plots
     for i, (file_name, rows) in enumerate(grouped.items()):
         # Sort rows by the logarithm of guesses
-        rows = sorted(rows, key=lambda r: float(r['guesses_log10']))
+        rows = sorted(rows, key=lambda r: float(r.guesses_log10))
 
         # Prepare points for the bar graph
-        points = [(float(r['guesses_log10']), int(r['n'])) for r in rows]
-        max_y = max(max_y, max(int(r['n']) for r in rows))  # Update max_y
+        points = [(float(r.guesses_log10), int(r.n)) for r in rows]
+        max_y = max(max_y, max(int(r.n) for r in rows))  # Update max_y
 
         # Append plot data for the current file
         plots.append({"legend": file_name.replace("_", "\\_"),
                       "points": points,
-                      "recovered": float(rows[0]['recovered'])})
+                      "recovered": float(rows[0].recovered)})
 
     # Round the maximum Y value to the nearest thousand for better graph scaling
     ymax = ((max_y + 999) // 1000) * 1000
@@ -250,46 +305,26 @@ def zxcvbn_recovered_tex():
     print(f"Zxcvbn recovered LaTeX file saved to {filename}")
 
 
-def program_hashcat_tex_table():
+def program_hashcat_tex_table(exp, model=None):
     """Generates LaTeX tables for Program and Hashcat statistics."""
-    # Paths to the CSV files
-    hashcat_csv_path = shared.CONFIG.stats.hashcat_csv_file
-    program_csv_path = shared.CONFIG.stats.program_csv_file
-
-    # Load the LaTeX template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template("table.tex.jinja")  # Template for tables
-
-    # Load data from the Hashcat CSV file
-    hashcat_data = {}
-    with open(hashcat_csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            key = row['rule_file']  # Use the rule file as the key
-            hashcat_data[key] = {
-                "recovered": float(row['recovered']),  # Percentage of recovered passwords
-            }
-
-    # Load data from the program CSV file and combine it with Hashcat data
-    program_data = defaultdict(list)
-    with open(program_csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            program = row['program']  # Program name
-            rule_file = row['rule_file']  # Rule file name
-
-            # Skip if the rule file is not in the Hashcat data
-            if rule_file not in hashcat_data:
-                continue
+    model = model or ResultsModel(exp)
+    template = get_template("table.tex.jinja")  # Template for tables
 
-            # Combine data from both CSV files
-            program_data[program].append((
-                row['run_index'],
-                float(row['time']),
-                float(row['memory']),
-                int(row['rules']),
-                hashcat_data.get(rule_file, {}).get("recovered", 0.0)
-            ))
+    # Last finished Hashcat result of each rule file
+    recovered = {row.rule_file: float(row.recovered) for row in model.records("hashcat") if is_finished(row, "recovered")}
+
+    # Combine statistics of finished programs with the Hashcat results
+    program_data = defaultdict(list)
+    for row in model.records("program"):
+        if row.rule_file not in recovered or not is_finished(row, "time", "memory", "rules"):
+            continue
+        program_data[row.program].append((
+            row.run_index,
+            float(row.time),
+            float(row.memory),
+            int(row.rules),
+            recovered[row.rule_file],
+        ))
 
     content = ""  # Initialize the content for the LaTeX file
 
@@ -301,7 +336,7 @@ def program_hashcat_tex_table():
         content += "\n\n"
 
     # Save the combined content to a single LaTeX file
-    filename = os.path.join(shared.CONFIG.general.stats_folder, "hashcat_table.tex")
+    filename = os.path.join(exp.config.general.stats_folder, "hashcat_table.tex")
     save_to_file(filename, content)
     print(f"Hashcat LaTeX table saved to {filename}")
 
@@ -334,14 +369,11 @@ def rule_to_tex(rule):
     return tex_rule
 
 
-def rules_tex_table():
+def rules_tex_table(exp, model=None):
     """Generates LaTeX tables for rule statistics."""
-    # Path to the CSV file containing rule statistics
-    rules_csv_path = shared.CONFIG.stats.rules_csv_file
-
-    # Load the LaTeX template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template = env.get_template("rule_table.tex.jinja")
+    model = model or ResultsModel(exp)
+    template = get_template("rule_table.tex.jinja")
+    header = store.get_header("rules")
 
     # Prepare data structures for the templates
     data_order = defaultdict(dict)  # Dictionary for rule_file and individual rules
@@ -351,30 +383,28 @@ def rules_tex_table():
     group_names = {}  # Mapping of groups to their names
     group_rules = {}  # Mapping of groups to their rules
 
-    # Read the CSV file and process its content
-    with open(rules_csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            rule_file = row['rule_file'].replace("_", "\\_")  # Format rule file for LaTeX
-            rule_files.append(os.path.basename(rule_file))  # Add rule file to the list
+    # Process each row of the rule statistics
+    for row in model.records("rules"):
+        rule_file = row.rule_file.replace("_", "\\_")  # Format rule file for LaTeX
+        rule_files.append(os.path.basename(rule_file))  # Add rule file to the list
 
-            # Process each rule in the row
-            for rule, value in row.items():
-                tex_rule = rule_to_tex(rule)  # Convert the rule to LaTeX format
-                if rule == "rule_file":
-                    continue  # Skip the rule_file column
+        # Process each rule in the row
+        for rule, value in zip(header, row):
+            tex_rule = rule_to_tex(rule)  # Convert the rule to LaTeX format
+            if rule == "rule_file":
+                continue  # Skip the rule_file column
 
-                # Add data for ordered rules
-                data_order[tex_rule][rule_file] = int(value)
+            # Add data for ordered rules
+            data_order[tex_rule][rule_file] = int(value)
 
-                # Get the English and Czech names for the rule
-                english_name, czech_name = shared.RULE_ORDER.get(rule, ("Unknown", "Neznámé"))
-                rule_names[tex_rule] = czech_name  # Store the Czech name (or English if needed)
+            # Get the English and Czech names for the rule
+            english_name, czech_name = shared.RULE_ORDER.get(rule, ("Unknown", "Neznámé"))
+            rule_names[tex_rule] = czech_name  # Store the Czech name (or English if needed)
 
-                # Add data for grouped rules
-                for group_name, group_data in shared.RULE_GROUPS.items():
-                    if rule in group_data['rules']:
-                        data_group[group_name][rule_file] += int(value)
+            # Add data for grouped rules
+            for group_name, group_data in shared.RULE_GROUPS.items():
+                if rule in group_data['rules']:
+                    data_group[group_name][rule_file] += int(value)
 
     # Process group names and their rules
     for group_name, group_data in shared.RULE_GROUPS.items():
@@ -384,8 +414,8 @@ def rules_tex_table():
 
     # Generate the LaTeX content for the grouped or ordered rules table
     content += template.render(
-        rule_order=shared.CONFIG.stats.analyze_rules,
-        rule_group=shared.CONFIG.stats.analyze_rules,
+        rule_order=exp.config.stats.analyze_rules,
+        rule_group=exp.config.stats.analyze_rules,
         header=rule_files,
         header_size=len(rule_files),
         data_group={group_name: data_group[group_name] for group_name in shared.RULE_GROUPS},
@@ -394,52 +424,50 @@ def rules_tex_table():
         rule_name=rule_names)
 
     # Save the generated content to a LaTeX file
-    filename = shared.CONFIG.stats.analyze_rules_file
+    filename = exp.config.stats.analyze_rules_file
     save_to_file(filename, content)
     print(f"LaTeX table saved to {filename}")
 
 
-def wordlist_tex_table():
+def wordlist_tex_table(exp, model=None):
     """Generates LaTeX tables for wordlist statistics."""
-    # Path to the CSV file containing wordlist statistics
-    csv_path = shared.CONFIG.stats.wordlist_csv_file
-
-    # Load the LaTeX template
-    env = Environment(loader=FileSystemLoader("templates"))
-    template_group = env.get_template("wordlist_table.tex.jinja")
+    model = model or ResultsModel(exp)
+    template_group = get_template("wordlist_table.tex.jinja")
+    header = store.get_header("wordlist")
 
     # Initialize data structures
     data = []  # Data for the first table
     charset_data = defaultdict(dict)  # Data for the second table (charset × wordlist)
     wordlists = []  # List of wordlists (for table headers)
 
-    # Open the CSV file and read its content
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            file = os.path.basename(row['wordlist']).replace("_", "\\_")
-            wl_size = int(row['size'])
-            entropy_above = f"{(int(row['entropy_above']) / wl_size) * 100:.2f}\\%"
-            ascii = f"{(int(row['ascii']) / wl_size) * 100:.2f}\\%"
-            
-            data.append([
-                file,
-                wl_size,
-                row['avg_len'],
-                row['median_len'],
-                row['avg_entropy'],
-                entropy_above,
-                ascii,
-            ])
-
-            # Add the wordlist to the list of headers
-            wordlists.append(file)
-
-            # Process charset counts for the second table
-            for charset, count in row.items():
-                if charset in shared.CHARSET.keys(): 
-                    cz_charset = shared.CHARSET[charset] 
-                    charset_data[cz_charset][file] = int(count)
+    # Process each row of the wordlist statistics
+    for row in model.records("wordlist"):
+        file = os.path.basename(row.wordlist).replace("_", "\\_")
+        wl_size = int(row.size)
+        entropy_above = f"{(int(row.entropy_above) / wl_size) * 100:.2f}\\%"
+        ascii = f"{(int(row.ascii) / wl_size) * 100:.2f}\\%"
+        
+        data.append([
+            file,
+            wl_size,
+            row.avg_len,
+            row.median_len,
+            row.avg_entropy,
+            entropy_above,
+            ascii,
+            row.distinct or "-",
+            row.entropy_p90 or "-",
+            row.entropy_p99 or "-",
+        ])
+
+        # Add the wordlist to the list of headers
+        wordlists.append(file)
+
+        # Process charset counts for the second table
+        for charset, count in zip(header, row):
+            if charset in shared.CHARSET.keys(): 
+                cz_charset = shared.CHARSET[charset] 
+                charset_data[cz_charset][file] = int(count)
 
     # Generate the LaTeX content for the table
     content = template_group.render(
@@ -449,6 +477,68 @@ def wordlist_tex_table():
     )
 
     # Save the generated content to a LaTeX file
-    filename = shared.CONFIG.stats.analyze_wordlist_file
+    filename = exp.config.stats.analyze_wordlist_file
     save_to_file(filename, content)
     print(f"LaTeX table saved to {filename}")
+
+
+def similarity_tex_table(exp, model=None):
+    """Generates LaTeX tables for the similarity of wordlists, attack and target files."""
+    model = model or ResultsModel(exp)
+    template = get_template("similarity_table.tex.jinja")
+
+    # Initialize data structures
+    jaccard = defaultdict(dict)  # Jaccard index of file pairs
+    containment = defaultdict(dict)  # Part of the row file contained in the column file
+    files = []  # List of files (for table headers)
+
+    # Process each row of the similarity statistics
+    for row in model.records("similarity"):
+        file_a = os.path.basename(row.file_a).replace("_", "\\_")
+        file_b = os.path.basename(row.file_b).replace("_", "\\_")
+        for file in (file_a, file_b):
+            if file not in files:
+                files.append(file)
+                jaccard[file][file] = "100.00\\%"
+                containment[file][file] = "100.00\\%"
+
+        value = f"{float(row.jaccard) * 100:.2f}\\%"
+        jaccard[file_a][file_b] = value
+        jaccard[file_b][file_a] = value
+        containment[file_a][file_b] = f"{float(row.a_in_b) * 100:.2f}\\%"
+        containment[file_b][file_a] = f"{float(row.b_in_a) * 100:.2f}\\%"
+
+    # Generate the LaTeX content for the tables
+    content = template.render(
+        header=files,
+        jaccard=jaccard,
+        containment=containment,
+    )
+
+    # Save the generated content to a LaTeX file
+    filename = exp.config.stats.analyze_similarity_file
+    save_to_file(filename, content)
+    print(f"LaTeX table saved to {filename}")
+
+
+def render_reports(exp, model=None):
+    """Renders all LaTeX outputs enabled in the configuration from one shared results model."""
+    model = model or ResultsModel(exp)
+    con_stats = exp.config.stats
+
+    program_stats = (con_stats.time_passwords or con_stats.memory_passwords
+                     or con_stats.rules_passwords or con_stats.cpu_passwords)
+    if program_stats:
+        program_tex(exp, model)
+    if con_stats.recovered_guesses:
+        hashcat_tex(exp, model)
+    if con_stats.zxcvbn_recovered:
+        zxcvbn_recovered_tex(exp, model)
+    if con_stats.zxcvbn_score:
+        zxcvbn_score_tex(exp, model)
+    if program_stats and con_stats.recovered_guesses:
+        program_hashcat_tex_table(exp, model)
+    if con_stats.analyze_wordlist:
+        wordlist_tex_table(exp, model)
+    if con_stats.analyze_similarity:
+        similarity_tex_table(exp, model)
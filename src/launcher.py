@@ -0,0 +1,49 @@
+# Author: Andrea Michlíková - xmichl11
+
+"""Starts a measured shell command and reports its resource usage.
+
+A process started by PWDRE inherits the peak memory of PWDRE in `ru_maxrss`, so measured commands are started
+from this small script instead. It is run with `python3 -S` and uses only the standard library.
+
+Usage: launcher.py <report_fd> <command>
+The exit code of the command, the peak memory in kB of its largest process and the user and system CPU time
+of all its processes are written to `report_fd` when the command and all its descendants have ended.
+"""
+
+import ctypes
+import os
+import signal
+import subprocess
+import sys
+
+# prctl option that makes orphaned descendants children of the launcher
+PR_SET_CHILD_SUBREAPER = 36
+
+
+def main():
+    report_fd, command = int(sys.argv[1]), sys.argv[2]
+    # SIGTERM is sent to the whole process group, the launcher waits for the command to report its usage.
+    # A handler instead of SIG_IGN, so the command gets the default action back on exec.
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+    # A stopped shell does not wait for its children, they are reaped by the launcher instead
+    ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    process = subprocess.Popen(command, shell=True)
+
+    returncode, maxrss, cpu_time = 1, 0, 0.0
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, 0)
+        except ChildProcessError:
+            break
+        maxrss = max(maxrss, rusage.ru_maxrss)
+        cpu_time += rusage.ru_utime + rusage.ru_stime
+        if pid == process.pid:
+            returncode = process.returncode = os.waitstatus_to_exitcode(status)
+
+    with os.fdopen(report_fd, "w") as report:
+        report.write(f"{returncode} {maxrss} {cpu_time}")
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,26 +4,63 @@ import json
 import os
 import hashlib
 import csv
+import threading
 from collections import defaultdict
 
-import src.shared as shared
+import src.store as store
+from src.files import file_lock
+from src.profiler import traced
+from src.metrics import timed_write
+
+# Stages run in threads, the log and CSV files are updated by one thread at a time,
+# file locks do the same for other processes that share the log or the statistics folder
+_lock = threading.RLock()
+
+# Status of a run that was stopped by its budget, its partial results are kept
+OVER_BUDGET = "over_budget"
+
+# Parsed logs by their files with the size and modification time they were read with,
+# a log is parsed again only when it changes
+_log_cache = {}
 
 ########################################################################### LOG
-def load_log():
-    """Loads the JSON log from the file specified in 'shared.LOG_FILE'."""
-    if os.path.exists(shared.LOG_FILE):
-        with open(shared.LOG_FILE, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-    return {}
-
-
-def save_log(log):
-    """Saves the given log to 'shared.LOG_FILE'."""
-    with open(shared.LOG_FILE, "w") as f:
+def get_log_state(log_file):
+    stat = os.stat(log_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@traced("log")
+def load_log(exp):
+    """Loads the JSON log from the file specified in 'exp.log_file'.
+    The parsed log is kept until the file changes, long runs check many commands against it.
+    """
+    if not os.path.exists(exp.log_file):
+        return {}
+    state = get_log_state(exp.log_file)
+    cached = _log_cache.get(exp.log_file)
+    if cached and cached[0] == state:
+        return cached[1]
+
+    with open(exp.log_file, "r") as f:
+        try:
+            log = json.load(f)
+        except json.JSONDecodeError:
+            return {}
+    _log_cache[exp.log_file] = (state, log)
+    return log
+
+
+@traced("log")
+@timed_write("log")
+def save_log(exp, log):
+    """Saves the given log to 'exp.log_file'.
+    The log is replaced at once, so it is never read half written.
+    """
+    temp_file = f"{exp.log_file}.tmp"
+    with open(temp_file, "w") as f:
         json.dump(log, f, indent=4)
+    os.replace(temp_file, exp.log_file)
+    _log_cache[exp.log_file] = (get_log_state(exp.log_file), log)
 
 
 def get_command_hash(cmd):
@@ -31,7 +68,9 @@ def get_command_hash(cmd):
     return hashlib.sha256(cmd.encode()).hexdigest()
 
 
+@traced("log")
 def log_command(
+    exp,
     cmd,
     status,
     rule_file=None,
@@ -47,6 +86,12 @@ def log_command(
     recovered_line=None,
     guesses_log10=None,
     score=None,
+    benchmark=None,
+    budget=None,
+    exceeded=None,
+    stages=None,
+    raw_guesses=None,
+    effective_guesses=None,
     error_message=None,
 ):
     """Logs the result of a command execution into the JSON log.
@@ -54,57 +99,100 @@ def log_command(
     - `status`: The status of the command (e.g., "done", "error").
     - Additional parameters provide information about the command execution.
     """
-    log = load_log()
-    cmd_hash = get_command_hash(cmd)
-
-    # Create a dictionary with only non-None values
-    log[cmd_hash] = {
-        "command": cmd,
-        "status": status,
-        **{
-            key: value
-            for key, value in {
-                "error": error_message,
-                "rule_file": rule_file,
-            }.items()
-            if value is not None
-        },
-        "stats": {
-            key: (dict(value) if isinstance(value, defaultdict) else value)
-            for key, value in {
-                "wordlist": wl,
-                "wordlist_size": wl_size,
-                "attack": attack,
-                "target": target,
-                "time": time,
-                "memory": memory,
-                "cpu": cpu,
-                "rule_size": rule_size,
-                "progress": progress_line,
-                "recovered": recovered_line,
-                "guesses_log10": guesses_log10,
-                "score": score,
-            }.items()
-            if value is not None
-        },
-    }
-
-    save_log(log)
-
-
-def has_command_run(cmd):
-    """Checks if the given command has already been successfully executed."""
-    log = load_log()
-    cmd_hash = get_command_hash(cmd)
-    return log.get(cmd_hash, {}).get("status") == "done"
-
-
-def load_stats_from_log(cmd):
+    with _lock, file_lock(exp.log_file):
+        log = load_log(exp)
+        cmd_hash = get_command_hash(cmd)
+
+        # Create a dictionary with only non-None values
+        log[cmd_hash] = {
+            "command": cmd,
+            "status": status,
+            **{
+                key: value
+                for key, value in {
+                    "error": error_message,
+                    "rule_file": rule_file,
+                }.items()
+                if value is not None
+            },
+            "stats": {
+                key: (dict(value) if isinstance(value, defaultdict) else value)
+                for key, value in {
+                    "wordlist": wl,
+                    "wordlist_size": wl_size,
+                    "attack": attack,
+                    "target": target,
+                    "time": time,
+                    "memory": memory,
+                    "cpu": cpu,
+                    "rule_size": rule_size,
+                    "progress": progress_line,
+                    "recovered": recovered_line,
+                    "guesses_log10": guesses_log10,
+                    "score": score,
+                    "benchmark": benchmark,
+                    "budget": budget,
+                    "exceeded": exceeded,
+                    "stages": stages,
+                    "raw_guesses": raw_guesses,
+                    "effective_guesses": effective_guesses,
+                }.items()
+                if value is not None
+            },
+        }
+
+        save_log(exp, log)
+
+
+@traced("log")
+def merge_log(exp, entries):
+    """Adds entries of another log, for example the log of a worker, to the log."""
+    with _lock, file_lock(exp.log_file):
+        log = load_log(exp)
+        log.update(entries)
+        save_log(exp, log)
+
+
+@traced("log")
+def has_command_run(exp, cmd, budget=None):
+    """Checks if the given command has already been successfully executed.
+    A command stopped by its budget counts as executed while the budget stays the same.
+    """
+    log = load_log(exp)
+    entry = log.get(get_command_hash(cmd), {})
+    if entry.get("status") == OVER_BUDGET:
+        return budget is not None and entry.get("stats", {}).get("budget") == budget
+    return entry.get("status") == "done"
+
+
+@traced("log")
+def forget_rule_file(exp, rule_file):
+    """Deletes the Hashcat and zxcvbn results of a rule file from the log and the CSV files,
+    so the rule file is evaluated again after it was changed. Results of the program that generated it are kept.
+    Returns the number of deleted log entries.
+    """
+    with _lock:
+        with file_lock(exp.log_file):
+            log = load_log(exp)
+            stale = [key for key, entry in log.items()
+                     if (entry["command"].startswith("hashcat") and entry.get("rule_file") == rule_file)
+                     or entry["command"].startswith(f"zcvbn R:{rule_file} ")]
+            for key in stale:
+                del log[key]
+            if stale:
+                save_log(exp, log)
+        store.delete(exp, "hashcat", rule_file=rule_file)
+        store.delete(exp, "zxcvbn_recovered", file_name=rule_file)
+        store.delete(exp, "zxcvbn_score", file_name=rule_file)
+    return len(stale)
+
+
+def load_stats_from_log(exp, cmd):
     """Loads statistics and rule file information for a given command from the log."""
-    log = load_log()
+    log = load_log(exp)
     cmd_hash = get_command_hash(cmd)
     info = log.get(cmd_hash)
-    if not cmd_hash or not has_command_run(cmd):
+    if not info or info.get("status") not in ("done", OVER_BUDGET):
         return {}, None
     return info.get("stats", {}), info.get("rule_file")
 
@@ -124,7 +212,18 @@ def data_to_csv(csv_path, content, header=None):
         writer.writerow(content)
 
 
-def program_to_csv(program, run_index, rule_file, wordlist, size, time, memory, cpu, rule_size):
+@traced("log")
+@timed_write("csv")
+def record_to_csv(exp, table, data):
+    """Saves a record to the CSV file of the table and to the results store."""
+    with _lock, file_lock(store.get_csv_path(exp, table)):
+        store.sync_table(exp, table)
+        data_to_csv(store.get_csv_path(exp, table), data, store.get_header(table))
+        store.insert(exp, table, data)
+
+
+def program_to_csv(exp, program, run_index, rule_file, wordlist, size, time, memory, cpu, rule_size, benchmark=None,
+                   status="done", stages=None):
     """
     Log program execution data to a CSV file.
     - `program`: Name of the program.
@@ -132,19 +231,24 @@ def program_to_csv(program, run_index, rule_file, wordlist, size, time, memory,
     - `rule_file`: Path to the rule file.
     - `wordlist`: Path to the wordlist.
     - `size`: Size of the wordlist.
-    - `time`: Execution time.
+    - `time`: Execution time, the mean of the trials in the benchmark mode.
     - `memory`: Memory usage.
     - `cpu`: CPU usage.
     - `rule_size`: Size of the rule file.
+    - `benchmark`: Number of trials, standard deviations and confidence intervals of the metrics.
+    - `status`: "done", or "over_budget" for a run stopped by its budget.
+    - `stages`: Time, CPU time, memory and output bytes of the pipeline stages, values of the stages are separated by ';'.
     """
-    csv_path = shared.CONFIG.stats.program_csv_file
-
-    header = ["program", "run_index", "rule_file", "wordlist", "size", "time", "memory", "cpu", "rules"]
-    data = [program, run_index, rule_file, wordlist, size, time, memory, cpu, rule_size]
-    data_to_csv(csv_path, data, header)
+    benchmark = benchmark or {"trials": 1}
+    stages = stages or {}
+    data = [program, run_index, rule_file, wordlist, size, time, memory, cpu, rule_size, benchmark["trials"]]
+    data += [benchmark.get(f"{metric}_{value}", "") for metric in ("time", "memory", "cpu") for value in ("std", "ci")]
+    data += [status] + [stages.get(metric, "") for metric in ("time", "cpu_time", "memory", "bytes")]
+    record_to_csv(exp, "program", data)
 
 
-def hashcat_to_csv(rule_file, size, attack, attack_size, target, progress, recovered):
+def hashcat_to_csv(exp, rule_file, size, attack, attack_size, target, progress, recovered, status="done",
+                   raw_guesses=None, effective_guesses=None):
     """
     Logs Hashcat execution data to a CSV file.
     - `rule_file`: Path to the rule file.
@@ -154,58 +258,50 @@ def hashcat_to_csv(rule_file, size, attack, attack_size, target, progress, recov
     - `target`: Path to the target file.
     - `progress`: Number of progress passwords.
     - `recovered`: Percent of recovered passwords.
+    - `status`: "done", or "over_budget" for a run stopped by its budget.
+    - `raw_guesses`: Number of all candidates of the attack, with duplicates.
+    - `effective_guesses`: Number of unique candidates of the attack.
     """
-    csv_path = shared.CONFIG.stats.hashcat_csv_file
-
-    header = ["rule_file", "rule_size", "attack", "attack_size", "target", "progress", "recovered"]
-    data = [rule_file, size, attack, attack_size, target, progress, recovered]
-    data_to_csv(csv_path, data, header)
+    data = [rule_file, size, attack, attack_size, target, progress, recovered, status, raw_guesses, effective_guesses]
+    record_to_csv(exp, "hashcat", data)
 
 
-def zxcvbn_recovered_to_csv(file_name, recovered, guesses_log10):
+def zxcvbn_recovered_to_csv(exp, file_name, recovered, guesses_log10):
     """
     Logs zxcvbn recovery data to a CSV file.
     - `file_name`: Name of the file being analyzed.
     - `recovered`: Percent of recovered passwords.
     - `guesses_log10`: Logarithmic guesses data.
     """
-    csv_path = shared.CONFIG.stats.zxcvbn_recovered_csv_file
-
-    header = ["file_name", "recovered", "guesses_log10", "n"]
     for guesses_log10, count in sorted(guesses_log10.items()):
         data = [file_name, recovered, guesses_log10, count]
-        data_to_csv(csv_path, data, header)
+        record_to_csv(exp, "zxcvbn_recovered", data)
 
 
-def zxcvbn_score_to_csv(file_name, recovered, score):
+def zxcvbn_score_to_csv(exp, file_name, recovered, score):
     """
     Logs zxcvbn score data to a CSV file.
     - `file_name`: Name of the file being analyzed.
     - `recovered`: Percent of recovered passwords.
     - `score`: Score distribution.
     """
-    csv_path = shared.CONFIG.stats.zxcvbn_score_csv_file
-
-    header = ["file_name", "recovered"] + [f"score_{i}" for i in range(5)]
     data = [file_name, recovered] + [score[i] for i in range(5)]
-    data_to_csv(csv_path, data, header)
+    record_to_csv(exp, "zxcvbn_score", data)
 
 
-def rules_to_csv(file_name, rule_order, rule_counts):
+def rules_to_csv(exp, file_name, rule_order, rule_counts):
     """
     Logs the analysis of rules to a CSV file.
     - `file_name`: Name of the file being analyzed.
     - `rule_order`: List of rules in the desired order.
     - `rule_counts`: Dictionary containing counts for each rule.
     """
-    csv_path = shared.CONFIG.stats.rules_csv_file
-
-    header = ["rule_file"] + list(rule_order)
     data = [file_name] + [rule_counts.get(rule, 0) for rule in rule_order]
-    data_to_csv(csv_path, data, header)
+    record_to_csv(exp, "rules", data)
 
 
-def wordlist_to_csv(wl_path, wl_size, avg_len, median_len, avg_entropy, entropy_above, ascii, charset_counts):
+def wordlist_to_csv(exp, wl_path, wl_size, avg_len, median_len, avg_entropy, entropy_above, ascii, charset_counts,
+                    distinct, entropy_p90, entropy_p99):
     """
     Logs wordlist statistics to a CSV file.
     - `wordlist_path`: Path to the wordlist file.
@@ -216,38 +312,51 @@ def wordlist_to_csv(wl_path, wl_size, avg_len, median_len, avg_entropy, entropy_
     - `entropy_above`: Number of words with entropy above a threshold.
     - `ascii`: Number of words that contains only ASCII characters.
     - `charset_counts`: Dictionary with counts of characters by charset.
+    - `distinct`: Estimated number of distinct words.
+    - `entropy_p90`: 90th percentile of the entropy.
+    - `entropy_p99`: 99th percentile of the entropy.
     """
-    csv_path = shared.CONFIG.stats.wordlist_csv_file
+    data = ([wl_path, wl_size, avg_len, median_len, avg_entropy, entropy_above, ascii]
+            + list(charset_counts.values()) + [distinct, entropy_p90, entropy_p99])
+    record_to_csv(exp, "wordlist", data)
 
-    header = ["wordlist", "size", "avg_len", "median_len", "avg_entropy", "entropy_above", "ascii"] + list(charset_counts.keys())
 
-    data = [wl_path, wl_size, avg_len, median_len, avg_entropy, entropy_above, ascii] + list(charset_counts.values())
-
-    data_to_csv(csv_path, data, header)
+def similarity_to_csv(exp, file_a, file_b, method, jaccard, a_in_b, b_in_a):
+    """
+    Logs the similarity of two files to a CSV file.
+    - `file_a`: Path to the first file.
+    - `file_b`: Path to the second file.
+    - `method`: Method of the comparison ("exact" or "minhash").
+    - `jaccard`: Jaccard index of the files.
+    - `a_in_b`: Part of the first file contained in the second file.
+    - `b_in_a`: Part of the second file contained in the first file.
+    """
+    data = [file_a, file_b, method, jaccard, a_in_b, b_in_a]
+    record_to_csv(exp, "similarity", data)
 
 
 ########################################################################### Is record in CSV
-def is_program_record_in_csv(rule_file, wordlist):
+def is_program_record_in_csv(exp, rule_file, wordlist):
     """
     Checks if a specific program record already exists in the program CSV file.
     - `rule_file`: Path to the rule file.
     - `wordlist`: Path to the wordlist file.
     Returns True if the record exists, otherwise False.
     """
-    csv_path = shared.CONFIG.stats.program_csv_file
+    return store.exists(exp, "program", rule_file=rule_file, wordlist=wordlist)
 
-    if not os.path.exists(csv_path):
-        return False
 
-    with open(csv_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get("rule_file") == rule_file and row.get("wordlist") == wordlist:
-                return True
-    return False
+def delete_program_record(exp, rule_file, wordlist):
+    """
+    Deletes the program records of a rule file, they are replaced by a new measurement.
+    - `rule_file`: Path to the rule file.
+    - `wordlist`: Path to the wordlist file.
+    """
+    with _lock:
+        return store.delete(exp, "program", rule_file=rule_file, wordlist=wordlist)
 
 
-def is_hashcat_record_in_csv(rule_file, size, attack, target):
+def is_hashcat_record_in_csv(exp, rule_file, size, attack, target):
     """
     Checks if a specific hashcat record already exists in the hashcat CSV file.
     - `rule_file`: Path to the rule file.
@@ -256,25 +365,21 @@ def is_hashcat_record_in_csv(rule_file, size, attack, target):
     - `target`: Path to the target file.
     Returns True if the record exists, otherwise False.
     """
-    csv_path = shared.CONFIG.stats.hashcat_csv_file
+    return store.exists(exp, "hashcat", rule_file=rule_file, rule_size=int(size), attack=attack, target=target)
 
-    if not os.path.exists(csv_path):
-        return False
 
-    with open(csv_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if (
-                row.get("rule_file") == rule_file
-                and row.get("rule_size") == str(size)
-                and row.get("attack") == attack
-                and row.get("target") == target
-            ):
-                return True
-    return False
+def is_similarity_record_in_csv(exp, file_a, file_b):
+    """
+    Checks if the similarity of two files already exists in the similarity CSV file.
+    - `file_a`: Path to the first file.
+    - `file_b`: Path to the second file.
+    Returns True if the record exists, otherwise False.
+    """
+    return (store.exists(exp, "similarity", file_a=file_a, file_b=file_b)
+            or store.exists(exp, "similarity", file_a=file_b, file_b=file_a))
 
 
-def is_file_record_in_csv(csv_path, key, file):
+def is_file_record_in_csv(exp, csv_path, key, file):
     """
     Checks if a specific file record exists in a given CSV file.
     - `csv_path`: Path to the CSV file.
@@ -282,6 +387,11 @@ def is_file_record_in_csv(csv_path, key, file):
     - `file`: Value to search for in the specified column.
     Returns True if the record exists, otherwise False.
     """
+    table = store.get_table_for_csv(exp, csv_path)
+    if table:
+        return store.exists(exp, table, **{key: file})
+
+    # CSV files outside of the results store are searched directly
     if not os.path.exists(csv_path):
         return False
     with open(csv_path, "r", encoding="utf-8") as f:
@@ -293,17 +403,18 @@ def is_file_record_in_csv(csv_path, key, file):
 
 
 ########################################################################### Load from LOG to CSV
-def program_from_log_to_csv(cmd, program, i):
+def program_from_log_to_csv(exp, cmd, program, i):
     """
     Logs program statistics from the log to the program CSV file.
     - `cmd`: Command string used to retrieve the log entry.
     - `program`: Name of the program.
     - `i`: Index of the run.
     """
-    stats, rule_file = load_stats_from_log(cmd)
+    stats, rule_file = load_stats_from_log(exp, cmd)
 
     if stats:
         program_to_csv(
+            exp,
             program,
             i,
             rule_file,
@@ -313,57 +424,66 @@ def program_from_log_to_csv(cmd, program, i):
             stats["memory"],
             stats["cpu"],
             stats["rule_size"],
+            stats.get("benchmark"),
+            OVER_BUDGET if stats.get("exceeded") else "done",
+            stats.get("stages"),
         )
         print(f"Program statistics were retrieved from LOG.")
     else:
         print(f"No program statistics found for '{cmd}'.")
 
 
-def hashcat_from_log_to_csv(cmd, rule_size, attack_size):
+def hashcat_from_log_to_csv(exp, cmd, rule_size, attack_size):
     """
     Logs hashcat statistics from the log to the hashcat CSV file.
     - `cmd`: Command string used to retrieve the log entry.
     - `rule_size`: Size of the rule file.
     - `attack_size`: Size of the attack file.
     """
-    stats, rule_file = load_stats_from_log(cmd)
+    stats, rule_file = load_stats_from_log(exp, cmd)
 
     if stats:
         hashcat_to_csv(
+            exp,
             rule_file,
             rule_size,
             stats["attack"],
             attack_size,
             stats["target"],
-            stats["progress"],
-            stats["recovered"],
+            stats.get("progress"),
+            stats.get("recovered"),
+            OVER_BUDGET if stats.get("exceeded") else "done",
+            stats.get("raw_guesses"),
+            stats.get("effective_guesses"),
         )
         print(f"Hashcat statistics were retrieved from LOG.")
     else:
         print(f"No Hashcat statistics found for '{cmd}'.")
 
 
-def zxcvbn_from_log_to_csv(cmd, file_name):
+def zxcvbn_from_log_to_csv(exp, cmd, file_name):
     """
     Logs zxcvbn statistics from the log to the zxcvbn CSV files.
     - `cmd`: Command string used to retrieve the log entry.
     """
-    stats, _ = load_stats_from_log(cmd)
+    stats, _ = load_stats_from_log(exp, cmd)
 
     if stats:
         # Log recovery data to the zxcvbn_recovered CSV
-        if shared.CONFIG.stats.zxcvbn_recovered:
+        if exp.config.stats.zxcvbn_recovered:
             zxcvbn_recovered_to_csv(
+                exp,
                 file_name,
                 stats.get("recovered", "0.00"),
                 stats.get("guesses_log10", {}),
             )
 
         # Log score data to the zxcvbn_score CSV
-        if shared.CONFIG.stats.zxcvbn_score:
+        if exp.config.stats.zxcvbn_score:
             score = stats.get("score", {})
             score = {int(k): v for k, v in score.items()}
             zxcvbn_score_to_csv(
+                exp,
                 file_name,
                 stats.get("recovered", "0.00"),  # Default to "0.00" if missing
                 score,
@@ -0,0 +1,257 @@
+# Author: Andrea Michlíková - xmichl11
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Active metrics of the process, None when they are disabled
+_metrics = None
+
+# Job of the current asyncio task or thread, it can be marked as failed
+_current_job = contextvars.ContextVar("pwdre_job", default=None)
+
+# Metric definitions: name, type and help text in the order they are written
+DEFINITIONS = [
+    ("pwdre_run_seconds", "gauge", "Seconds since the start of the run."),
+    ("pwdre_stage_state", "gauge", "State of every stage, 1 for the current state."),
+    ("pwdre_jobs", "gauge", "Jobs of a stage by their state."),
+    ("pwdre_job_seconds", "summary", "Duration of finished jobs of a stage."),
+    ("pwdre_eta_seconds", "gauge", "Estimated time until the queued and running jobs of a stage finish."),
+    ("pwdre_hashcat_speed_hashes_per_second", "gauge", "Current speed of a Hashcat run."),
+    ("pwdre_hashcat_progress_ratio", "gauge", "Current progress of a Hashcat run from 0 to 1."),
+    ("pwdre_zxcvbn_passwords_per_second", "gauge", "Passwords analyzed by zxcvbn per second."),
+    ("pwdre_write_seconds", "summary", "Duration of log and CSV writes."),
+    ("pwdre_write_seconds_max", "gauge", "Longest log and CSV write."),
+]
+
+# States of jobs and stages
+JOB_STATES = ["queued", "running", "done", "failed"]
+STAGE_STATES = ["running", "done", "up_to_date", "failed"]
+
+
+def escape(value):
+    """Escapes a label value of the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Values of the metrics of a run, written in the Prometheus text format."""
+
+    def __init__(self, text_file=None, interval=5.0):
+        self.lock = threading.Lock()
+        self.values = {}  # Values by metric name and sorted labels
+        self.start = time.time()
+        self.text_file = text_file
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.writer = None
+        self.server = None
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels.items())))] = value
+
+    def add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, name, **labels):
+        with self.lock:
+            return self.values.get((name, tuple(sorted(labels.items()))), 0)
+
+    def update_eta(self):
+        """Estimates the remaining time of every stage from the mean duration of its finished jobs."""
+        stages = {dict(labels)["stage"] for name, labels in list(self.values) if name == "pwdre_jobs"}
+        total = 0.0
+        for stage in stages:
+            count = self.get("pwdre_job_seconds_count", stage=stage)
+            if not count:
+                continue
+            remaining = self.get("pwdre_jobs", stage=stage, state="queued") + self.get("pwdre_jobs", stage=stage, state="running")
+            parallel = max(self.get("pwdre_jobs", stage=stage, state="running"), 1)
+            eta = remaining * self.get("pwdre_job_seconds_sum", stage=stage) / count / parallel
+            self.set("pwdre_eta_seconds", eta, stage=stage)
+            total += eta
+        self.set("pwdre_eta_seconds", total, stage="all")
+
+    def render(self):
+        """Returns all metrics in the Prometheus text format."""
+        self.set("pwdre_run_seconds", time.time() - self.start)
+        self.update_eta()
+        with self.lock:
+            values = sorted(self.values.items())
+
+        lines = []
+        for base, kind, help_text in DEFINITIONS:
+            names = [f"{base}_sum", f"{base}_count"] if kind == "summary" else [base]
+            samples = [(name, labels, value) for (name, labels), value in values if name in names]
+            if not samples:
+                continue
+            lines.append(f"# HELP {base} {help_text}")
+            lines.append(f"# TYPE {base} {kind}")
+            for name, labels, value in samples:
+                label_text = ",".join(f'{key}="{escape(value)}"' for key, value in labels)
+                lines.append(f"{name}{{{label_text}}} {value:g}" if labels else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Writes the metrics to the text file, the file is replaced at once so it is never read half written."""
+        if not self.text_file:
+            return
+        os.makedirs(os.path.dirname(self.text_file) or ".", exist_ok=True)
+        temp_file = f"{self.text_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            f.write(self.render())
+        os.replace(temp_file, self.text_file)
+
+    def write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def serve(self, port):
+        """Serves the metrics on localhost at /metrics."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not printed between the run output
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def enable(text_file=None, port=None, interval=5.0):
+    """Starts collecting metrics, they are written to a text file and served on a localhost port."""
+    global _metrics
+    _metrics = Metrics(text_file, interval)
+    if text_file:
+        _metrics.writer = threading.Thread(target=_metrics.write_periodically, daemon=True)
+        _metrics.writer.start()
+    if port:
+        _metrics.serve(port)
+        print(f"METRICS: Serving on http://127.0.0.1:{port}/metrics")
+    return _metrics
+
+
+def disable():
+    """Writes the final metrics and stops the writer and the server."""
+    global _metrics
+    metrics, _metrics = _metrics, None
+    if metrics is None:
+        return
+    metrics.stopped.set()
+    metrics.write()
+    if metrics.server:
+        metrics.server.shutdown()
+
+
+def is_enabled():
+    return _metrics is not None
+
+
+def set_value(name, value, **labels):
+    """Sets a gauge, does nothing when metrics are disabled."""
+    if _metrics is not None:
+        _metrics.set(name, value, **labels)
+
+
+########################################################################### Jobs and stages
+def jobs_queued(stage, count):
+    """Adds jobs waiting in a stage, all states of the stage are exposed from now on."""
+    if _metrics is not None:
+        for state in JOB_STATES:
+            _metrics.add("pwdre_jobs", count if state == "queued" else 0, stage=stage, state=state)
+
+
+def job_moved(stage, old_state, new_state):
+    """Moves a job of a stage to another state, for jobs that run outside of this process."""
+    if _metrics is not None:
+        _metrics.add("pwdre_jobs", -1, stage=stage, state=old_state)
+        _metrics.add("pwdre_jobs", 1, stage=stage, state=new_state)
+
+
+class Job:
+    def __init__(self, stage):
+        self.stage = stage
+        self.failed = False
+
+
+@contextmanager
+def job(stage):
+    """Tracks a queued job while it runs, it counts as failed on an exception or after fail_job()."""
+    if _metrics is None:
+        yield
+        return
+    current = Job(stage)
+    token = _current_job.set(current)
+    _metrics.add("pwdre_jobs", -1, stage=stage, state="queued")
+    _metrics.add("pwdre_jobs", 1, stage=stage, state="running")
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        current.failed = True
+        raise
+    finally:
+        _current_job.reset(token)
+        _metrics.add("pwdre_jobs", -1, stage=stage, state="running")
+        _metrics.add("pwdre_jobs", 1, stage=stage, state="failed" if current.failed else "done")
+        _metrics.add("pwdre_job_seconds_sum", time.monotonic() - start, stage=stage)
+        _metrics.add("pwdre_job_seconds_count", 1, stage=stage)
+
+
+def fail_job():
+    """Marks the job of the current task as failed."""
+    current = _current_job.get()
+    if current is not None:
+        current.failed = True
+
+
+def stage_state(stage, state):
+    """Sets the current state of a stage."""
+    if _metrics is not None:
+        for name in STAGE_STATES:
+            _metrics.set("pwdre_stage_state", 1 if name == state else 0, stage=stage, state=name)
+
+
+########################################################################### Writes
+def observe_write(target, seconds):
+    """Records the duration of a log or CSV write."""
+    if _metrics is not None:
+        _metrics.add("pwdre_write_seconds_sum", seconds, target=target)
+        _metrics.add("pwdre_write_seconds_count", 1, target=target)
+        if seconds > _metrics.get("pwdre_write_seconds_max", target=target):
+            _metrics.set("pwdre_write_seconds_max", seconds, target=target)
+
+
+def timed_write(target):
+    """Decorator that records the duration of every call as a write to the target."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _metrics is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe_write(target, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,248 @@
+# Author: Andrea Michlíková - xmichl11
+
+import heapq
+import math
+import os
+import statistics
+from dataclasses import dataclass
+from typing import Optional
+
+import src.store as store
+import src.program_task as program_task
+import src.hashcat_task as hashcat_task
+from src.preprocess import preprocess_inputs, get_preprocess_output
+from src.log import load_log, has_command_run, OVER_BUDGET
+from src.files import count_lines_in_file, create_rules_file_name, get_rules_list, get_stem
+
+
+@dataclass
+class PlannedJob:
+    stage: str  # Stage of the job, "rules" or "hashcat"
+    name: str  # Short description of the job
+    cmd: str  # Logged command of the job
+    status: str  # "cached" when the log has its results, "new" or "skip"
+    time: Optional[float] = None  # Estimated wall time in seconds, None without history
+    memory: Optional[float] = None  # Estimated peak memory in MB
+    candidates: Optional[int] = None  # Rules of a generator, guesses of Hashcat
+    rule_file: Optional[str] = None  # Rule file written by a generator
+
+
+########################################################################### Estimates
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_program(rows, program, run_index, size):
+    """Estimates time, memory and rules of a generator run from earlier runs of the same program and arguments.
+    The rows with the nearest wordlist size are averaged, time and rules are scaled linearly to the size.
+    """
+    history = [row for row in rows if row["program"] == program and int(row["run_index"]) == run_index
+               and int(row["size"] or 0) > 0 and to_float(row["time"]) is not None and row.get("status") != OVER_BUDGET]
+    if not history or not size:
+        return None, None, None
+
+    nearest = min({int(row["size"]) for row in history}, key=lambda s: abs(math.log(size / s)))
+    similar = [row for row in history if int(row["size"]) == nearest]
+    scale = size / nearest
+    time = statistics.mean(to_float(row["time"]) for row in similar) * scale
+    memory = statistics.mean(to_float(row["memory"]) or 0 for row in similar)
+    rules = statistics.mean(int(row["rules"] or 0) for row in similar) * scale
+    return time, memory, int(rules)
+
+
+def hashcat_speed(exp):
+    """Returns the median number of guesses per second of the logged Hashcat runs, None without them."""
+    speeds = []
+    for entry in load_log(exp).values():
+        stats = entry.get("stats", {})
+        if entry.get("status") != "done" or not entry["command"].startswith("hashcat"):
+            continue
+        time, progress = to_float(stats.get("time")), to_float(stats.get("progress"))
+        if time and progress:
+            speeds.append(progress / time)
+    return statistics.median(speeds) if speeds else None
+
+
+########################################################################### Jobs
+def plan_inputs(exp):
+    """Replaces the input lists with the paths of the cleaned files like preprocess_inputs, nothing is cleaned.
+    Returns the original file of every cleaned file that is not in the cache yet.
+    """
+    originals = {}
+
+    def clean(exp, file_path, options):
+        output = get_preprocess_output(exp, file_path, options)
+        if not os.path.exists(output):
+            originals[output] = file_path
+        return output
+
+    preprocess_inputs(exp, clean)
+    return originals
+
+
+def count_planned_lines(file_path, originals):
+    """Counts the lines of an input file, a file that is not cleaned yet is counted in its original,
+    so the estimate is an upper bound of the cleaned size.
+    """
+    return count_lines_in_file(originals.get(file_path, file_path))
+
+
+def planned_wordlists(exp, wordlist, originals):
+    """Returns the wordlists of the configured sizes like get_wordlist_info, without creating the sampled files."""
+    max_size = count_planned_lines(wordlist, originals)
+    sizes = exp.config.input.wordlist_size
+    if not sizes:
+        return [{"name": wordlist, "size": max_size}]
+
+    folder = os.path.join(os.path.dirname(wordlist), "random_selected")
+    wl_info = []
+    for size in sorted(sizes, reverse=True):
+        if size == 0:
+            wl_info.append({"name": wordlist, "size": max_size})
+        elif size <= max_size:
+            wl_info.append({"name": os.path.join(folder, f"{get_stem(wordlist)}_{size}.txt"), "size": size})
+        else:
+            print(f"WARNING: Requested size {size} exceeds file size {max_size} in {wordlist}.")
+    return wl_info
+
+
+def plan_programs(exp, originals):
+    """Expands the configuration into generator runs the same way run_cmd does."""
+    rows = store.read_csv(exp, "program")  # The plan does not create the results store
+    benchmark = exp.config.benchmark
+    runs = benchmark.warmup + max(benchmark.trials, 1)  # The benchmark mode runs every generator more times
+    jobs = []
+    for wordlist in exp.wordlist_list:
+        for program in exp.config.programs:
+            for i, arg in enumerate(program.args):
+                for wl in planned_wordlists(exp, wordlist, originals):
+                    cmd, _ = program_task.get_cmd(exp, arg, program, wl, i)
+                    cmd = program_task.get_log_cmd(exp, cmd)
+                    job = PlannedJob("rules", f"{program.name} #{i} {get_stem(wl['name'])}", cmd,
+                                     "cached" if has_command_run(exp, cmd, program_task.get_budget(exp, program)) else "new",
+                                     rule_file=create_rules_file_name(exp, program, wl['name'], i))
+                    job.time, job.memory, job.candidates = estimate_program(rows, program.name, i, wl['size'])
+                    if job.time is not None:
+                        job.time *= runs
+                    jobs.append(job)
+    return jobs
+
+
+def plan_hashcat(exp, program_jobs, originals):
+    """Expands the configuration into Hashcat runs the same way run_hashcat does.
+    Guesses are the attack size times the number of rules, rule files that do not exist yet
+    use the estimate of their generator.
+    """
+    rules_size = exp.config.input.rules_size if exp.config.stats.recovered_guesses else [0]
+    planned_rules = {job.rule_file: job.candidates for job in program_jobs}
+    speed = hashcat_speed(exp)
+    budget = hashcat_task.get_budget(exp)
+
+    jobs = []
+    for attack_file in exp.attack_list:
+        attack_size = count_planned_lines(attack_file, originals)
+        for target_file in exp.target_list:
+            for rule_file in get_rules_list(exp):
+                if os.path.exists(rule_file):
+                    rule_count = count_lines_in_file(rule_file)
+                else:
+                    rule_count = planned_rules.get(rule_file)
+                for in_size in rules_size:
+                    in_size = int(in_size)
+                    cmd = hashcat_task.get_log_cmd(rule_file, target_file, attack_file, in_size, exp.config.dedup.stream)
+                    job = PlannedJob("hashcat", f"{get_stem(rule_file)} [{in_size or 'all'}] {get_stem(target_file)}", cmd,
+                                     "cached" if has_command_run(exp, cmd, budget) else "new")
+                    rules = in_size or rule_count
+                    if in_size and rule_count is not None and rule_count < in_size:
+                        job.status, rules = "skip", None  # Hashcat skips rule files with less rules than the limit
+                    if rules is not None:
+                        job.candidates = attack_size * rules
+                        if budget["candidates"]:
+                            job.candidates = min(job.candidates, budget["candidates"])
+                        job.time = job.candidates / speed if speed else None
+                    jobs.append(job)
+    return jobs
+
+
+########################################################################### Schedule
+def makespan(times, parallel):
+    """Returns the wall time of jobs run at most 'parallel' at a time, longest jobs first."""
+    slots = [0.0] * max(parallel, 1)
+    for time in sorted(times, reverse=True):
+        heapq.heappush(slots, heapq.heappop(slots) + time)
+    return max(slots)
+
+
+def peak_memory(memories, parallel):
+    """Returns the memory of the 'parallel' largest jobs, they can run at the same time."""
+    return sum(sorted(memories, reverse=True)[:max(parallel, 1)])
+
+
+def format_time(seconds):
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+def format_value(value, fmt):
+    return "?" if value is None else format(value, fmt)
+
+
+def print_plan(jobs, parallel):
+    """Prints the planned jobs and the estimates of every stage and of the whole run."""
+    print(f"{'stage':<8} {'status':<7} {'job':<48} {'time':>9} {'memory [MB]':>12} {'candidates':>15}")
+    for job in jobs:
+        print(f"{job.stage:<8} {job.status:<7} {job.name[:48]:<48} {format_time(job.time) if job.status == 'new' else '-':>9} "
+              f"{format_value(job.memory, '.2f') if job.status == 'new' else '-':>12} {format_value(job.candidates, ',') if job.status != 'skip' else '-':>15}")
+
+    total, wall, critical = 0.0, 0.0, 0.0
+    print(f"\nEstimates for {parallel} parallel run(s):")
+    for stage in ("rules", "hashcat"):
+        stage_jobs = [job for job in jobs if job.stage == stage]
+        new = [job for job in stage_jobs if job.status == "new"]
+        if not stage_jobs:
+            continue
+        times = [job.time for job in new if job.time is not None]
+        memories = [job.memory for job in new if job.memory is not None]
+        candidates = sum(job.candidates for job in new if job.candidates is not None)
+        unknown = len(new) - len(times)
+
+        stage_wall = makespan(times, parallel) if times else 0.0
+        total += sum(times)
+        wall += stage_wall  # Hashcat starts after all rule files are generated
+        critical += max(times, default=0.0)
+        print(f"{stage:<8} {len(new)} new, {len(stage_jobs) - len(new)} cached or skipped, "
+              f"time {format_time(sum(times))}, wall {format_time(stage_wall)}, "
+              + (f"peak memory {peak_memory(memories, parallel):.2f} MB, " if memories else "")
+              + f"candidates {candidates:,}"
+              + (f" ({unknown} job(s) without history are not included)" if unknown else ""))
+
+    print(f"Total time {format_time(total)}, wall time {format_time(wall)}, critical path {format_time(critical)}")
+
+
+def plan_experiment(exp, parallel=None):
+    """Prints what a run of the configuration would do and how long it would take, nothing is run or written.
+    Returns the planned jobs.
+    """
+    con_stats = exp.config.stats
+    parallel = parallel or exp.config.general.parallel_runs
+    originals = plan_inputs(exp)  # Logged commands use the cleaned input files
+    if originals:
+        print(f"PLAN: {len(originals)} input file(s) are not preprocessed yet, their sizes are counted before cleaning")
+
+    jobs = []
+    program_stats = (con_stats.time_passwords or con_stats.memory_passwords
+                     or con_stats.rules_passwords or con_stats.cpu_passwords)
+    program_jobs = plan_programs(exp, originals)
+    if program_stats:
+        jobs += program_jobs
+    if con_stats.recovered_guesses or con_stats.zxcvbn_recovered or con_stats.zxcvbn_score:
+        jobs += plan_hashcat(exp, program_jobs, originals)
+
+    print_plan(jobs, parallel)
+    return jobs
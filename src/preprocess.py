@@ -0,0 +1,169 @@
+# Author: Andrea Michlíková - xmichl11
+
+import heapq
+import json
+import hashlib
+import os
+import tempfile
+import unicodedata
+from dataclasses import asdict
+
+import src.shared as shared
+from src.files import get_file_hash, open_input, strip_compression_ext
+from src.analyze_files import find_charset, get_charset
+
+
+def decode_line(raw, options):
+    """Decodes a raw line, returns None if it can not be decoded."""
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        if not options.fallback_encoding:
+            return None
+        return raw.decode(options.fallback_encoding, errors="replace")
+
+
+def clean_line(raw, options):
+    """Normalizes and filters a single raw line, returns None if the line is dropped."""
+    password = decode_line(raw.rstrip(b"\r\n"), options)
+    if not password:
+        return None
+
+    if options.normalize:
+        password = unicodedata.normalize(options.normalize, password)
+
+    if options.min_length and len(password) < options.min_length:
+        return None
+    if options.max_length and len(password) > options.max_length:
+        return None
+
+    if options.charsets:
+        has_lower, has_upper, has_digit, has_special, _ = find_charset(password)
+        if get_charset(has_lower, has_upper, has_digit, has_special) not in options.charsets:
+            return None
+
+    return password
+
+
+def read_clean_lines(file_path, options):
+    """Yields (index, password) for every line that passes the filters."""
+    with open_input(file_path, "rb") as file:
+        for index, raw in enumerate(file):
+            password = clean_line(raw, options)
+            if password is not None:
+                yield index, password
+
+
+def write_run(records, folder, key):
+    """Sorts records in memory and writes them to a run file."""
+    records.sort(key=key)
+    fd, run_path = tempfile.mkstemp(dir=folder, suffix=".run")
+    with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+        for index, password in records:
+            f.write(f"{index}\t{password}\n")
+    return run_path
+
+
+def read_run(run_path):
+    """Yields (index, password) records from a run file."""
+    with open(run_path, "r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            index, password = line.rstrip("\n").split("\t", 1)
+            yield int(index), password
+
+
+def external_sort(records, folder, key, chunk_size):
+    """Sorts records with bounded memory, yields them in sorted order."""
+    runs = []
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            runs.append(write_run(chunk, folder, key))
+            chunk = []
+    if chunk:
+        runs.append(write_run(chunk, folder, key))
+
+    try:
+        yield from heapq.merge(*(read_run(run) for run in runs), key=key)
+    finally:
+        for run in runs:
+            os.remove(run)
+
+
+def first_occurrences(sorted_records):
+    """Drops duplicate passwords from records sorted by password and index."""
+    last = None
+    for index, password in sorted_records:
+        if password != last:
+            last = password
+            yield index, password
+
+
+def dedup_lines(file_path, options, folder):
+    """Removes duplicates with an external sort-merge, keeps the order of first occurrences."""
+    by_password = external_sort(read_clean_lines(file_path, options), folder,
+                                lambda r: (r[1], r[0]), options.chunk_size)
+    by_index = external_sort(first_occurrences(by_password), folder,
+                             lambda r: r[0], options.chunk_size)
+    for _, password in by_index:
+        yield password
+
+
+def get_preprocess_key(file_path, options):
+    """Returns the cache key of a cleaned file, based on its content and the cleaning options."""
+    settings = {k: v for k, v in asdict(options).items() if k not in ("wordlist", "attack", "target", "chunk_size")}
+    options_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+    return hashlib.sha256(f"{get_file_hash(file_path)}{options_hash}".encode()).hexdigest()[:16]
+
+
+def get_preprocess_output(exp, file_path, options):
+    """Returns the path of the cleaned file in the cache, the file is not created."""
+    folder = os.path.join(exp.config.general.cache_folder, "preprocess", get_preprocess_key(file_path, options))
+    return os.path.join(folder, strip_compression_ext(os.path.basename(file_path)))
+
+
+def preprocess_file(exp, file_path, options):
+    """Cleans a file and returns the path of the cleaned file from the cache."""
+    output = get_preprocess_output(exp, file_path, options)
+    folder = os.path.dirname(output)
+
+    if os.path.exists(output):
+        print(f"PREPROCESS: Using cached {output}")
+        return output
+
+    os.makedirs(folder, exist_ok=True)
+    if options.dedup:
+        passwords = dedup_lines(file_path, options, folder)
+    else:
+        passwords = (password for _, password in read_clean_lines(file_path, options))
+
+    # Write to a temporary file first, so an interrupted run never leaves a partial output in the cache
+    temp_output = f"{output}.tmp"
+    count = 0
+    with open(temp_output, "w", encoding="utf-8", newline="\n") as f:
+        for password in passwords:
+            f.write(f"{password}\n")
+            count += 1
+    os.replace(temp_output, output)
+
+    print(f"PREPROCESS: {file_path} -> {output} ({count} passwords)")
+    return output
+
+
+def preprocess_inputs(exp, clean=preprocess_file):
+    """Replaces the enabled input lists with cleaned files.
+    'clean' returns the cleaned path of a file, get_preprocess_output only computes it without cleaning.
+    """
+    options = exp.config.preprocess
+
+    unknown = [charset for charset in options.charsets if charset not in shared.CHARSET]
+    if unknown:
+        raise ValueError(f"ERROR: Unknown charsets in preprocess section: {', '.join(unknown)}")
+
+    if options.wordlist:
+        exp.wordlist_list = [clean(exp, f, options) for f in exp.wordlist_list]
+    if options.attack:
+        exp.attack_list = [clean(exp, f, options) for f in exp.attack_list]
+    if options.target:
+        exp.target_list = [clean(exp, f, options) for f in exp.target_list]
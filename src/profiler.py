@@ -0,0 +1,164 @@
+# Author: Andrea Michlíková - xmichl11
+
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Active tracer of the process, None when profiling is disabled
+_tracer = None
+
+# cProfile can profile only one stage at a time, profiled stages wait for each other
+_cprofile_lock = threading.Lock()
+
+
+class Tracer:
+    """Records nested spans of a run as Chrome trace events."""
+
+    def __init__(self, cprofile_folder=None):
+        self.start = time.perf_counter_ns()
+        self.events = []
+        self.tracks = {}  # Track ids and names by thread or asyncio task
+        self.lock = threading.Lock()
+        self.cprofile_folder = cprofile_folder
+
+    def track(self):
+        """Returns the track of the current asyncio task or thread, concurrent runs get their own tracks."""
+        # Asyncio is not imported here, without it loaded there are no tasks
+        asyncio = sys.modules.get("asyncio")
+        try:
+            task = asyncio.current_task() if asyncio else None
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key, name = ("task", id(task)), f"{threading.current_thread().name} {task.get_name()}"
+        else:
+            key, name = ("thread", threading.get_ident()), threading.current_thread().name
+        with self.lock:
+            if key not in self.tracks:
+                self.tracks[key] = (len(self.tracks) + 1, name)
+            return self.tracks[key][0]
+
+    def add(self, name, cat, start, end, tid, args):
+        """Adds a finished span, times are in nanoseconds of perf_counter."""
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (start - self.start) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    def trace(self):
+        """Returns the trace in the Chrome trace event format."""
+        with self.lock:
+            names = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self.tracks.values()
+            ]
+            return {"traceEvents": names + list(self.events), "displayTimeUnit": "ms"}
+
+    def summary(self):
+        """Returns the total time, the number of calls and the longest call of every span name, in seconds."""
+        totals = defaultdict(lambda: [0.0, 0, 0.0])
+        with self.lock:
+            for event in self.events:
+                total = totals[(event["cat"], event["name"])]
+                total[0] += event["dur"] / 1e6
+                total[1] += 1
+                total[2] = max(total[2], event["dur"] / 1e6)
+        return sorted(((cat, name, *values) for (cat, name), values in totals.items()), key=lambda row: -row[2])
+
+
+def enable(cprofile_folder=None):
+    """Starts profiling of the process, with a folder every stage is also profiled by cProfile."""
+    global _tracer
+    _tracer = Tracer(cprofile_folder)
+    return _tracer
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+@contextmanager
+def span(name, cat, **args):
+    """Records the time of a block as a span, does nothing when profiling is disabled."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    tid = tracer.track()
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        tracer.add(name, cat, start, time.perf_counter_ns(), tid, args)
+
+
+def traced(cat):
+    """Decorator that records every call of a function as a span."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with span(func.__name__, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_stage(name):
+    """Records a stage as a span and saves its cProfile statistics when they are enabled."""
+    tracer = _tracer
+    if tracer is None or not tracer.cprofile_folder:
+        with span(name, "stage"):
+            yield
+        return
+
+    with _cprofile_lock, span(name, "stage"):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            os.makedirs(tracer.cprofile_folder, exist_ok=True)
+            profile.dump_stats(os.path.join(tracer.cprofile_folder, f"{name}.prof"))
+
+
+def format_summary(rows, top=20):
+    """Formats the span summary as a table of the top time consumers."""
+    lines = [f"{'category':<12} {'span':<32} {'total [s]':>10} {'calls':>8} {'mean [s]':>10} {'max [s]':>10}"]
+    for cat, name, total, calls, longest in rows[:top]:
+        lines.append(f"{cat:<12} {name[:32]:<32} {total:>10.3f} {calls:>8} {total / calls:>10.4f} {longest:>10.3f}")
+    return "\n".join(lines)
+
+
+def save(folder, top=20):
+    """Writes the Chrome trace and the summary of the profiled run to a folder and prints the summary."""
+    if _tracer is None:
+        return
+    os.makedirs(folder, exist_ok=True)
+    trace_file = os.path.join(folder, "trace.json")
+    with open(trace_file, "w") as f:
+        json.dump(_tracer.trace(), f)
+
+    summary = format_summary(_tracer.summary(), top)
+    with open(os.path.join(folder, "summary.txt"), "w") as f:
+        f.write(summary + "\n")
+    print(summary)
+    print(f"Profile saved to {folder} (open {trace_file} in chrome://tracing or Perfetto)")
@@ -1,18 +1,29 @@
 # Author: Andrea Michlíková - xmichl11
 
+import asyncio
 import os
-import subprocess
-import src.shared as shared
+import statistics
+from src.async_run import run_process, gather_limited
+from src.benchmark import summarize_trials
+from src.profiler import span
+import src.metrics as metrics
 from src.log import (
     has_command_run,
     log_command,
     program_to_csv,
     is_program_record_in_csv,
+    delete_program_record,
     program_from_log_to_csv,
+    forget_rule_file,
+    OVER_BUDGET,
 )
-from src.files import count_lines_in_file, create_rules_file_name
+from src.files import count_lines_in_file, create_rules_file_name, get_file_hash
 from src.files import get_wordlist_info
 
+# PACK prints this line when the rules are written, the process is stopped then
+PACK_END_PATTERN = "[*] Top 10 words"
+
+
 def handle_pack_special_case(program, rule_file):
     """Handles a special case for the PACK program."""
 
@@ -31,19 +42,10 @@ def handle_pack_special_case(program, rule_file):
     return rule_file
 
 
-def parse_result(result):
-    """Parses the result of a subprocess command."""
-    split_stdout = result.stdout.decode('utf-8', errors='ignore').strip().split(',')
-    if len(split_stdout) >= 3:
-        return split_stdout[0].strip(), split_stdout[1].strip(), split_stdout[2].strip()
-    return "N/A", "N/A", "N/A"
-
-
-def process_run(arg, program, wl, i):
-    """Executes a single run of a program with the given arguments."""
+def get_cmd(exp, arg, program, wl, i):
+    """Returns the command of a program run and the name of its rule file."""
     # Create the rule file name
-    rule_file = create_rules_file_name(program, wl['name'], i)
-    os.makedirs(os.path.dirname(rule_file), exist_ok=True)
+    rule_file = create_rules_file_name(exp, program, wl['name'], i)
 
     # Handle special naming conventions for the PACK program
     if program.name == "PACK":
@@ -51,52 +53,149 @@ def process_run(arg, program, wl, i):
 
     # Replace placeholders in the command template with actual values
     cmd = (arg.replace("<run>", program.run).replace("<wordlist>", wl['name']).replace("<rules>", rule_file))
+    return cmd, rule_file
+
+
+def get_log_cmd(exp, cmd):
+    """Returns the logged command of a program run.
+    Runs measured in the benchmark mode are logged separately, so a single measurement is not reused for them.
+    """
+    benchmark = exp.config.benchmark
+    if not benchmark.enabled:
+        return cmd
+    return f"{cmd} [trials={benchmark.trials}, warmup={benchmark.warmup}]"
+
 
-    # Skip execution if the command has already been run
-    if shared.LOG and has_command_run(cmd):
-        print(f"ALREADY RUN {cmd}")
+def get_budget(exp, program):
+    """Returns the wall time and memory budget of a program run, limits of the program replace the stage budget."""
+    budget = exp.config.budget
+    return {"time": program.time_limit or budget.rules_time, "memory": program.memory_limit or budget.rules_memory}
+
+
+def summarize_stages(trials):
+    """Averages the pipeline stages over the trials, values of the stages are joined by ';'.
+    Returns None when the command is not a pipeline.
+    """
+    stages = [trial["stages"] for trial in trials if trial["stages"]]
+    if not stages:
+        return None
+    summary = {}
+    for column, attr, fmt in (("time", "elapsed", ".2f"), ("cpu_time", "cpu_time", ".2f"),
+                              ("memory", "memory", ".2f"), ("bytes", "bytes", ".0f")):
+        means = [statistics.fmean(getattr(trial[n], attr) for trial in stages) for n in range(len(stages[0]))]
+        summary[column] = ";".join(format(mean, fmt) for mean in means)
+    return summary
+
+
+async def process_run(exp, arg, program, wl, i):
+    """Executes a single run of a program with the given arguments."""
+    with span(program.name, "program", wordlist=wl['name'], run_index=i), metrics.job("rules"):
+        return await run_program(exp, arg, program, wl, i)
+
+
+async def run_program(exp, arg, program, wl, i):
+    """Runs a program unless the log has its results, and saves the statistics.
+    In the benchmark mode the program runs 'warmup' times without measurement and then 'trials' times.
+    Returns False if the run failed.
+    """
+    cmd, rule_file = get_cmd(exp, arg, program, wl, i)
+    log_cmd = get_log_cmd(exp, cmd)
+    benchmark = exp.config.benchmark
+    budget = get_budget(exp, program)
+    os.makedirs(os.path.dirname(rule_file), exist_ok=True)
+
+    # Skip execution if the command has already been run, the regression check needs a new measurement
+    if exp.log and not exp.remeasure and has_command_run(exp, log_cmd, budget):
+        print(f"ALREADY RUN {log_cmd}")
         if program.name == "PACK":
             rule_file = f"{rule_file}.rule"
 
         # Log the program to CSV if not already recorded
-        if not is_program_record_in_csv(rule_file, wl['name']):
-            program_from_log_to_csv(cmd, program.name, i)
-        return False
-
-    print(f"RUN: {cmd}")
-    result = subprocess.run(f'python3 run_program.py -c "{cmd}"', shell=True, capture_output=True, cwd=shared.SCRIPT_DIR)
-
-    # Handle errors during execution
-    if result.returncode != 0:
-        print(f"{result.stderr.decode()}")
-        if shared.LOG:
-            log_command(cmd, "error", error_message=result.stderr.decode())
-        if os.path.exists(rule_file):
-            os.remove(rule_file)
-        return False
-
-    # Handle special cases for PACK and parse the result
+        if not is_program_record_in_csv(exp, rule_file, wl['name']):
+            program_from_log_to_csv(exp, log_cmd, program.name, i)
+        return True
+
+    # A measurement for the regression check can write different rules, their Hashcat results are then evaluated again
+    final_rule_file = f"{rule_file}.rule" if program.name == "PACK" else rule_file
+    previous_hash = get_file_hash(final_rule_file) if exp.remeasure and os.path.exists(final_rule_file) else None
+
+    print(f"RUN: {log_cmd}")
+    # PACK does not end by itself, it is stopped after it writes the rules and its exit code is ignored
+    is_pack = "rulegen.py" in cmd
+    timeout = exp.config.general.run_timeout or None
+    runs = benchmark.warmup + max(benchmark.trials, 1)
+
+    trials = []
+    exceeded = None
+    for n in range(runs):
+        result = await run_process(cmd, cwd=exp.script_dir, timeout=timeout,
+                                   stop_patterns=[PACK_END_PATTERN] if is_pack else [], measure=True, name=program.name,
+                                   time_limit=budget["time"] or None, memory_limit=budget["memory"] or None, split=True)
+
+        # A run stopped by its budget is kept with the rules written so far, no more trials are run
+        if result.exceeded:
+            exceeded = result.exceeded
+            print(f"OVER BUDGET: {program.name} exceeded the {exceeded} budget: {log_cmd}")
+            trials.append({"time": result.elapsed, "memory": result.memory, "cpu": result.cpu, "stages": result.stages})
+            break
+
+        # Handle errors during execution
+        if result.timed_out or (result.returncode != 0 and not is_pack):
+            error_message = f"Timeout after {timeout} s" if result.timed_out else result.stderr or result.stdout
+            print(f"{error_message}")
+            metrics.fail_job()
+            if exp.log:
+                log_command(exp, log_cmd, "error", error_message=error_message)
+            if os.path.exists(rule_file):
+                os.remove(rule_file)
+            return False
+
+        if n >= benchmark.warmup:
+            trials.append({"time": result.elapsed, "memory": result.memory, "cpu": result.cpu, "stages": result.stages})
+        if benchmark.enabled:
+            kind = "WARMUP" if n < benchmark.warmup else "TRIAL"
+            print(f"{kind} {n + 1}/{runs}: {result.elapsed:.2f} s {cmd}")
+
+    # Handle special cases for PACK and summarize the trials
     rule_file = handle_pack_special_case(program, rule_file)
-    time, memory, cpu = parse_result(result)
-    rule_size = count_lines_in_file(rule_file)
+    if previous_hash and os.path.exists(rule_file) and get_file_hash(rule_file) != previous_hash:
+        print(f"Rules of {rule_file} changed, their Hashcat results are evaluated again.")
+        forget_rule_file(exp, rule_file)
+    stages = summarize_stages(trials)
+    summary = summarize_trials(trials, benchmark.outlier_factor)
+    time, memory, cpu = summary["time"], summary["memory"], summary["cpu"]
+    summary = summary if benchmark.enabled else None
+    rule_size = count_lines_in_file(rule_file) if os.path.exists(rule_file) else 0
+    status = OVER_BUDGET if exceeded else "done"
+
+    # A new benchmark or a measurement for the regression check replaces the previous measurement of the rule file
+    if (summary or exp.remeasure) and delete_program_record(exp, rule_file, wl['name']):
+        print(f"Previous measurement of {rule_file} was replaced.")
 
     # Log the command and results, save the results to a CSV file
-    program_to_csv(program.name, i, rule_file, wl['name'], wl['size'], time, memory, cpu, rule_size)
+    program_to_csv(exp, program.name, i, rule_file, wl['name'], wl['size'], time, memory, cpu, rule_size, summary, status, stages)
 
-    if shared.LOG:
-        log_command(cmd, "done", rule_file=rule_file, wl=wl['name'], wl_size=str(wl['size']), time=time, memory=memory, cpu=cpu, rule_size=str(rule_size))
+    if exp.log:
+        log_command(exp, log_cmd, status, rule_file=rule_file, wl=wl['name'], wl_size=str(wl['size']), time=time, memory=memory, cpu=cpu, rule_size=str(rule_size), benchmark=summary,
+                    budget=budget if exceeded else None, exceeded=exceeded, stages=stages)
 
     return True 
 
 
-def run_cmd():
-    """Main function to execute commands."""
-    for wordlist in shared.WORDLIST_LIST:
-        wl_info = get_wordlist_info(wordlist)
+def run_cmd(exp):
+    """Main function to execute commands. Returns the number of failed runs."""
+    runs = []
+    for wordlist in exp.wordlist_list:
+        wl_info = get_wordlist_info(exp, wordlist)
         if not wl_info:
             print(f"WARNING: No valid wordlist data found for '{wordlist}'. Skipping.")
             continue
-        for program in shared.CONFIG.programs:
+        for program in exp.config.programs:
             for i, arg in enumerate(program.args):
                 for wl in wl_info:
-                    process_run(arg, program, wl, i)
+                    runs.append(process_run(exp, arg, program, wl, i))
+
+    # All runs share one event loop, at most 'parallel_runs' of them at the same time
+    metrics.jobs_queued("rules", len(runs))
+    results = asyncio.run(gather_limited(runs, exp.config.general.parallel_runs))
+    return results.count(False)
@@ -0,0 +1,168 @@
+# Author: Andrea Michlíková - xmichl11
+
+import csv
+import math
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+
+import src.store as store
+from src.benchmark import t_critical
+from src.log import OVER_BUDGET
+
+# Columns of the regression report
+REPORT_HEADER = ["table", "key", "metric", "baseline", "current", "change", "ci_low", "ci_high", "method", "status"]
+
+
+@dataclass
+class Sample:
+    mean: float  # Mean of the trials
+    std: float  # Sample standard deviation of the trials
+    n: int  # Number of trials
+
+
+def to_float(value, default=0.0):
+    """Converts a CSV value to float, empty values give the default."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def pool(samples):
+    """Pools samples of one group, for example runs with different wordlists of the same size."""
+    n = sum(sample.n for sample in samples)
+    mean = sum(sample.mean * sample.n for sample in samples) / n
+    if n < 2:
+        return Sample(mean, 0.0, n)
+    # Sum of squares within the samples and between them
+    squares = sum((sample.n - 1) * sample.std ** 2 + sample.n * (sample.mean - mean) ** 2 for sample in samples)
+    return Sample(mean, math.sqrt(squares / (n - 1)), n)
+
+
+def program_samples(rows, metric):
+    """Groups program rows by (program, run_index, size) into pooled samples of a metric."""
+    grouped = defaultdict(list)
+    for row in rows:
+        key = (row["program"], int(row["run_index"]), int(row["size"]))
+        trials = int(to_float(row.get("trials"), 1)) or 1
+        grouped[key].append(Sample(to_float(row[metric]), to_float(row.get(f"{metric}_std")), trials))
+    return {key: pool(samples) for key, samples in grouped.items()}
+
+
+def compare(baseline, current, threshold):
+    """Compares two samples of a metric where higher values are worse.
+    With trials on both sides the 95% confidence interval of the difference is computed (Welch),
+    a change is reported only when it exceeds the threshold in percent and the interval does not contain zero.
+    Without trials only the threshold is used.
+    """
+    diff = current.mean - baseline.mean
+    change = diff / baseline.mean * 100 if baseline.mean else 0.0
+
+    se2 = (baseline.std ** 2 / baseline.n if baseline.n > 1 else 0) + (current.std ** 2 / current.n if current.n > 1 else 0)
+    if baseline.n > 1 and current.n > 1 and se2 > 0:
+        # Welch–Satterthwaite degrees of freedom
+        df = se2 ** 2 / ((baseline.std ** 2 / baseline.n) ** 2 / (baseline.n - 1)
+                         + (current.std ** 2 / current.n) ** 2 / (current.n - 1))
+        margin = t_critical(int(df)) * math.sqrt(se2)
+        ci_low, ci_high, method = diff - margin, diff + margin, "welch"
+    else:
+        ci_low, ci_high, method = None, None, "threshold"
+
+    if change > threshold and (ci_low is None or ci_low > 0):
+        status = "regression"
+    elif change < -threshold and (ci_high is None or ci_high < 0):
+        status = "improvement"
+    else:
+        status = "ok"
+    return change, ci_low, ci_high, method, status
+
+
+def compare_programs(baseline_rows, current_rows, thresholds):
+    """Compares time and memory of the rule generators per (program, run_index, size)."""
+    report = []
+    for metric, threshold in thresholds.items():
+        baseline = program_samples(baseline_rows, metric)
+        current = program_samples(current_rows, metric)
+        for key in sorted(baseline):
+            key_name = " ".join(map(str, key))
+            if key not in current:
+                report.append(["program", key_name, metric, f"{baseline[key].mean:.2f}", "", "", "", "", "", "missing"])
+                continue
+            change, ci_low, ci_high, method, status = compare(baseline[key], current[key], threshold)
+            report.append([
+                "program", key_name, metric, f"{baseline[key].mean:.2f}", f"{current[key].mean:.2f}", f"{change:.2f}",
+                "" if ci_low is None else f"{ci_low:.2f}", "" if ci_high is None else f"{ci_high:.2f}", method, status,
+            ])
+    return report
+
+
+def compare_hashcat(baseline_rows, current_rows, threshold):
+    """Compares recovered passwords per (rule file, rule size, attack, target), fewer recovered passwords are worse.
+    Hashcat results are deterministic, so the threshold is in percentage points.
+    """
+    def key(row):
+        return (row["rule_file"], int(row["rule_size"]), row["attack"], row["target"])
+
+    current = {key(row): to_float(row["recovered"]) for row in current_rows}
+    report = []
+    for row in baseline_rows:
+        key_name = " ".join(map(str, key(row)))
+        baseline = to_float(row["recovered"])
+        if key(row) not in current:
+            report.append(["hashcat", key_name, "recovered", f"{baseline:.2f}", "", "", "", "", "", "missing"])
+            continue
+        change = current[key(row)] - baseline
+        status = "regression" if change < -threshold else "improvement" if change > threshold else "ok"
+        report.append(["hashcat", key_name, "recovered", f"{baseline:.2f}", f"{current[key(row)]:.2f}",
+                       f"{change:.2f}", "", "", "threshold", status])
+    return report
+
+
+def load_baseline(folder, csv_file):
+    """Loads rows of a baseline CSV file with the same name as the current one."""
+    csv_path = os.path.join(folder, os.path.basename(csv_file))
+    if not os.path.exists(csv_path):
+        print(f"WARNING: Baseline file '{csv_path}' not found.")
+        return []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def check_regressions(exp, baseline_folder=None):
+    """Compares the current statistics with a baseline folder and writes the report.
+    Returns the number of regressions.
+    """
+    con_reg = exp.config.regression
+    con_stats = exp.config.stats
+    folder = baseline_folder or con_reg.baseline
+    if not os.path.isdir(folder):
+        raise ValueError(f"ERROR: Baseline folder '{folder}' not found")
+
+    # Runs stopped by their budget have only partial results
+    finished = lambda rows: [row for row in rows if row.get("status") != OVER_BUDGET]
+    report = compare_programs(
+        finished(load_baseline(folder, con_stats.program_csv_file)),
+        finished(store.select(exp, "program")),
+        {"time": con_reg.time_threshold, "memory": con_reg.memory_threshold},
+    )
+    report += compare_hashcat(
+        finished(load_baseline(folder, con_stats.hashcat_csv_file)),
+        finished(store.select(exp, "hashcat")),
+        con_reg.recovered_threshold,
+    )
+
+    with open(con_stats.regression_csv_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_HEADER)
+        writer.writerows(report)
+
+    # Print the changes, unchanged results are only counted
+    counts = defaultdict(int)
+    for row in report:
+        counts[row[-1]] += 1
+        if row[-1] != "ok":
+            print(f"{row[-1].upper():<12} {row[0]:<8} {row[2]:<10} {row[3]:>10} -> {row[4]:>10} ({row[5]}) {row[1]}")
+    print(f"Regression report saved to {con_stats.regression_csv_file}: "
+          + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    return counts["regression"]
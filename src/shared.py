@@ -1,6 +1,10 @@
 # Author: Andrea Michlíková - xmichl11
 
 import os
+import socket
+from dataclasses import dataclass, field
+from typing import List
+
 from src.config import Config
 from src.files import get_files, make_filepath
 
@@ -10,14 +14,21 @@ DEFAULT_LOG_FILE = "log/log.json"
 # Default recovered file path
 RECOVERED_FILE = "recovered.potfile"
 
-CONFIG = None
-SCRIPT_DIR = None  # Directory of the script
-LOG = None  # Enabled/Disabled logging
-LOG_FILE = None  # Full path to the log file
 
-WORDLIST_LIST = []  # List of wordlist files
-TARGET_LIST = []  # List of target files
-ATTACK_LIST = []  # List of attack files
+@dataclass
+class Experiment:
+    """State of one experiment, passed explicitly to all tasks.
+    Several experiments can run in one process, each one with its own configuration and inputs.
+    """
+    config: Config  # Loaded configuration
+    script_dir: str  # Directory of the script
+    log: bool = True  # Enabled/Disabled logging
+    log_file: str = ""  # Full path to the log file
+    wordlist_list: List[str] = field(default_factory=list)  # List of wordlist files
+    target_list: List[str] = field(default_factory=list)  # List of target files
+    attack_list: List[str] = field(default_factory=list)  # List of attack files
+    temp_folder: str = "temp/"  # Folder for temporary files
+    remeasure: bool = False  # Programs run again even if the log has their results, for the regression check
 
 
 def initialize_filepaths(config):
@@ -29,29 +40,37 @@ def initialize_filepaths(config):
             setattr(config.stats, attr_name, file_path)
 
 
-def initialize_shared(script_directory, args):
-    """Initialize global variables."""
-    global SCRIPT_DIR
-    SCRIPT_DIR = script_directory
+def get_scratch_name():
+    """Returns a name unique for this process on this host, used for files that processes can not share."""
+    return f"{socket.gethostname()}_{os.getpid()}"
 
-    global CONFIG
-    CONFIG = Config.load(os.path.join(SCRIPT_DIR, args.config))
-    initialize_filepaths(CONFIG)
 
-    global LOG
-    LOG = args.log
-    global LOG_FILE
-    LOG_FILE = os.path.join(SCRIPT_DIR, args.log_file)
-    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+def create_experiment(script_directory, config_file, log=True, log_file=DEFAULT_LOG_FILE, scratch_name=None):
+    """Loads a configuration and creates the state of an experiment.
+    The temporary files get a name of the process, so several processes can share one folder.
+    """
+    config = Config.load(os.path.join(script_directory, config_file))
+    scratch_name = scratch_name or get_scratch_name()
+    initialize_filepaths(config)
 
-    global WORDLIST_LIST
-    WORDLIST_LIST = get_files(CONFIG.general.wordlist)
+    log_file = os.path.join(script_directory, log_file)
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-    global TARGET_LIST
-    TARGET_LIST = get_files(CONFIG.general.target)
+    return Experiment(
+        config=config,
+        script_dir=script_directory,
+        log=log,
+        log_file=log_file,
+        wordlist_list=get_files(config.general.wordlist),
+        target_list=get_files(config.general.target),
+        attack_list=get_files(config.general.attack),
+        temp_folder=os.path.join("temp", scratch_name, ""),
+    )
 
-    global ATTACK_LIST
-    ATTACK_LIST = get_files(CONFIG.general.attack)
+
+def initialize_shared(script_directory, args):
+    """Creates the experiment from command-line arguments."""
+    return create_experiment(script_directory, args.config, args.log, args.log_file)
 
 
 # Rule definitions with their descriptions in English and Czech
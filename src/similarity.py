@@ -0,0 +1,133 @@
+# Author: Andrea Michlíková - xmichl11
+
+import heapq
+import json
+import os
+from itertools import combinations
+
+from src.files import get_file_hash, make_filepath, open_input
+from src.log import similarity_to_csv, is_similarity_record_in_csv
+from src.sketch import HyperLogLog, hash64
+
+# Number of the smallest hashes kept in a MinHash (bottom-k) signature
+SIGNATURE_SIZE = 256
+
+# Files with at most this many distinct passwords are compared exactly
+EXACT_LIMIT = 200000
+
+
+def read_passwords(file_path):
+    """Yields non-empty passwords from a file."""
+    with open_input(file_path) as file:
+        for line in file:
+            password = line.strip()
+            if password:
+                yield password
+
+
+def create_signature(file_path):
+    """Creates a bottom-k MinHash signature and a distinct count estimate of a file."""
+    heap = []  # Negated hashes, so the largest kept hash is on top
+    kept = set()
+    distinct = HyperLogLog()
+
+    for password in read_passwords(file_path):
+        h = hash64(password)
+        distinct.add_hash(h)
+        if h in kept:
+            continue
+        if len(heap) < SIGNATURE_SIZE:
+            heapq.heappush(heap, -h)
+            kept.add(h)
+        elif h < -heap[0]:
+            kept.discard(-heapq.heapreplace(heap, -h))
+            kept.add(h)
+
+    return {"hashes": sorted(kept), "distinct": distinct.count()}
+
+
+def load_signature(exp, file_path):
+    """Loads the signature of a file from the cache or creates a new one."""
+    file_hash = get_file_hash(file_path)
+    folder = os.path.join(exp.config.general.cache_folder, "minhash")
+    cache_file = os.path.join(folder, f"{file_hash}_{SIGNATURE_SIZE}.json")
+
+    if os.path.exists(cache_file):
+        with open(cache_file, "r") as f:
+            return json.load(f)
+
+    signature = create_signature(file_path)
+    with open(make_filepath(folder, os.path.basename(cache_file)), "w") as f:
+        json.dump(signature, f)
+    return signature
+
+
+def estimate_jaccard(signature_a, signature_b):
+    """Estimates the Jaccard index from two bottom-k signatures."""
+    hashes_a = set(signature_a["hashes"])
+    hashes_b = set(signature_b["hashes"])
+    union = sorted(hashes_a | hashes_b)[:SIGNATURE_SIZE]
+    if not union:
+        return 0.0
+    both = sum(1 for h in union if h in hashes_a and h in hashes_b)
+    return both / len(union)
+
+
+def compare_minhash(signature_a, signature_b):
+    """Returns the estimated Jaccard index and containments of two files."""
+    jaccard = estimate_jaccard(signature_a, signature_b)
+    size_a, size_b = signature_a["distinct"], signature_b["distinct"]
+
+    # |A ∩ B| = J * |A ∪ B| and |A ∪ B| = |A| + |B| - |A ∩ B|
+    intersection = jaccard * (size_a + size_b) / (1 + jaccard)
+    in_b = min(intersection / size_a, 1.0) if size_a else 0.0
+    in_a = min(intersection / size_b, 1.0) if size_b else 0.0
+    return jaccard, in_b, in_a
+
+
+def compare_exact(set_a, set_b):
+    """Returns the exact Jaccard index and containments of two password sets."""
+    intersection = len(set_a & set_b)
+    union = len(set_a) + len(set_b) - intersection
+    jaccard = intersection / union if union else 0.0
+    in_b = intersection / len(set_a) if set_a else 0.0
+    in_a = intersection / len(set_b) if set_b else 0.0
+    return jaccard, in_b, in_a
+
+
+def get_similarity_files(exp):
+    """Returns all wordlist, attack and target files without duplicates."""
+    files = []
+    for file in exp.wordlist_list + exp.attack_list + exp.target_list:
+        if file not in files:
+            files.append(file)
+    return files
+
+
+def analyze_similarity(exp):
+    """Compares every pair of wordlist, attack and target files."""
+    files = get_similarity_files(exp)
+    signatures = {}
+    exact_sets = {}
+
+    for file_a, file_b in combinations(files, 2):
+        if is_similarity_record_in_csv(exp, file_a, file_b):
+            continue
+
+        for file in (file_a, file_b):
+            if file not in signatures:
+                signatures[file] = load_signature(exp, file)
+
+        # Small files are compared exactly, large ones by their signatures
+        if signatures[file_a]["distinct"] <= EXACT_LIMIT and signatures[file_b]["distinct"] <= EXACT_LIMIT:
+            for file in (file_a, file_b):
+                if file not in exact_sets:
+                    exact_sets[file] = set(read_passwords(file))
+            method = "exact"
+            jaccard, a_in_b, b_in_a = compare_exact(exact_sets[file_a], exact_sets[file_b])
+        else:
+            method = "minhash"
+            jaccard, a_in_b, b_in_a = compare_minhash(signatures[file_a], signatures[file_b])
+
+        similarity_to_csv(exp, file_a, file_b, method, round(jaccard, 4), round(a_in_b, 4), round(b_in_a, 4))
+        print(f"SIMILARITY: {file_a} x {file_b} ({method}) jaccard = {jaccard:.4f}")
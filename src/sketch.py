@@ -0,0 +1,180 @@
+# Author: Andrea Michlíková - xmichl11
+
+import hashlib
+import math
+import random
+
+# Default precision of the HyperLogLog sketch (2^14 registers, ~0.8% error)
+HLL_PRECISION = 14
+
+# Default size of one compactor level in the quantile sketch
+QUANTILE_K = 200
+
+# Default memory of the Bloom filter in MB and its false positive rate when it fits into the memory
+BLOOM_MEMORY = 64
+BLOOM_ERROR_RATE = 0.001
+
+# Mask of 64 bits and the odd multiplier that derives the second hash of the Bloom filter from the first one
+MASK64 = (1 << 64) - 1
+GOLDEN64 = 0x9E3779B97F4A7C15
+
+
+def hash64(value):
+    """Returns a stable 64-bit hash of the given string."""
+    digest = hashlib.blake2b(value.encode("utf-8", errors="replace"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HyperLogLog:
+    """Estimates the number of distinct items with a fixed amount of memory."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        """Adds a string to the sketch."""
+        self.add_hash(hash64(value))
+
+    def add_hash(self, h):
+        """Adds an already computed 64-bit hash to the sketch."""
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merges another sketch with the same precision into this one."""
+        for i, value in enumerate(other.registers):
+            if value > self.registers[i]:
+                self.registers[i] = value
+
+    def count(self):
+        """Returns the estimated number of distinct items."""
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # Small range correction (linear counting)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+def bloom_capacity(memory=BLOOM_MEMORY, error_rate=BLOOM_ERROR_RATE):
+    """Returns the number of distinct items a Bloom filter of 'memory' MB holds with at most 'error_rate' false positives."""
+    return int(memory * 8 * 2**20 * math.log(2) ** 2 / -math.log(error_rate))
+
+
+class BloomFilter:
+    """Approximate set of byte strings with a bounded amount of memory.
+    A false positive makes a new item look like it was already added, items are never missed.
+    """
+
+    def __init__(self, expected, memory=BLOOM_MEMORY, error_rate=BLOOM_ERROR_RATE):
+        expected = max(int(expected), 1)
+        # Optimal number of bits for the expected items and the error rate, at most 'memory' MB
+        bits = math.ceil(-expected * math.log(error_rate) / math.log(2) ** 2)
+        self.m = max(min(bits, memory * 8 * 2**20), 64)
+        self.k = min(max(round(self.m / expected * math.log(2)), 1), 16)
+        self.bits = bytearray((self.m + 7) // 8)
+
+    def add(self, value):
+        """Adds a byte string, returns False if it was (probably) added before.
+        The built-in hash is several times faster than blake2b. It differs between processes,
+        which does not matter for a filter that lives in one process.
+        """
+        h1 = hash(value) & MASK64
+        # Double hashing, the k positions are derived from the hash and a second hash mixed from it
+        h2 = (h1 * GOLDEN64 & MASK64) | 1
+        bits, m, new = self.bits, self.m, False
+        for _ in range(self.k):
+            bit = h1 % m
+            mask = 1 << (bit & 7)
+            if not bits[bit >> 3] & mask:
+                bits[bit >> 3] |= mask
+                new = True
+            h1 += h2
+        return new
+
+    def error_rate(self, count):
+        """Returns the false positive rate after 'count' distinct items were added."""
+        return (1 - math.exp(-self.k * count / self.m)) ** self.k
+
+
+class QuantileSketch:
+    """KLL-style quantile sketch with bounded memory."""
+
+    def __init__(self, k=QUANTILE_K, seed=0):
+        self.k = k
+        self.levels = [[]]
+        self.n = 0
+        self.random = random.Random(seed)
+
+    def add(self, value):
+        """Adds a value to the sketch."""
+        self.levels[0].append(value)
+        self.n += 1
+        if len(self.levels[0]) >= self.k:
+            self._compress()
+
+    def _compress(self):
+        """Halves every full level and promotes the survivors one level up."""
+        for level, items in enumerate(self.levels):
+            if len(items) < self.k:
+                break
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            items.sort()
+            offset = self.random.randint(0, 1)
+            self.levels[level + 1].extend(items[offset::2])
+            self.levels[level] = []
+
+    def quantile(self, q):
+        """Returns the approximate value at quantile q (0.0 - 1.0)."""
+        weighted = sorted(
+            (value, 1 << level)
+            for level, items in enumerate(self.levels)
+            for value in items
+        )
+        if not weighted:
+            return 0
+        total = sum(weight for _, weight in weighted)
+        rank = q * total
+        cumulative = 0
+        for value, weight in weighted:
+            cumulative += weight
+            if cumulative >= rank:
+                return value
+        return weighted[-1][0]
+
+
+def histogram_median(histogram):
+    """Returns the median of values stored as a {value: count} histogram."""
+    n = sum(histogram.values())
+    if not n:
+        return 0
+    # Positions of the middle element(s), same as statistics.median
+    low, high = (n - 1) // 2, n // 2
+    low_value = high_value = None
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if low_value is None and seen > low:
+            low_value = value
+        if seen > high:
+            high_value = value
+            break
+    return (low_value + high_value) / 2
+
+
+def histogram_mean(histogram):
+    """Returns the mean of values stored as a {value: count} histogram."""
+    n = sum(histogram.values())
+    if not n:
+        return 0
+    return sum(value * count for value, count in histogram.items()) / n
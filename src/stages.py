@@ -0,0 +1,304 @@
+# Author: Andrea Michlíková - xmichl11
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field, asdict
+from typing import Callable, List, Optional
+
+import src.shared as shared
+from src.files import get_file_hash, get_rules_list, file_lock, delete_temporary_folder
+from src.preprocess import preprocess_inputs
+from src.profiler import span, profile_stage
+import src.metrics as metrics
+
+
+@dataclass
+class Stage:
+    name: str  # Name of the stage
+    run: Callable[[], Optional[int]]  # Function that runs the stage, returns the number of failed jobs
+    inputs: Callable[[], List[str]]  # Files whose content decides if the stage has to run
+    outputs: Callable[[], List[str]]  # Files created by the stage
+    params: Callable[[], object] = lambda: None  # Configuration that decides if the stage has to run
+    after: List[str] = field(default_factory=list)  # Stages that have to finish first
+    enabled: bool = True  # Enabled/Disabled stage
+    rerun: bool = False  # The stage runs even if its inputs did not change
+
+
+class StageState:
+    """Fingerprints of finished stages and hashes of their input files, saved between runs."""
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.data = self.load()
+
+    def load(self):
+        """Loads the saved state."""
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                try:
+                    return json.load(f)
+                except json.JSONDecodeError:
+                    pass
+        return {"stages": {}, "files": {}}
+
+    def file_hash(self, file_path):
+        """Returns the content hash of a file, files with unchanged size and mtime are not hashed again."""
+        if not os.path.exists(file_path):
+            return "missing"
+        stat = os.stat(file_path)
+        with self.lock:
+            cached = self.data["files"].get(file_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        file_hash = get_file_hash(file_path)
+        with self.lock:
+            self.data["files"][file_path] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        return file_hash
+
+    def fingerprint(self, stage):
+        """Returns the fingerprint of the stage inputs and configuration."""
+        sha = hashlib.sha256()
+        sha.update(json.dumps(stage.params(), sort_keys=True, default=str).encode())
+        for file_path in sorted(set(stage.inputs())):
+            sha.update(f"{file_path}:{self.file_hash(file_path)}\n".encode())
+        return sha.hexdigest()
+
+    def is_up_to_date(self, stage, fingerprint):
+        """Checks if the stage already ran with the same inputs and all its outputs exist."""
+        with self.lock:
+            saved = self.data["stages"].get(stage.name)
+        return saved == fingerprint and all(os.path.exists(f) for f in stage.outputs())
+
+    def save(self, stage, fingerprint):
+        """Saves the fingerprint of a finished stage into the state saved by other processes.
+        Only this stage is updated, fingerprints of other stages may be newer in the saved state.
+        """
+        with self.lock, file_lock(self.state_file):
+            saved = self.load()
+            saved["stages"][stage.name] = fingerprint
+            self.data["stages"] = saved["stages"]
+            self.data["files"] = {**saved["files"], **self.data["files"]}
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            temp_file = f"{self.state_file}.{os.getpid()}.tmp"
+            with open(temp_file, "w") as f:
+                json.dump(self.data, f, indent=4)
+            os.replace(temp_file, self.state_file)
+
+
+def run_stage(stage, state, force):
+    """Runs a stage if its inputs changed since its last run.
+    A stage with failed jobs is not saved, so it runs again next time.
+    """
+    fingerprint = state.fingerprint(stage)
+    if not (force or stage.rerun) and state.is_up_to_date(stage, fingerprint):
+        print(f"STAGE {stage.name}: up to date")
+        metrics.stage_state(stage.name, "up_to_date")
+        return
+
+    print(f"STAGE {stage.name}: running")
+    metrics.stage_state(stage.name, "running")
+    try:
+        with profile_stage(stage.name):
+            failed = stage.run()
+    except BaseException:
+        metrics.stage_state(stage.name, "failed")
+        raise
+    if failed:
+        print(f"STAGE {stage.name}: failed jobs ({failed}), the stage runs again next time")
+        metrics.stage_state(stage.name, "failed")
+        return
+    state.save(stage, fingerprint)
+    metrics.stage_state(stage.name, "done")
+
+
+def run_stages(exp, stages, force=False):
+    """Runs enabled stages in dependency order, independent stages run concurrently."""
+    state = StageState(exp.config.stats.stage_state_file)
+    enabled = {stage.name for stage in stages if stage.enabled}
+    pending = [stage for stage in stages if stage.enabled]
+    done = set()
+
+    with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as pool:
+        running = {}
+        while pending or running:
+            # Start every stage whose enabled dependencies have finished
+            for stage in list(pending):
+                if all(dep in done or dep not in enabled for dep in stage.after):
+                    running[pool.submit(run_stage, stage, state, force)] = stage.name
+                    pending.remove(stage)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()  # Re-raise errors from the stage
+                done.add(running.pop(future))
+
+
+##############################################################################################
+def config_params(*parts):
+    """Returns configuration parts in a form that can be fingerprinted."""
+    return [asdict(part) if hasattr(part, "__dataclass_fields__") else part for part in parts]
+
+
+# Stage modules and their dependencies, such as zxcvbn or Jinja2, are imported only when a stage runs,
+# so a run with cached or disabled stages starts quickly
+def run_rules_stage(exp):
+    """Runs the rule generators, returns the number of failed runs."""
+    from src.program_task import run_cmd
+    return run_cmd(exp)
+
+
+def run_hashcat_stage(exp, rules_files=None, attack_sizes=None):
+    """Runs Hashcat, only with full rule files when Hashcat is needed just for zxcvbn.
+    Returns the number of failed runs.
+    """
+    from src.hashcat_task import run_hashcat
+    if not exp.config.stats.recovered_guesses:
+        exp.config.input.rules_size = [0]
+    return run_hashcat(exp, rules_files, attack_sizes)
+
+
+def run_zxcvbn_stage(exp):
+    from src.zxcvbn_task import zxcvbn_for_target
+    zxcvbn_for_target(exp)
+
+
+def run_wordlist_stage(exp):
+    from src.analyze_files import analyze_wordlist
+    analyze_wordlist(exp)
+
+
+def run_similarity_stage(exp):
+    from src.similarity import analyze_similarity
+    analyze_similarity(exp)
+
+
+def build_stages(exp):
+    """Creates the stage graph of a run from the configuration."""
+    con = exp.config
+    con_stats = con.stats
+
+    program_stats = (con_stats.time_passwords or con_stats.memory_passwords
+                     or con_stats.rules_passwords or con_stats.cpu_passwords)
+    zxcvbn = con_stats.zxcvbn_recovered or con_stats.zxcvbn_score
+    # Only the enabled zxcvbn statistics are written, a missing disabled one would run the stages every time
+    zxcvbn_csv = ([con_stats.zxcvbn_recovered_csv_file] if con_stats.zxcvbn_recovered else []) + \
+                 ([con_stats.zxcvbn_score_csv_file] if con_stats.zxcvbn_score else [])
+
+    # One results model is shared by all LaTeX stages, it is created by the first of them and tables are loaded on first use
+    models = []
+    model_lock = threading.Lock()
+
+    def tex(render):
+        """Renders a LaTeX output with the shared model, 'render' returns the function of src.latex."""
+        import src.latex as latex
+        with model_lock:
+            if not models:
+                models.append(latex.ResultsModel(exp))
+        render(latex)(exp, models[0])
+
+    templates = lambda *names: [os.path.join("templates", name) for name in names]
+
+    return [
+        # Rule generation
+        Stage("rules", lambda: run_rules_stage(exp),
+              inputs=lambda: exp.wordlist_list,
+              outputs=lambda: [con_stats.program_csv_file],
+              params=lambda: config_params(*con.programs, con.general.rules_file, con.input.wordlist_size, con.benchmark,
+                                           con.budget.rules_time, con.budget.rules_memory, con.general.run_timeout),
+              enabled=program_stats, rerun=exp.remeasure),
+        # Attack with Hashcat, also evaluates recovered passwords with zxcvbn
+        Stage("hashcat", lambda: run_hashcat_stage(exp),
+              inputs=lambda: get_rules_list(exp) + exp.attack_list + exp.target_list,
+              outputs=lambda: ([con_stats.hashcat_csv_file] if con_stats.recovered_guesses else []) + (zxcvbn_csv if zxcvbn else []),
+              params=lambda: config_params(con.input.rules_size, con_stats.recovered_guesses, zxcvbn, con.budget.hashcat_time,
+                                           con.budget.hashcat_memory, con.budget.hashcat_candidates, con.dedup,
+                                           con.general.run_timeout),
+              after=["rules"],
+              enabled=con_stats.recovered_guesses or zxcvbn),
+        # Evaluation of target passwords with zxcvbn
+        Stage("zxcvbn_targets", lambda: run_zxcvbn_stage(exp),
+              inputs=lambda: exp.target_list,
+              outputs=lambda: zxcvbn_csv,
+              params=lambda: config_params(con_stats.zxcvbn_recovered, con_stats.zxcvbn_score),
+              enabled=zxcvbn),
+        # Analysis of wordlists
+        Stage("wordlist", lambda: run_wordlist_stage(exp),
+              inputs=lambda: exp.wordlist_list,
+              outputs=lambda: [con_stats.wordlist_csv_file],
+              enabled=con_stats.analyze_wordlist),
+        # Similarity of wordlists, attack and target files
+        Stage("similarity", lambda: run_similarity_stage(exp),
+              inputs=lambda: exp.wordlist_list + exp.attack_list + exp.target_list,
+              outputs=lambda: [con_stats.similarity_csv_file],
+              enabled=con_stats.analyze_similarity),
+
+        # LaTeX graphs and tables
+        Stage("tex_program", lambda: tex(lambda latex: latex.program_tex),
+              inputs=lambda: [con_stats.program_csv_file] + templates("program_graph.tex.jinja"),
+              outputs=lambda: [getattr(con_stats, f"{t}_passwords_file") for t in ["memory", "time", "cpu", "rules"]
+                               if getattr(con_stats, f"{t}_passwords")],
+              params=lambda: config_params(con_stats, con.input.wordlist_size),
+              after=["rules"],
+              enabled=program_stats),
+        Stage("tex_hashcat", lambda: tex(lambda latex: latex.hashcat_tex),
+              inputs=lambda: [con_stats.hashcat_csv_file] + templates("program_graph.tex.jinja"),
+              outputs=lambda: [con_stats.recovered_guesses_file],
+              params=lambda: config_params(con.input.rules_size, con_stats.plot_points),
+              after=["hashcat"],
+              enabled=con_stats.recovered_guesses),
+        Stage("tex_zxcvbn_recovered", lambda: tex(lambda latex: latex.zxcvbn_recovered_tex),
+              inputs=lambda: [con_stats.zxcvbn_recovered_csv_file] + templates("bar_graph.tex.jinja"),
+              outputs=lambda: [con_stats.zxcvbn_recovered_file],
+              after=["hashcat", "zxcvbn_targets"],
+              enabled=con_stats.zxcvbn_recovered),
+        Stage("tex_zxcvbn_score", lambda: tex(lambda latex: latex.zxcvbn_score_tex),
+              inputs=lambda: [con_stats.zxcvbn_score_csv_file] + templates("bar_graph.tex.jinja"),
+              outputs=lambda: [con_stats.zxcvbn_score_file],
+              after=["hashcat", "zxcvbn_targets"],
+              enabled=con_stats.zxcvbn_score),
+        Stage("tex_program_hashcat", lambda: tex(lambda latex: latex.program_hashcat_tex_table),
+              inputs=lambda: [con_stats.program_csv_file, con_stats.hashcat_csv_file] + templates("table.tex.jinja"),
+              outputs=lambda: [os.path.join(con.general.stats_folder, "hashcat_table.tex")],
+              after=["rules", "hashcat"],
+              enabled=program_stats and con_stats.recovered_guesses),
+        Stage("tex_wordlist", lambda: tex(lambda latex: latex.wordlist_tex_table),
+              inputs=lambda: [con_stats.wordlist_csv_file] + templates("wordlist_table.tex.jinja"),
+              outputs=lambda: [con_stats.analyze_wordlist_file],
+              after=["wordlist"],
+              enabled=con_stats.analyze_wordlist),
+        Stage("tex_similarity", lambda: tex(lambda latex: latex.similarity_tex_table),
+              inputs=lambda: [con_stats.similarity_csv_file] + templates("similarity_table.tex.jinja"),
+              outputs=lambda: [con_stats.analyze_similarity_file],
+              after=["similarity"],
+              enabled=con_stats.analyze_similarity),
+    ]
+
+
+##############################################################################################
+def run_experiment(exp, force=False):
+    """Runs all stages of one experiment."""
+    with span("preprocess", "stage"):
+        preprocess_inputs(exp)  # Replace raw input files with cleaned ones from the cache
+    try:
+        run_stages(exp, build_stages(exp), force=force)
+    finally:
+        delete_temporary_folder(exp)
+
+
+def run_experiments(config_files, script_dir=".", log=True, log_file=shared.DEFAULT_LOG_FILE, force=False):
+    """Runs several configurations at once in one process and returns their experiments.
+    Every experiment gets its own recovered and temporary files, so Hashcat runs do not overwrite each other.
+    """
+    experiments = [
+        shared.create_experiment(script_dir, config_file, log, log_file, f"{shared.get_scratch_name()}_{i}")
+        for i, config_file in enumerate(config_files)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max(len(experiments), 1)) as pool:
+        for future in [pool.submit(run_experiment, exp, force) for exp in experiments]:
+            future.result()
+    return experiments
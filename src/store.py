@@ -0,0 +1,291 @@
+# Author: Andrea Michlíková - xmichl11
+
+import csv
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+import src.shared as shared
+from src.files import file_lock
+from src.profiler import traced
+
+# Tables of the results store, each one mirrors one CSV file from the stats section
+TABLES = {
+    "program": {
+        "csv": "program_csv_file",
+        "columns": [
+            ("program", "TEXT"), ("run_index", "INTEGER"), ("rule_file", "TEXT"), ("wordlist", "TEXT"),
+            ("size", "INTEGER"), ("time", "REAL"), ("memory", "REAL"), ("cpu", "REAL"), ("rules", "INTEGER"),
+            ("trials", "INTEGER"), ("time_std", "REAL"), ("time_ci", "REAL"), ("memory_std", "REAL"),
+            ("memory_ci", "REAL"), ("cpu_std", "REAL"), ("cpu_ci", "REAL"), ("status", "TEXT"),
+            ("stage_time", "TEXT"), ("stage_cpu_time", "TEXT"), ("stage_memory", "TEXT"), ("stage_bytes", "TEXT"),
+        ],
+        "indexes": [("rule_file", "wordlist"), ("program", "run_index", "size")],
+    },
+    "hashcat": {
+        "csv": "hashcat_csv_file",
+        "columns": [
+            ("rule_file", "TEXT"), ("rule_size", "INTEGER"), ("attack", "TEXT"), ("attack_size", "INTEGER"),
+            ("target", "TEXT"), ("progress", "INTEGER"), ("recovered", "REAL"), ("status", "TEXT"),
+            ("raw_guesses", "INTEGER"), ("effective_guesses", "INTEGER"),
+        ],
+        "indexes": [("rule_file", "rule_size", "attack", "target"), ("attack",), ("target",)],
+    },
+    "zxcvbn_recovered": {
+        "csv": "zxcvbn_recovered_csv_file",
+        "columns": [("file_name", "TEXT"), ("recovered", "REAL"), ("guesses_log10", "REAL"), ("n", "INTEGER")],
+        "indexes": [("file_name",)],
+    },
+    "zxcvbn_score": {
+        "csv": "zxcvbn_score_csv_file",
+        "columns": [("file_name", "TEXT"), ("recovered", "REAL")] + [(f"score_{i}", "INTEGER") for i in range(5)],
+        "indexes": [("file_name",)],
+    },
+    "rules": {
+        "csv": "rules_csv_file",
+        "columns": [("rule_file", "TEXT")] + [(rule, "INTEGER") for rule in shared.RULE_ORDER],
+        "indexes": [("rule_file",)],
+    },
+    "wordlist": {
+        "csv": "wordlist_csv_file",
+        "columns": [
+            ("wordlist", "TEXT"), ("size", "INTEGER"), ("avg_len", "REAL"), ("median_len", "INTEGER"),
+            ("avg_entropy", "REAL"), ("entropy_above", "INTEGER"), ("ascii", "INTEGER"),
+        ] + [(charset, "INTEGER") for charset in shared.CHARSET] + [
+            ("distinct", "INTEGER"), ("entropy_p90", "REAL"), ("entropy_p99", "REAL"),
+        ],
+        "indexes": [("wordlist",)],
+    },
+    "similarity": {
+        "csv": "similarity_csv_file",
+        "columns": [
+            ("file_a", "TEXT"), ("file_b", "TEXT"), ("method", "TEXT"),
+            ("jaccard", "REAL"), ("a_in_b", "REAL"), ("b_in_a", "REAL"),
+        ],
+        "indexes": [("file_a", "file_b")],
+    },
+}
+
+# Connections are not shared between threads
+_local = threading.local()
+
+
+def quote(name):
+    """Quotes a column or table name for SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def column(name):
+    """Returns the quoted SQL column of a CSV column.
+    SQL column names are case insensitive, so rules like "c" and "C" are stored by their character codes.
+    """
+    if name.isidentifier() and name == name.lower():
+        return quote(name)
+    return quote("x" + name.encode("utf-8").hex())
+
+
+def get_header(table):
+    """Returns the CSV header of a table."""
+    return [name for name, _ in TABLES[table]["columns"]]
+
+
+def get_csv_path(exp, table):
+    """Returns the path to the CSV file of a table."""
+    return getattr(exp.config.stats, TABLES[table]["csv"])
+
+
+def get_table_for_csv(exp, csv_path):
+    """Returns the table that mirrors the given CSV file, or None."""
+    for table in TABLES:
+        if get_csv_path(exp, table) == csv_path:
+            return table
+    return None
+
+
+def get_csv_state(exp, table):
+    """Returns the size and modification time of the CSV file of a table."""
+    csv_path = get_csv_path(exp, table)
+    if not os.path.exists(csv_path):
+        return 0, 0
+    stat = os.stat(csv_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def create_schema(db):
+    """Creates the tables, indexes and the table with the state of imported CSV files."""
+    db.execute("CREATE TABLE IF NOT EXISTS csv_state (name TEXT PRIMARY KEY, size INTEGER, mtime INTEGER)")
+    for table, info in TABLES.items():
+        columns = ", ".join(f"{column(name)} {type}" for name, type in info["columns"])
+        db.execute(f"CREATE TABLE IF NOT EXISTS {quote(table)} ({columns})")
+        for index in info["indexes"]:
+            index_name = quote(f"idx_{table}_{'_'.join(index)}")
+            db.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {quote(table)} ({', '.join(map(column, index))})")
+    db.commit()
+
+
+def connect(exp):
+    """Returns the connection to the results store of the current thread."""
+    db_path = exp.config.stats.results_db_file
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    db = connections.get(db_path)
+    if db is None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        db = sqlite3.connect(db_path, timeout=60)
+        db.row_factory = sqlite3.Row
+        create_schema(db)
+        connections[db_path] = db
+    return db
+
+
+def close(exp):
+    """Closes the connection of the current thread to the results store of an experiment."""
+    connections = getattr(_local, "connections", {})
+    db = connections.pop(exp.config.stats.results_db_file, None)
+    if db is not None:
+        db.close()
+
+
+@traced("csv")
+def sync_table(exp, table):
+    """Imports the CSV file of a table again if it was changed outside of the store.
+    The CSV file is locked, so a row appended by another process is never imported before it is inserted.
+    """
+    db = connect(exp)
+    with file_lock(get_csv_path(exp, table)):
+        state = db.execute("SELECT size, mtime FROM csv_state WHERE name = ?", (table,)).fetchone()
+        if state is None or tuple(state) != get_csv_state(exp, table):
+            import_csv(exp, table)
+            # CSV files from older versions are rewritten with the current columns, new columns stay empty
+            if read_csv_header(get_csv_path(exp, table)) not in (None, get_header(table)):
+                export_csv(exp, table)
+                print(f"CSV file '{get_csv_path(exp, table)}' was updated to the current columns.")
+
+
+def read_csv_header(csv_path):
+    """Returns the header of a CSV file, or None if the file is empty or does not exist."""
+    if not os.path.exists(csv_path):
+        return None
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), None)
+
+
+def save_csv_state(exp, db, table):
+    """Remembers the state of the CSV file that matches the content of the table."""
+    db.execute("INSERT OR REPLACE INTO csv_state (name, size, mtime) VALUES (?, ?, ?)", (table, *get_csv_state(exp, table)))
+
+
+def read_csv(exp, table):
+    """Returns the rows of the CSV file of a table as dictionaries, without creating or updating the store.
+    Empty values are None like in the store, values are not converted to the column types.
+    """
+    csv_path = get_csv_path(exp, table)
+    if not os.path.exists(csv_path):
+        return []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return [{name: value or None for name, value in row.items()} for row in csv.DictReader(f)]
+
+
+@traced("csv")
+def import_csv(exp, table, csv_path=None):
+    """Replaces the content of a table with the content of its CSV file."""
+    db = connect(exp)
+    csv_path = csv_path or get_csv_path(exp, table)
+    header = get_header(table)
+
+    db.execute(f"DELETE FROM {quote(table)}")
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            db.executemany(insert_sql(table), ([row.get(name) or None for name in header] for row in reader))
+    save_csv_state(exp, db, table)
+    db.commit()
+
+
+@traced("csv")
+def export_csv(exp, table, csv_path=None):
+    """Writes the content of a table to its CSV file."""
+    db = connect(exp)
+    csv_path = csv_path or get_csv_path(exp, table)
+    header = get_header(table)
+
+    os.makedirs(os.path.dirname(csv_path) or ".", exist_ok=True)
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in db.execute(f"SELECT {', '.join(map(column, header))} FROM {quote(table)} ORDER BY rowid"):
+            writer.writerow(["" if value is None else value for value in row])
+    save_csv_state(exp, db, table)
+    db.commit()
+
+
+def insert_sql(table):
+    """Returns the SQL statement that inserts one row into a table."""
+    header = get_header(table)
+    return f"INSERT INTO {quote(table)} ({', '.join(map(column, header))}) VALUES ({', '.join('?' * len(header))})"
+
+
+@traced("csv")
+def insert(exp, table, data):
+    """Inserts a row, which was already appended to the CSV file, into a table."""
+    db = connect(exp)
+    db.execute(insert_sql(table), data)
+    save_csv_state(exp, db, table)
+    db.commit()
+
+
+@traced("csv")
+def delete(exp, table, **where):
+    """Deletes all rows of a table with the given column values and writes the table to its CSV file."""
+    with file_lock(get_csv_path(exp, table)):
+        sync_table(exp, table)
+        db = connect(exp)
+        condition = " AND ".join(f"{column(name)} = ?" for name in where)
+        deleted = db.execute(f"DELETE FROM {quote(table)} WHERE {condition}", tuple(where.values())).rowcount
+        if deleted:
+            export_csv(exp, table)
+        else:
+            db.commit()
+        return deleted
+
+
+@traced("csv")
+def exists(exp, table, **where):
+    """Checks if a table contains a row with the given column values."""
+    sync_table(exp, table)
+    condition = " AND ".join(f"{column(name)} = ?" for name in where)
+    sql = f"SELECT 1 FROM {quote(table)} WHERE {condition} LIMIT 1"
+    return connect(exp).execute(sql, tuple(where.values())).fetchone() is not None
+
+
+@traced("csv")
+def select(exp, table, order_by="rowid", **where):
+    """Returns all rows of a table with the given column values."""
+    sync_table(exp, table)
+    header = get_header(table)
+    sql = f"SELECT {', '.join(map(column, header))} FROM {quote(table)}"
+    if where:
+        sql += " WHERE " + " AND ".join(f"{column(name)} = ?" for name in where)
+    sql += f" ORDER BY {order_by}"
+    return [dict(zip(header, row)) for row in connect(exp).execute(sql, tuple(where.values()))]
+
+
+@lru_cache(maxsize=None)
+def get_record_type(table):
+    """Returns the named tuple type for the rows of a table.
+    Columns that are not valid identifiers (rules like "$") get positional names, see get_header.
+    """
+    return namedtuple(f"{table.title().replace('_', '')}Record", get_header(table), rename=True)
+
+
+@traced("csv")
+def load_records(exp, table):
+    """Loads all rows of a table as named tuples in the order they were added."""
+    sync_table(exp, table)
+    record_type = get_record_type(table)
+    sql = f"SELECT {', '.join(map(column, get_header(table)))} FROM {quote(table)} ORDER BY rowid"
+    return [record_type._make(row) for row in connect(exp).execute(sql)]
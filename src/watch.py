@@ -0,0 +1,176 @@
+# Author: Andrea Michlíková - xmichl11
+
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+from src.files import get_rules_list, get_file_hash, count_lines_in_file, list_subdirectories, delete_temporary_folder
+from src.log import forget_rule_file
+from src.profiler import span
+from src.stages import build_stages, run_stages, run_experiment, run_hashcat_stage
+
+# inotify events of a file that was written, moved into a folder or created (also new subfolders)
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+
+class InotifyWatcher:
+    """Wakes up when a file in the watched folders is written or moved in, Linux only."""
+
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for folder in folders:
+            if libc.inotify_add_watch(self.fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+
+    def wait(self, timeout=None):
+        """Waits for events at most 'timeout' seconds, the folders are scanned after it anyway."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        try:
+            while ready and os.read(self.fd, 65536):
+                pass  # Only the wake up matters, the events themselves are not needed
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Wakes up every 'interval' seconds, used where inotify is not available."""
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def wait(self, timeout=None):
+        time.sleep(min(timeout, self.interval) if timeout is not None else self.interval)
+
+    def close(self):
+        pass
+
+
+def get_watched_folders(exp):
+    """Returns the folders with the rule files of the experiment."""
+    folder = exp.config.general.hashcat_folder
+    if folder:
+        folder = os.path.join(exp.script_dir, folder)
+        return [folder] + list_subdirectories(folder)
+    # Without 'hashcat_folder' the rule files are written by the generators
+    return sorted({os.path.dirname(os.path.abspath(file)) for file in get_rules_list(exp)})
+
+
+def create_watcher(folders, interval):
+    """Returns an inotify watcher of the folders, or a polling one if inotify cannot be used."""
+    try:
+        return InotifyWatcher(folders)
+    except (OSError, AttributeError) as e:
+        print(f"WARNING: inotify is not available ({e}), the folders are checked every {interval} s.")
+        return PollingWatcher(interval)
+
+
+def scan_rule_files(exp):
+    """Returns the size and modification time of every rule file of the experiment."""
+    files = {}
+    for file in get_rules_list(exp):
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            continue  # Deleted between listing and stat
+        files[file] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+class WatchState:
+    """State kept between evaluations: the sizes of the attack files and the rule files with their content hashes.
+    The log and the CSV indexes stay loaded in the log and store modules.
+    """
+
+    def __init__(self, exp):
+        self.exp = exp
+        self.attack_sizes = {file: count_lines_in_file(file) for file in exp.attack_list}
+        self.files = scan_rule_files(exp)  # Rule files with their state when they were last evaluated
+        self.hashes = {file: get_file_hash(file) for file in self.files}
+        self.seen = dict(self.files)  # State of the rule files at the last scan
+
+    def changed_files(self):
+        """Returns the rule files that are new or changed and were not written since the last scan,
+        and whether some other files are still being written.
+        """
+        current = scan_rule_files(self.exp)
+        changed = {file for file, state in current.items() if self.files.get(file) != state}
+        settled = {file for file in changed if self.seen.get(file) == current[file]}
+        self.seen = current
+        for file in set(self.files) - set(current):
+            del self.files[file]  # Deleted rule files are forgotten, their results are kept
+            self.hashes.pop(file, None)
+        return sorted(settled), len(changed) > len(settled)
+
+    def take(self, files):
+        """Marks the files as evaluated and returns the ones with new content and the changed ones."""
+        new, modified = [], []
+        for file in files:
+            self.files[file] = self.seen[file]
+            try:
+                file_hash = get_file_hash(file)
+            except FileNotFoundError:
+                continue  # Deleted after the scan
+            if self.hashes.get(file) == file_hash:
+                continue  # Only the modification time changed
+            (modified if file in self.hashes else new).append(file)
+            self.hashes[file] = file_hash
+        return new, modified
+
+
+def evaluate_rule_files(exp, state, files):
+    """Runs Hashcat, zxcvbn and the LaTeX outputs of Hashcat for the given rule files."""
+    with span("watch", "stage", files=len(files)):
+        run_hashcat_stage(exp, files, state.attack_sizes)
+        # The LaTeX outputs are rendered from the CSV files, so they include all rule files
+        run_stages(exp, [stage for stage in build_stages(exp) if stage.name.startswith("tex_") and "hashcat" in stage.after])
+    delete_temporary_folder(exp)
+
+
+def watch_experiment(exp, force=False):
+    """Runs the experiment and then evaluates rule files as soon as they appear in the rule folder.
+    A file is evaluated when it was not written for 'watch_settle' seconds, changed files are evaluated again.
+    Runs until it is interrupted.
+    """
+    general = exp.config.general
+    run_experiment(exp, force=force)
+
+    state = WatchState(exp)
+    folders = get_watched_folders(exp)
+    watcher = create_watcher(folders, general.watch_interval)
+    print(f"WATCH: {len(state.files)} rule files in {', '.join(folders)}")
+    writing = False
+    try:
+        while True:
+            # While files are written the folders are scanned again after 'watch_settle' seconds
+            watcher.wait(general.watch_settle if writing else None)
+            files, writing = state.changed_files()
+
+            # New subfolders are watched too
+            if get_watched_folders(exp) != folders:
+                watcher.close()
+                folders = get_watched_folders(exp)
+                watcher = create_watcher(folders, general.watch_interval)
+
+            new, modified = state.take(files)
+            for file in modified:
+                print(f"WATCH: {file} was changed, its previous results were deleted")
+                forget_rule_file(exp, file)
+            if new or modified:
+                print(f"WATCH: evaluating {len(new) + len(modified)} rule files")
+                evaluate_rule_files(exp, state, new + modified)
+                print("WATCH: waiting for rule files")
+    except KeyboardInterrupt:
+        print("WATCH: stopped")
+    finally:
+        watcher.close()
@@ -1,15 +1,19 @@
 # Author: Andrea Michlíková - xmichl11
 
 import os
+import time
 from collections import defaultdict
-from zxcvbn import zxcvbn
 
 from src.log import log_command, zxcvbn_recovered_to_csv, zxcvbn_score_to_csv, is_file_record_in_csv
-import src.shared as shared
+from src.files import open_input
+from src.profiler import traced
+import src.metrics as metrics
 
 
 def analyze_passwords(file_path: str):
     """Analyzes passwords in the given file and calculates statistics."""
+    from zxcvbn import zxcvbn  # Loading of the frequency lists is slow, they are loaded only when needed
+
     guesses_log10 = defaultdict(int)
     score = defaultdict(int)
 
@@ -17,12 +21,17 @@ def analyze_passwords(file_path: str):
     for i in range(5):
         score[i]
 
-    with open(file_path, "r") as file:
+    start_time = time.monotonic()
+    analyzed = 0
+    with open_input(file_path) as file:
         for line in file:
             password = line.strip()
             # Skip empty lines and passwords longer than 72 characters
             if password and len(password) <= 72:
                 results = zxcvbn(password)
+                analyzed += 1
+                if analyzed % 1000 == 0:
+                    metrics.set_value("pwdre_zxcvbn_passwords_per_second", analyzed / (time.monotonic() - start_time))
                 # Round guesses_log10 to the nearest 0.5 and count occurrences
                 tmp = round(results['guesses_log10'] * 2) / 2
                 guesses_log10[tmp] += 1
@@ -32,37 +41,41 @@ def analyze_passwords(file_path: str):
     return guesses_log10, score
 
 
-def run_zxcvbn(cmd, file, recovered=100.0, rule=False):
-    """Processes zxcvbn output and saves statistics."""
+@traced("zxcvbn")
+def run_zxcvbn(exp, cmd, file, recovered=100.0, recovered_file=None):
+    """Processes zxcvbn output and saves statistics.
+    With a recovered file of a Hashcat run, the passwords recovered with the rule file are analyzed.
+    """
     guesses_log10 = {}
     score = {}
 
     # Analyze the recovered file or analyze the given file
-    if rule:
-        guesses_log10, score = analyze_passwords(shared.RECOVERED_FILE)
+    if recovered_file:
+        guesses_log10, score = analyze_passwords(recovered_file)
     else:
         guesses_log10, score = analyze_passwords(file)
 
     # Save recovered statistics to CSV if not already logged
-    if (shared.CONFIG.stats.zxcvbn_recovered and
-        not is_file_record_in_csv(shared.CONFIG.stats.zxcvbn_recovered_csv_file, "file_name", file)):
-        zxcvbn_recovered_to_csv(file, recovered, guesses_log10)
+    if (exp.config.stats.zxcvbn_recovered and
+        not is_file_record_in_csv(exp, exp.config.stats.zxcvbn_recovered_csv_file, "file_name", file)):
+        zxcvbn_recovered_to_csv(exp, file, recovered, guesses_log10)
 
     # Save score statistics to CSV if not already logged
-    if (shared.CONFIG.stats.zxcvbn_score and
-        not is_file_record_in_csv(shared.CONFIG.stats.zxcvbn_score_csv_file, "file_name", file)):
-        zxcvbn_score_to_csv(file, recovered, score)
+    if (exp.config.stats.zxcvbn_score and
+        not is_file_record_in_csv(exp, exp.config.stats.zxcvbn_score_csv_file, "file_name", file)):
+        zxcvbn_score_to_csv(exp, file, recovered, score)
 
-    log_command(cmd, "done", recovered_line=recovered, guesses_log10=guesses_log10, score=score)
+    log_command(exp, cmd, "done", recovered_line=recovered, guesses_log10=guesses_log10, score=score)
 
-    if os.path.exists(shared.RECOVERED_FILE):
-        os.remove(shared.RECOVERED_FILE)
+    if recovered_file and os.path.exists(recovered_file):
+        os.remove(recovered_file)
 
 
-def zxcvbn_for_target():
-    """Runs zxcvbn analysis for all target files in the shared.TARGET_LIST."""
-    for t in shared.TARGET_LIST:
-     
-        if (not is_file_record_in_csv(shared.CONFIG.stats.zxcvbn_recovered_csv_file, "file_name", t)
-            or not is_file_record_in_csv(shared.CONFIG.stats.zxcvbn_score_csv_file, "file_name", t)):
-            run_zxcvbn(f"zcvbn T:{t}", t)
+def zxcvbn_for_target(exp):
+    """Runs zxcvbn analysis for all target files in the exp.target_list."""
+    metrics.jobs_queued("zxcvbn_targets", len(exp.target_list))
+    for t in exp.target_list:
+        with metrics.job("zxcvbn_targets"):
+            if (not is_file_record_in_csv(exp, exp.config.stats.zxcvbn_recovered_csv_file, "file_name", t)
+                or not is_file_record_in_csv(exp, exp.config.stats.zxcvbn_score_csv_file, "file_name", t)):
+                run_zxcvbn(exp, f"zcvbn T:{t}", t)